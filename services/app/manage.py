@@ -1,22 +1,25 @@
 import os
+import time
 import subprocess
 import datetime
 import random
 import requests
 
 import click
-from sqlalchemy import exc
+from sqlalchemy import event, exc
 from flask.cli import FlaskGroup
 
 from src import create_app, db
-from src.utils.perms import set_model_perms
+from src.utils.perms import apply_manifest, PERMISSIONS
+from src.utils.hashing import calibrate
+from src.utils.counters import counters, reconcile
+from src.utils.timeline import timeline
+from src.utils.permissions import permission_sets
 from src.blueprints.auth.models import User
 from src.blueprints.profiles.models import Profile
 from src.blueprints.posts.models import Post, Comment
 from src.blueprints.admin.models import Group
 from src.blueprints.admin.models import Permission
-from src.blueprints.admin.models import grp_members, grp_perms
-from src.blueprints.auth.models import user_perms
 
 app = create_app()
 cli = FlaskGroup(create_app=create_app)
@@ -99,6 +102,296 @@ def test(path):
     return subprocess.call(cmd, shell=True)
 
 
+@cli.command()
+@click.option(
+    "--target-ms",
+    default=250,
+    help="Target time to hash a password, in milliseconds."
+)
+@click.option("--rounds", default=5, help="Timed hashes per measurement.")
+def tune_password_hash(target_ms, rounds):
+    """
+    Benchmark PBKDF2 on this host and pick the iterations that hash a
+    password in about the target time.
+
+    :param target_ms: Target latency in milliseconds
+    :param rounds: Timed hashes per measurement
+    """
+    method, elapsed = calibrate(target_ms / 1000, rounds=rounds)
+
+    print(f'{method} hashes a password in {elapsed * 1000:.0f}ms.')
+    print(f'Set PASSWORD_HASH_METHOD={method} to use it, existing '
+          'hashes are upgraded as their users log in.')
+
+
+@cli.command()
+@click.option("--rounds", default=1000, help="Checks per measurement.")
+@click.argument("perms", nargs=-1)
+def bench_permissions(rounds, perms):
+    """
+    Time the check permission_required runs on every admin request, for
+    a user without the admin flag, with a cold and a warm permission set.
+
+    :param rounds: Checks per measurement
+    :param perms: Permission code names to check, can_view_users by default
+    """
+    perms = list(perms) or ['can_view_users']
+    queries = []
+
+    def count_query(*args):
+        queries.append(1)
+
+    with app.app_context():
+        user = User.query.filter(User.is_admin.is_(False)).first()
+
+        if user is None:
+            print('Error: seed some users first.')
+            return
+
+        engine = db.get_engine(app)
+        event.listen(engine, 'before_cursor_execute', count_query)
+
+        try:
+            for label, cold in (('cold', True), ('warm', False)):
+                user.has_permissions(perms)
+                del queries[:]
+                start = time.perf_counter()
+
+                for _ in range(rounds):
+                    if cold:
+                        permission_sets.invalidate()
+
+                    user.has_permissions(perms)
+
+                elapsed = (time.perf_counter() - start) / rounds
+                print(f'{label}: {elapsed * 1e6:.1f}us and '
+                      f'{len(queries) / rounds:.2f} queries per request')
+        finally:
+            event.remove(engine, 'before_cursor_execute', count_query)
+
+
+@cli.command()
+@click.option("--users", default=2000, help="Synthetic users.")
+@click.option("--follows", default=50, help="Users followed per user.")
+@click.option("--posts", default=500, help="Posts written per threshold.")
+@click.option("--reads", default=200, help="Timelines read per threshold.")
+@click.option(
+    "--thresholds",
+    default="10,100,1000,100000",
+    help="Comma separated TIMELINE_FANOUT_LIMIT values to compare."
+)
+def bench_feed(users, follows, posts, reads, thresholds):
+    """
+    Compare write amplification and home timeline read latency across
+    fan-out thresholds, on a synthetic graph where who gets followed is
+    Zipf distributed. Everything is rolled back at the end.
+
+    :param users: Synthetic users
+    :param follows: Users followed per user
+    :param posts: Posts written per threshold
+    :param reads: Timelines read per threshold
+    :param thresholds: Comma separated follower limits
+    """
+    from sqlalchemy import func, select
+    from src.blueprints.auth.models import followers
+    from src.blueprints.posts.models import timelines
+
+    limits = [int(limit) for limit in thresholds.split(',')]
+    user_table = User.__table__
+
+    with app.app_context():
+        session = db.session
+        fanout_limit = timeline.fanout_limit
+
+        try:
+            session.execute(user_table.insert(), [{
+                'username': f'bench_feed_{i}',
+                'email': f'bench_feed_{i}@example.com',
+                'password': '!'
+            } for i in range(users)])
+            ids = [row[0] for row in session.execute(
+                select([user_table.c.id]).where(
+                    user_table.c.username.like('bench_feed_%')
+                ).order_by(user_table.c.id))]
+
+            weights = [1 / rank for rank in range(1, users + 1)]
+            links = set()
+
+            for follower_id in ids:
+                for followed_id in random.choices(ids, weights, k=follows):
+                    if followed_id != follower_id:
+                        links.add((follower_id, followed_id))
+
+            session.execute(followers.insert(), [
+                {'follower_id': a, 'followed_id': b} for a, b in links])
+            counts = select([
+                func.count().label('n')
+            ]).where(followers.c.followed_id == user_table.c.id)
+            session.execute(user_table.update().where(
+                user_table.c.id.in_(ids)).values(
+                follower_count=counts.as_scalar()))
+
+            top = session.execute(
+                select([func.max(user_table.c.follower_count)]).where(
+                    user_table.c.id.in_(ids))).scalar()
+            print(f'{users} users, {len(links)} follows, '
+                  f'most followed has {top} followers.')
+
+            for limit in limits:
+                timeline.fanout_limit = limit
+                savepoint = session.begin_nested()
+
+                try:
+                    before = session.execute(
+                        select([func.count()]).select_from(
+                            timelines)).scalar()
+                    start = time.perf_counter()
+
+                    for _ in range(posts):
+                        post = Post(body='bench', user_id=random.choice(ids))
+                        session.add(post)
+                        session.flush()
+
+                    write = (time.perf_counter() - start) / posts
+                    written = session.execute(
+                        select([func.count()]).select_from(
+                            timelines)).scalar() - before
+
+                    start = time.perf_counter()
+
+                    for _ in range(reads):
+                        timeline.read(random.choice(ids), 20)
+
+                    read = (time.perf_counter() - start) / reads
+                    print(f'limit {limit}: {written / posts:.1f} rows and '
+                          f'{write * 1000:.2f}ms per post, '
+                          f'{read * 1000:.2f}ms per read')
+                finally:
+                    savepoint.rollback()
+        finally:
+            timeline.fanout_limit = fanout_limit
+            session.rollback()
+
+
+@cli.command()
+@click.option("--count", default=1000, help="Objects dumped per round.")
+@click.option("--rounds", default=20, help="Timed rounds per serializer.")
+def bench_serializers(count, rounds):
+    """
+    Compare marshmallow's dump with the compiled fast_dump on the feed
+    and follower page schemas, with objects built in memory so only the
+    serialization is timed.
+
+    :param count: Objects dumped per round
+    :param rounds: Timed rounds per serializer
+    """
+    from src.utils.serializers import fast_dump
+    from src.blueprints.users.schema import UserSchema
+    from src.blueprints.posts.schema import PostSchema
+
+    now = datetime.datetime.utcnow()
+    users = [User(
+        id=i,
+        username=f'bench_{i}',
+        email=f'bench_{i}@example.com',
+        created_on=now,
+        follower_count=i,
+        following_count=i,
+        post_count=i,
+        profile=Profile(name=f'Bench {i}', bio='bio', created_on=now)
+    ) for i in range(count)]
+    posts = [Post(
+        id=i,
+        body='bench',
+        created_on=now,
+        updated_on=now,
+        like_count=i,
+        comment_count=0,
+        author=users[i]
+    ) for i in range(count)]
+    context = {'user': users[0], 'liked': set(), 'followed': set()}
+    cases = [
+        ('PostSchema', PostSchema(many=True, context=context), posts),
+        ('UserSchema(only=...)', UserSchema(
+            many=True,
+            only=('id', 'username', 'profile', 'followed_by_me',),
+            context=context
+        ), users),
+    ]
+
+    with app.app_context():
+        for name, schema, items in cases:
+            assert fast_dump(schema, items) == schema.dump(items)
+            timings = {}
+
+            for label, dump in (
+                    ('marshmallow', schema.dump),
+                    ('fast_dump', lambda items: fast_dump(schema, items))):
+                start = time.perf_counter()
+
+                for _ in range(rounds):
+                    dump(items)
+
+                timings[label] = (time.perf_counter() - start) / rounds
+
+            slow, fast = timings['marshmallow'], timings['fast_dump']
+            print(f'{name}: marshmallow {slow * 1000:.1f}ms, fast_dump '
+                  f'{fast * 1000:.1f}ms per {count} objects, '
+                  f'{slow / fast:.1f}x faster')
+
+
+@cli.command()
+@click.option("--chunk", default=1000, help="Rows per transaction.")
+def reconcile_counters(chunk):
+    """
+    Recompute the denormalized follower, following, post, like and
+    comment counters and fix the ones that drifted.
+
+    :param chunk: Rows updated per transaction
+    """
+    with app.app_context():
+        for table, counter, key in counters():
+            fixed = reconcile(table, counter, key, chunk=chunk)
+            print(f'{table.name}.{counter}: {fixed} fixed')
+
+
+@cli.command()
+@click.option("--chunk", default=1000, help="Users per transaction.")
+def trim_timelines(chunk):
+    """
+    Drop the home timeline entries past TIMELINE_LENGTH, run it
+    periodically.
+
+    :param chunk: Users trimmed per transaction
+    """
+    with app.app_context():
+        print(f'{timeline.trim_all(chunk=chunk)} entries trimmed')
+
+
+@cli.command()
+@click.option("--chunk", default=100, help="Users per transaction.")
+def backfill_timelines(chunk):
+    """
+    Fill the home timelines from the existing follows and posts.
+
+    :param chunk: Users filled per transaction
+    """
+    with app.app_context():
+        print(f'{timeline.backfill(chunk=chunk)} entries added')
+
+
+@cli.command()
+@click.option("--chunk", default=1000, help="Threads per transaction.")
+def backfill_comment_paths(chunk):
+    """
+    Set the thread paths, depths and reply counts of existing comments.
+
+    :param chunk: Top-level comments per transaction
+    """
+    with app.app_context():
+        print(f'{Comment.backfill_paths(chunk=chunk)} comments fixed')
+
+
 @cli.command()
 def db_init():
     """Initialize the database."""
@@ -106,12 +399,7 @@ def db_init():
     db.create_all()
     db.session.commit()
 
-    set_model_perms(User)
-    set_model_perms(Profile, ['edit', 'view'])
-    set_model_perms(Group)
-    set_model_perms(grp_members, is_table=True)
-    set_model_perms(grp_perms, is_table=True)
-    set_model_perms(user_perms, is_table=True)
+    apply_manifest(PERMISSIONS)
 
     print("Database was successfully initialized...")
     return None
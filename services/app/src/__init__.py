@@ -32,6 +32,26 @@ def create_app(config=app_settings):
     migrate.init_app(app, db)
     cors.init_app(app)
 
+    # set up in-process services
+    from src.utils.cache import principals, auth_versions
+    from src.utils.hashing import hasher
+    from src.utils.activity import activity
+    from src.utils.bloom import identities
+    from src.utils.revocation import revocations
+    from src.utils.permissions import permission_sets, permission_registry
+    from src.utils.timeline import timeline
+    from src.utils.counters import like_counts
+    principals.init_app(app, 'PRINCIPAL_CACHE')
+    auth_versions.init_app(app, 'AUTH_VERSION_CACHE')
+    hasher.init_app(app)
+    activity.init_app(app)
+    identities.init_app(app)
+    revocations.init_app(app)
+    permission_sets.init_app(app)
+    permission_registry.init_app(app)
+    timeline.init_app(app)
+    like_counts.init_app(app, 'LIKE_COUNT')
+
     @app.route('/api/ping')
     def ping():
         return {"message": "Ping!"}
@@ -1,5 +1,10 @@
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+
 from src import db
-from src.utils.models import ResourceMixin
+from src.utils.models import ResourceMixin, ids_of, link, unlink, \
+    sync_links
+from src.utils.permissions import permission_sets, permission_registry
 
 
 grp_members = db.Table(
@@ -15,7 +20,9 @@ grp_members = db.Table(
         db.Integer,
         db.ForeignKey('users.id', ondelete='CASCADE', onupdate='CASCADE'),
         primary_key=True
-    )
+    ),
+    # The primary key only covers lookups by group
+    db.Index('ix_group_members_user_id', 'user_id')
 )
 
 
@@ -47,6 +54,9 @@ class Group(db.Model, ResourceMixin):
     name = db.Column(db.String(32), unique=True, index=True, nullable=False)
     description = db.Column(db.String(250))
 
+    # Keyset pagination
+    __table_args__ = (db.Index('ix_groups_created_on', 'created_on', 'id'),)
+
     # relationships
     members = db.relationship(
         'User',
@@ -60,6 +70,12 @@ class Group(db.Model, ResourceMixin):
         backref=db.backref('groups', lazy='dynamic'),
         lazy='dynamic'
     )
+    # Plain list twins of the dynamic relationships, see eager_options
+    member_list = db.relationship(
+        'User', secondary=grp_members, viewonly=True, order_by='User.id')
+    permission_list = db.relationship(
+        'Permission', secondary=grp_perms, viewonly=True,
+        order_by='Permission.id')
 
     def __init__(self, **kwargs):
         super(Group, self).__init__(**kwargs)
@@ -77,33 +93,77 @@ class Group(db.Model, ResourceMixin):
         return self.members.filter(
             grp_members.c.user_id == user.id).count() > 0
 
+    def _change_links(self, change, table, items):
+        ids = ids_of(items)
+
+        if self.id is None:
+            db.session.add(self)
+            db.session.flush()
+
+        permission_sets.invalidate_on_commit(db.session)
+        result = change(table, 'group_id', self.id, ids)
+        db.session.commit()
+
+        return result
+
     def add_members(self, members):
-        for member in members:
-            if not self.is_group_member(member):
-                self.members.append(member)
-                self.save()
+        """
+        Add users to the group in one statement.
+
+        :param members: Users or user ids
+        :return dict: Counts of added, unchanged and not found users
+        """
+        return self._change_links(link, grp_members, members)
 
     def remove_members(self, members):
-        for member in members:
-            if self.is_group_member(member):
-                self.members.remove(member)
-                self.save()
+        """
+        Remove users from the group in one statement.
+
+        :param members: Users or user ids
+        :return dict: Counts of removed and unchanged users
+        """
+        return self._change_links(unlink, grp_members, members)
+
+    def set_members(self, members):
+        """
+        Make the group's members exactly the given users.
+
+        :param members: Users or user ids
+        :return dict: Counts of added, removed, unchanged and not found users
+        """
+        return self._change_links(sync_links, grp_members, members)
 
     def has_perm(self, perm):
         return self.permissions.filter(
             grp_perms.c.perm_id == perm.id).count() > 0
 
     def add_permissions(self, perms):
-        for perm in perms:
-            if not self.has_perm(perm):
-                self.permissions.append(perm)
-                self.save()
+        """
+        Grant permissions to the group in one statement.
+
+        :param perms: Permissions or permission ids
+        :return dict: Counts of added, unchanged and not found permissions
+        """
+        return self._change_links(link, grp_perms, perms)
 
     def remove_permissions(self, perms):
-        for perm in perms:
-            if self.has_perm(perm):
-                self.permissions.remove(perm)
-                self.save()
+        """
+        Revoke permissions from the group in one statement.
+
+        :param perms: Permissions or permission ids
+        :return dict: Counts of removed and unchanged permissions
+        """
+        return self._change_links(unlink, grp_perms, perms)
+
+    def set_permissions(self, perms):
+        """
+        Make the group's permissions exactly the given permissions.
+
+        :param perms: Permissions or permission ids
+        :return dict: Counts of added, removed, unchanged and not found
+        permissions
+        """
+        return self._change_links(sync_links, grp_perms, perms)
 
 
 class Permission(db.Model, ResourceMixin):
@@ -135,11 +195,40 @@ class Permission(db.Model, ResourceMixin):
     def set_code_name(cls, name):
         return name.strip(',. ').replace(' ', '_').lower()
 
+    @classmethod
+    def find_by_id(cls, id):
+        perm_id = int(id)
+
+        if permission_registry.loaded:
+            return permission_registry.get(perm_id)
+
+        return super(Permission, cls).find_by_id(perm_id)
+
     @classmethod
     def find_by_name(cls, code_name):
+        perm_id = permission_registry.id_for(code_name)
+
+        if permission_registry.loaded:
+            return permission_registry.get(perm_id)
+
         return cls.query.filter((cls.code_name == code_name)).first()
 
 
+@event.listens_for(Group, 'after_delete')
+@event.listens_for(Permission, 'after_delete')
+def invalidate_permission_sets(mapper, connection, target):
+    """Deleted groups and permissions no longer grant anything"""
+    permission_sets.invalidate_on_commit(object_session(target))
+
+
+@event.listens_for(Permission, 'after_insert')
+@event.listens_for(Permission, 'after_update')
+@event.listens_for(Permission, 'after_delete')
+def reload_permission_registry(mapper, connection, target):
+    """Reload the permission registry once the change is committed"""
+    permission_registry.invalidate_on_commit(object_session(target))
+
+
 class Model(db.Model, ResourceMixin):
     __tablename__ = 'models'
 
@@ -3,46 +3,71 @@ from sqlalchemy import exc
 from flask import request, url_for, jsonify, current_app
 
 from src import db
+from src.utils.decorators import authenticate, permission_required
+from src.utils.pagination import paginate
+from src.utils.loading import eager_options
+from src.utils.serializers import fast_dump
+from src.utils.fieldsets import sparse
 from src.blueprints.errors import error_response, \
     bad_request, server_error, not_found
 from src.blueprints.admin.routes import admin
-from src.blueprints.auth.models import User
-from src.blueprints.admin.models import Group, Permission
+from src.blueprints.admin.models import Group
 from src.blueprints.admin.schema import GroupSchema
 
 
 @admin.route('/groups/page/<int:page>', methods=['GET'])
 @admin.route('/groups', methods=['GET'])
-# @permission_required(['can_view_Group'])
-def get_groups(page=1):
+@authenticate
+@permission_required(['can_view_groups'])
+def get_groups(current_user, page=1):
     """Get list of groups"""
-    groups = Group.query.paginate(
-        page, current_app.config['ITEMS_PER_PAGE'], False)
-    next_url = url_for('admin.get_groups', page=groups.next_num) \
-        if groups.has_next else None
-    prev_url = url_for('admin.get_groups', page=groups.prev_num) \
-        if groups.has_prev else None
+    cursor = request.args.get('cursor')
+    schema = sparse(GroupSchema, many=True)
+    groups = paginate(
+        Group.query.options(*eager_options(Group, schema)),
+        (Group.created_on, Group.id),
+        current_app.config['ITEMS_PER_PAGE'],
+        page=page,
+        cursor=cursor,
+        descending=False)
+
+    # Page number links until clients move over to cursors
+    if cursor:
+        next_url = url_for('admin.get_groups', cursor=groups.next) \
+            if groups.has_next else None
+        prev_url = url_for('admin.get_groups', cursor=groups.prev) \
+            if groups.has_prev else None
+    else:
+        next_url = url_for('admin.get_groups', page=page + 1) \
+            if groups.has_next else None
+        prev_url = url_for('admin.get_groups', page=page - 1) \
+            if groups.has_prev else None
 
     return {
-        'items': GroupSchema(many=True).dump(groups.items),
+        'items': fast_dump(schema, groups.items),
         'next_url': next_url,
-        'prev_url': prev_url
+        'prev_url': prev_url,
+        'next': groups.next,
+        'prev': groups.prev,
     }
 
 
 @admin.route('/groups/<int:id>', methods=['GET'])
-# @permission_required(['can_view_user'])
-def get_group(id):
+@authenticate
+@permission_required(['can_view_groups'])
+def get_group(current_user, id):
     """Get a single group"""
-    group = Group.find_by_id(id)
+    schema = sparse(GroupSchema)
+    group = Group.query.options(*eager_options(Group, schema)).get(id)
     if group is None:
         return not_found('Group not found!')
-    return jsonify(GroupSchema().dump(group))
+    return jsonify(schema.dump(group))
 
 
 @admin.route('/groups', methods=['POST'])
-# @permission_required(['can_view_user'])
-def add_group():
+@authenticate
+@permission_required(['can_add_groups'])
+def add_group(current_user):
     request_data = request.get_json()
 
     if not request_data:
@@ -77,8 +102,9 @@ def add_group():
 
 
 @admin.route('/groups/<int:id>', methods=['PUT'])
-# @permission_required(['can_view_user'])
-def update_group(id):
+@authenticate
+@permission_required(['can_edit_groups'])
+def update_group(current_user, id):
     request_data = request.get_json()
 
     if not request_data:
@@ -110,8 +136,9 @@ def update_group(id):
 
 
 @admin.route('/groups/<int:id>', methods=['DELETE'])
-# @permission_required(['can_delete_user'])
-def delete_group(id):
+@authenticate
+@permission_required(['can_delete_groups'])
+def delete_group(current_user, id):
     try:
         group = Group.find_by_id(id)
 
@@ -125,60 +152,76 @@ def delete_group(id):
 
 
 @admin.route('/groups/<int:grp_id>/members', methods=['PUT'])
-# @permission_required(['can_delete_user'])
-def add_group_members(grp_id):
-    data = request.get_json()
-    group = Group.find_by_id(grp_id)
-
-    users = []
-    for id in data.get('users'):
-        user = User.find_by_id(id)
-        users.append(user)
-
-    group.add_members(users)
-    return jsonify(GroupSchema().dump(group))
+@authenticate
+@permission_required(['can_edit_groups'])
+def add_group_members(current_user, grp_id):
+    return change_group(grp_id, Group.add_members, 'users', 'user')
 
 
 @admin.route('/groups/<int:grp_id>/members', methods=['DELETE'])
-# @permission_required(['can_delete_user'])
-def remove_group_members(grp_id):
-    data = request.get_json()
-    group = Group.find_by_id(grp_id)
+@authenticate
+@permission_required(['can_edit_groups'])
+def remove_group_members(current_user, grp_id):
+    return change_group(grp_id, Group.remove_members, 'users', 'user')
 
-    users = []
-    for id in data.get('users'):
-        user = User.find_by_id(id)
-        users.append(user)
 
-    group.remove_members(users)
-    return jsonify(GroupSchema().dump(group))
+@admin.route('/groups/<int:grp_id>/members', methods=['PATCH'])
+@authenticate
+@permission_required(['can_edit_groups'])
+def set_group_members(current_user, grp_id):
+    """Make the group's members exactly the given users"""
+    return change_group(grp_id, Group.set_members, 'users', 'user')
 
 
 @admin.route('/groups/<int:grp_id>/permissions', methods=['PUT'])
-# @permission_required(['can_delete_user'])
-def add_group_permissions(grp_id):
-    data = request.get_json()
-    group = Group.find_by_id(grp_id)
-
-    perms = []
-    for id in data.get('perms'):
-        perm = Permission.find_by_id(id)
-        perms.append(perm)
-
-    group.add_permissions(perms)
-    return jsonify(GroupSchema().dump(group))
+@authenticate
+@permission_required(['can_edit_groups'])
+def add_group_permissions(current_user, grp_id):
+    return change_group(
+        grp_id, Group.add_permissions, 'perms', 'permission')
 
 
 @admin.route('/groups/<int:grp_id>/permissions', methods=['DELETE'])
-# @permission_required(['can_delete_perms'])
-def remove_group_permissions(grp_id):
+@authenticate
+@permission_required(['can_edit_groups'])
+def remove_group_permissions(current_user, grp_id):
+    return change_group(
+        grp_id, Group.remove_permissions, 'perms', 'permission')
+
+
+@admin.route('/groups/<int:grp_id>/permissions', methods=['PATCH'])
+@authenticate
+@permission_required(['can_edit_groups'])
+def set_group_permissions(current_user, grp_id):
+    """Make the group's permissions exactly the given permissions"""
+    return change_group(
+        grp_id, Group.set_permissions, 'perms', 'permission')
+
+
+def change_group(grp_id, change, key, label):
+    """
+    Apply a membership or permission change with the ids in the request.
+
+    :param grp_id: Group id
+    :param change: Group method to apply, e.g. Group.add_members
+    :param key: Request key holding the ids
+    :param label: Name of the items, for error messages
+    :return: The group, with counts of the rows changed
+    """
     data = request.get_json()
+
+    if not data or not isinstance(data.get(key), list):
+        return bad_request(f'No {label} ids provided.')
+
     group = Group.find_by_id(grp_id)
 
-    perms = []
-    for id in data.get('perms'):
-        perm = Permission.find_by_id(id)
-        perms.append(perm)
+    if group is None:
+        return not_found('Group not found!')
+
+    try:
+        result = change(group, data.get(key))
+    except (exc.IntegrityError, ValueError, TypeError):
+        db.session.rollback()
+        return bad_request(f'Invalid {label} ids.')
 
-    group.remove_permissions(perms)
-    return jsonify(GroupSchema().dump(group))
+    return jsonify(dict(GroupSchema().dump(group), **result))
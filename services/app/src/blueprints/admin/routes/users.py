@@ -3,12 +3,17 @@ from flask import jsonify, request, url_for, current_app
 from marshmallow import ValidationError
 
 from src import db
+from src.utils.hashing import hasher, HashingPoolBusy
+from src.utils.decorators import authenticate, permission_required
+from src.utils.pagination import paginate
+from src.utils.loading import eager_options
+from src.utils.serializers import fast_dump
+from src.utils.fieldsets import sparse
 from src.blueprints.errors import error_response, \
-    bad_request, not_found, server_error
+    bad_request, not_found, server_error, service_unavailable
 from src.blueprints.admin.routes import admin
 from src.blueprints.auth.models import User
 from src.blueprints.profiles.models import Profile
-from src.blueprints.admin.models import Permission
 from src.blueprints.auth.schema import AuthSchema
 from src.blueprints.users.schema import UserSchema
 from src.blueprints.profiles.schema import ProfileSchema
@@ -16,36 +21,57 @@ from src.blueprints.profiles.schema import ProfileSchema
 
 @admin.route('/users/page/<int:page>', methods=['GET'])
 @admin.route('/users', methods=['GET'])
-# @permission_required(['can_view_user'])
-def get_users(page=1):
+@authenticate
+@permission_required(['can_view_users'])
+def get_users(current_user, page=1):
     """Get list of users"""
-    users = User.query.paginate(
-        page, current_app.config['ITEMS_PER_PAGE'], False)
-    next_url = url_for('admin.get_users', page=users.next_num) \
-        if users.has_next else None
-    prev_url = url_for('admin.get_users', page=users.prev_num) \
-        if users.has_prev else None
+    cursor = request.args.get('cursor')
+    schema = sparse(UserSchema, many=True)
+    users = paginate(
+        User.query.options(*eager_options(User, schema)),
+        (User.created_on, User.id),
+        current_app.config['ITEMS_PER_PAGE'],
+        page=page,
+        cursor=cursor,
+        descending=False)
+
+    # Page number links until clients move over to cursors
+    if cursor:
+        next_url = url_for('admin.get_users', cursor=users.next) \
+            if users.has_next else None
+        prev_url = url_for('admin.get_users', cursor=users.prev) \
+            if users.has_prev else None
+    else:
+        next_url = url_for('admin.get_users', page=page + 1) \
+            if users.has_next else None
+        prev_url = url_for('admin.get_users', page=page - 1) \
+            if users.has_prev else None
 
     return {
-        'items': UserSchema(many=True).dump(users.items),
+        'items': fast_dump(schema, users.items),
         'next_url': next_url,
-        'prev_url': prev_url
+        'prev_url': prev_url,
+        'next': users.next,
+        'prev': users.prev,
     }
 
 
 @admin.route('/users/<int:id>', methods=['GET'])
-# @permission_required(['can_view_user'])
-def get_user(id):
+@authenticate
+@permission_required(['can_view_users'])
+def get_user(current_user, id):
     """Get a single user"""
-    user = User.find_by_id(id)
+    schema = sparse(UserSchema)
+    user = User.query.options(*eager_options(User, schema)).get(id)
     if user is None:
         return not_found('User not found!')
-    return jsonify(UserSchema().dump(user))
+    return jsonify(schema.dump(user))
 
 
 @admin.route('/users', methods=['POST'])
-# @permission_required(['can_add_user'])
-def add_user():
+@authenticate
+@permission_required(['can_add_users'])
+def add_user(current_user):
     request_data = request.get_json()
 
     if not request_data:
@@ -85,14 +111,18 @@ def add_user():
     # handle errors
     except ValidationError as err:
         return error_response(422, err.messages)
+    except HashingPoolBusy:
+        return service_unavailable(
+            'Server is busy, please try again shortly.', hasher.retry_after)
     except (exc.IntegrityError, ValueError):
         db.session.rollback()
         return server_error('Something went wrong, please try again.')
 
 
 @admin.route('/users/<int:id>', methods=['PUT'])
-# @permission_required(['can_update_user'])
-def update_user(id):
+@authenticate
+@permission_required(['can_edit_users'])
+def update_user(current_user, id):
     request_data = request.get_json()
 
     if not request_data:
@@ -128,8 +158,9 @@ def update_user(id):
 
 
 @admin.route('/users/<int:id>', methods=['DELETE'])
-# @permission_required(['can_delete_user'])
-def delete_user(id):
+@authenticate
+@permission_required(['can_delete_users'])
+def delete_user(current_user, id):
     try:
         user = User.find_by_id(id)
 
@@ -143,30 +174,49 @@ def delete_user(id):
 
 
 @admin.route('/users/<int:id>/permissions', methods=['PUT'])
-# @permission_required(['can_delete_user'])
-def add_user_permissions(id):
-    data = request.get_json()
-    user = User.find_by_id(id)
+@authenticate
+@permission_required(['can_edit_users'])
+def add_user_permissions(current_user, id):
+    return change_user_permissions(id, User.add_permissions)
+
 
-    perms = []
-    for id in data.get('perms'):
-        perm = Permission.find_by_id(id)
-        perms.append(perm)
+@admin.route('/users/<int:id>/permissions', methods=['DELETE'])
+@authenticate
+@permission_required(['can_edit_users'])
+def remove_user_permissions(current_user, id):
+    return change_user_permissions(id, User.remove_permissions)
 
-    user.add_permissions(perms)
-    return jsonify(UserSchema().dump(user))
 
+@admin.route('/users/<int:id>/permissions', methods=['PATCH'])
+@authenticate
+@permission_required(['can_edit_users'])
+def set_user_permissions(current_user, id):
+    """Make the user's own permissions exactly the given permissions"""
+    return change_user_permissions(id, User.set_permissions)
 
-@admin.route('/users/<int:id>/permissions', methods=['DELETE'])
-# @permission_required(['can_delete_user'])
-def remove_user_permissions(id):
+
+def change_user_permissions(id, change):
+    """
+    Apply a permission change with the ids in the request.
+
+    :param id: User id
+    :param change: User method to apply, e.g. User.add_permissions
+    :return: The user, with counts of the rows changed
+    """
     data = request.get_json()
+
+    if not data or not isinstance(data.get('perms'), list):
+        return bad_request('No permission ids provided.')
+
     user = User.find_by_id(id)
 
-    perms = []
-    for id in data.get('perms'):
-        perm = Permission.find_by_id(id)
-        perms.append(perm)
+    if user is None:
+        return not_found('User not found!')
+
+    try:
+        result = change(user, data.get('perms'))
+    except (exc.IntegrityError, ValueError, TypeError):
+        db.session.rollback()
+        return bad_request('Invalid permission ids.')
 
-    user.remove_permissions(perms)
-    return jsonify(UserSchema().dump(user))
+    return jsonify(dict(UserSchema().dump(user), **result))
@@ -14,8 +14,9 @@ class GroupSchema(Schema):
     )
     # relationships
     members = fields.Nested('UserSchema', only=(
-        'id', 'username', 'email',), many=True)
-    permissions = fields.Nested('PermissionSchema', many=True)
+        'id', 'username', 'email',), many=True, attribute='member_list')
+    permissions = fields.Nested(
+        'PermissionSchema', many=True, attribute='permission_list')
 
     @validates('name')
     def validate_name(self, name):
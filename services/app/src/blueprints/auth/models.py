@@ -1,12 +1,23 @@
 from datetime import datetime, timedelta
+from uuid import uuid4
 import jwt
 
+from sqlalchemy import event, exc, inspect, select, union
+from sqlalchemy.orm import Session, make_transient_to_detached, \
+    object_session
 from flask import current_app
-from werkzeug.security import generate_password_hash, check_password_hash
 
 from src import db
-from src.utils.models import ResourceMixin
-from src.blueprints.admin.models import Permission
+from src.utils.models import ResourceMixin, ids_of, link, unlink, \
+    sync_links
+from src.utils.cache import principals, auth_versions, delete_on_commit
+from src.utils.hashing import hasher, HashingPoolBusy
+from src.utils.activity import activity
+from src.utils.timeline import timeline
+from src.utils.counters import increment, release
+from src.utils.revocation import utc_now
+from src.utils.permissions import permission_sets, permission_registry
+from src.blueprints.admin.models import Permission, grp_members, grp_perms
 
 
 user_perms = db.Table(
@@ -42,10 +53,29 @@ followers = db.Table(
         'followed_id',
         db.Integer,
         db.ForeignKey('users.id', ondelete='CASCADE', onupdate='CASCADE'),
-        primary_key=True)
+        primary_key=True),
+    # The primary key only covers lookups by follower
+    db.Index('ix_followers_followed_id', 'followed_id')
 )
 
 
+revoked_tokens = db.Table(
+    'revoked_tokens',
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('jti', db.String(32), unique=True, nullable=False),
+    db.Column('expires_on', db.DateTime, index=True, nullable=False),
+    # Stamped by the database, workers sync by it, see RevocationList
+    db.Column('created_on', db.DateTime, index=True, nullable=False,
+              server_default=utc_now())
+)
+
+
+# Stamped on every new or changed username/email. A sequence takes no
+# row lock, so generations can commit out of order, see IdentityFilter.
+identity_generation = db.Sequence(
+    'identity_generation_seq', metadata=db.Model.metadata)
+
+
 class User(db.Model, ResourceMixin):
     __tablename__ = 'users'
 
@@ -64,10 +94,35 @@ class User(db.Model, ResourceMixin):
         nullable=False
     )
     password = db.Column(db.String(128), nullable=False)
+    identity_gen = db.Column(
+        db.BigInteger,
+        index=True,
+        nullable=False,
+        default=0,
+        server_default='0'
+    )
 
     # Authorization
     is_active = db.Column(db.Boolean(), default=True, nullable=False)
     is_admin = db.Column(db.Boolean(), default=False, nullable=False)
+    auth_version = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0')
+
+    # Counters, see src.utils.counters
+    follower_count = db.Column(
+        db.Integer,
+        index=True,
+        nullable=False,
+        default=0,
+        server_default='0'
+    )
+    following_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0')
+    post_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0')
+
+    # Keyset pagination
+    __table_args__ = (db.Index('ix_users_created_on', 'created_on', 'id'),)
 
     # Activity tracking.
     sign_in_count = db.Column(db.Integer, nullable=False, default=0)
@@ -94,6 +149,21 @@ class User(db.Model, ResourceMixin):
     )
     posts = db.relationship('Post', backref='author')
     comments = db.relationship('Comment', backref='author')
+    # Plain list twins of the dynamic relationships, which can't be
+    # loaded ahead, for dumping pages of users, see eager_options
+    permission_list = db.relationship(
+        'Permission', secondary=user_perms, viewonly=True,
+        order_by='Permission.id')
+    follower_list = db.relationship(
+        'User', secondary='followers', viewonly=True, order_by='User.id',
+        primaryjoin=(followers.c.followed_id == id),
+        secondaryjoin=(followers.c.follower_id == id)
+    )
+    followed_list = db.relationship(
+        'User', secondary='followers', viewonly=True, order_by='User.id',
+        primaryjoin=(followers.c.follower_id == id),
+        secondaryjoin=(followers.c.followed_id == id)
+    )
 
     def __init__(self, **kwargs):
         super(User, self).__init__(**kwargs)
@@ -103,31 +173,41 @@ class User(db.Model, ResourceMixin):
         return f'<User {self.username}>'
 
     @classmethod
-    def find_by_identity(cls, identity):
+    def find_by_identity(cls, identity, options=()):
         """
         Find a user by their identity.
 
         :param: user identity - email or username
+        :param options: Loader options, see eager_options
         :return: User instance
         """
-        return cls.query.filter(
+        return cls.query.options(*options).filter(
             (cls.email == identity) | (cls.username == identity)
         ).first()
 
     @classmethod
     def hash_password(cls, password):
         """
-        Hash a plaintext string using PBKDF2.
+        Hash a plaintext string using PBKDF2, in the hashing pool.
 
         :param password: Password in plain text
         :type password: str
         :return: str
         """
         if password:
-            return generate_password_hash(password)
+            return hasher.generate(password)
 
         return None
 
+    def set_password(self, password):
+        """
+        Set a new password, invalidating the tokens issued so far.
+
+        :param password: Password in plain text
+        """
+        self.password = User.hash_password(password)
+        self.bump_auth_version()
+
     def check_password(self, password):
         """
         Check if the provided password matches that of the specified user.
@@ -135,7 +215,31 @@ class User(db.Model, ResourceMixin):
         :param password: Password in plain text
         :return: boolean
         """
-        return check_password_hash(self.password, password)
+        return hasher.check(self.password, password)
+
+    def upgrade_password(self, password):
+        """
+        Replace a hash made with outdated parameters by one using the
+        configured PASSWORD_HASH_METHOD. Failures keep the old hash, it is
+        upgraded on a later login.
+
+        :param password: Password in plain text, already checked
+        :return: boolean
+        """
+        if not hasher.needs_rehash(self.password):
+            return False
+
+        try:
+            self.password = hasher.generate(password)
+            self.save()
+        except HashingPoolBusy:
+            return False
+        except exc.SQLAlchemyError:
+            db.session.rollback()
+            current_app.logger.exception('Could not upgrade password hash.')
+            return False
+
+        return True
 
     def encode_auth_token(self, id):
         """Generates the auth token"""
@@ -146,8 +250,12 @@ class User(db.Model, ResourceMixin):
                     seconds=current_app.config.get('TOKEN_EXPIRATION_SECONDS')
                 ),
                 'iat': datetime.utcnow(),
+                'jti': uuid4().hex,
                 'sub': {
                     'id': id,
+                    'is_active': self.is_active,
+                    'is_admin': self.is_admin,
+                    'ver': self.auth_version or 0,
                 }
             }
             return jwt.encode(
@@ -164,7 +272,7 @@ class User(db.Model, ResourceMixin):
         Decodes the auth token
 
         :param string: token
-        :return dict: The user's identity
+        :return dict: The user's identity, with the token's jti and exp
         """
         try:
             payload = jwt.decode(
@@ -172,20 +280,62 @@ class User(db.Model, ResourceMixin):
                 current_app.config.get('SECRET_KEY'),
                 algorithms='HS256'
             )
-            return payload.get('sub')
+            return dict(
+                payload.get('sub'),
+                jti=payload.get('jti'),
+                exp=payload.get('exp')
+            )
         except jwt.ExpiredSignatureError:
             return 'Signature expired. Please log in again.'
         except jwt.InvalidTokenError:
             return 'Invalid token. Please log in again.'
 
+    @classmethod
+    def from_claims(cls, claims):
+        """
+        Build a user from verified token claims without loading its row.
+        Columns the token does not carry are loaded on first access.
+
+        :param claims: Decoded token subject
+        :return: User instance attached to the current session
+        """
+        key = cls.__mapper__.identity_key_from_primary_key([claims.get('id')])
+        user = db.session.identity_map.get(key)
+
+        if user is not None:
+            return user
+
+        user = cls.__mapper__.class_manager.new_instance()
+        user.id = claims.get('id')
+        user.is_active = claims.get('is_active')
+        user.is_admin = claims.get('is_admin')
+        user.auth_version = claims.get('ver', 0)
+        make_transient_to_detached(user)
+
+        return db.session.merge(user, load=False)
+
+    def bump_auth_version(self):
+        """
+        Invalidate every token issued to the user so far. The change is
+        applied on the next commit.
+        """
+        self.auth_version = (self.auth_version or 0) + 1
+
     def update_activity_tracking(self, ip_address):
         """
         Update various fields on the user that's
         related to meta data on their account.
 
+        With ACTIVITY_WRITE_BEHIND the sign-in is buffered and written in
+        bulk later on, see src.utils.activity.
+
         :param ip_address: str
         :return: SQLAlchemy commit results
         """
+        if current_app.config.get('ACTIVITY_WRITE_BEHIND'):
+            activity.record(self.id, ip_address)
+            return self
+
         self.sign_in_count += 1
 
         self.last_sign_in_on = self.current_sign_in_on
@@ -199,30 +349,100 @@ class User(db.Model, ResourceMixin):
     def follow(self, user):
         if not self.is_following(user):
             self.followed.append(user)
+            self.count_follow(user, 1)
+            timeline.follow(db.session, self.id, user.id)
 
     def unfollow(self, user):
         if self.is_following(user):
             self.followed.remove(user)
+            self.count_follow(user, -1)
+            timeline.unfollow(db.session, self.id, user.id)
+
+    def count_follow(self, user, delta):
+        """
+        Update the following_count of the user and the follower_count of
+        the followed user in place, in the same transaction as the follow.
+
+        :param user: Followed user
+        :param delta: 1 for a follow, -1 for an unfollow
+        """
+        users = User.__table__
+
+        # Lock the rows in id order, against two users following each
+        # other at the same time
+        for id, counter in sorted([
+                (self.id, 'following_count'), (user.id, 'follower_count')]):
+            increment(db.session, users, id, **{counter: delta})
+        db.session.expire(self, ['following_count'])
+        db.session.expire(user, ['follower_count'])
 
     def is_following(self, user):
         return self.followed.filter(
             followers.c.followed_id == user.id).count() > 0
 
+    def following_ids(self, ids):
+        """
+        Find which of some users the user follows, with one query for all
+        of them instead of an is_following per user.
+
+        :param ids: User ids
+        :return: set of the followed user ids
+        """
+        ids = set(ids)
+
+        if not ids:
+            return set()
+
+        return {id for id, in db.session.execute(
+            select([followers.c.followed_id])
+            .where(followers.c.follower_id == self.id)
+            .where(followers.c.followed_id.in_(ids)))}
+
     def user_has_perm(self, perm):
         return self.permissions.filter(
             user_perms.c.perm_id == perm.id).count() > 0
 
+    def _change_perms(self, change, perms):
+        ids = ids_of(perms)
+
+        if self.id is None:
+            db.session.add(self)
+            db.session.flush()
+
+        permission_sets.invalidate_on_commit(db.session)
+        result = change(user_perms, 'user_id', self.id, ids)
+        db.session.commit()
+
+        return result
+
     def add_permissions(self, perms):
-        for perm in perms:
-            if not self.user_has_perm(perm):
-                self.permissions.append(perm)
-                self.save()
+        """
+        Grant permissions to the user in one statement.
+
+        :param perms: Permissions or permission ids
+        :return dict: Counts of added, unchanged and not found permissions
+        """
+        return self._change_perms(link, perms)
 
     def remove_permissions(self, perms):
-        for perm in perms:
-            if self.user_has_perm(perm):
-                self.permissions.remove(perm)
-                self.save()
+        """
+        Revoke permissions from the user in one statement.
+
+        :param perms: Permissions or permission ids
+        :return dict: Counts of removed and unchanged permissions
+        """
+        return self._change_perms(unlink, perms)
+
+    def set_permissions(self, perms):
+        """
+        Make the user's own permissions exactly the given permissions,
+        group permissions are left alone.
+
+        :param perms: Permissions or permission ids
+        :return dict: Counts of added, removed, unchanged and not found
+        permissions
+        """
+        return self._change_perms(sync_links, perms)
 
     def get_perms(self):
         perms = []
@@ -232,24 +452,115 @@ class User(db.Model, ResourceMixin):
 
         return perms
 
+    @classmethod
+    def compile_perm_ids(cls, id):
+        """
+        Resolve a user's own and group permissions with a single query.
+
+        :param id: User id
+        :return: frozenset of permission ids
+        """
+        own = select([user_perms.c.perm_id]).where(
+            user_perms.c.user_id == id)
+        inherited = select([grp_perms.c.perm_id]).select_from(
+            grp_perms.join(
+                grp_members, grp_members.c.group_id == grp_perms.c.group_id)
+        ).where(grp_members.c.user_id == id)
+
+        rows = db.session.execute(union(own, inherited))
+        return frozenset(row[0] for row in rows)
+
+    def get_perm_ids(self):
+        """
+        Get the ids of the user's effective permissions, compiled once and
+        cached until memberships or permissions change.
+
+        :return: frozenset of permission ids
+        """
+        return permission_sets.get(
+            self.id, lambda: User.compile_perm_ids(self.id))
+
     def get_all_perms(self):
-        perms = []
+        perm_ids = self.get_perm_ids()
 
-        for group in self.groups:
-            for perm in group.permissions:
-                perms.append(perm)
+        if not perm_ids:
+            return []
 
-        return list(set(perms).union(set(self.get_perms())))
+        return Permission.query.filter(Permission.id.in_(perm_ids)).all()
 
     def has_permission(self, name):
-        perm = Permission.find_by_name(name)
-        return perm in self.get_all_perms()
+        return self.has_permissions([name])
 
     def has_permissions(self, perms_list):
-        perms = []
-
-        for perm in perms_list:
-            p = Permission.find_by_name(perm)
-            perms.append(p)
-
-        return set(perms).issubset(set(self.get_all_perms()))
+        perm_ids = permission_registry.ids_for(perms_list)
+
+        if not permission_registry.loaded:
+            perms = Permission.query.filter(
+                Permission.code_name.in_(perms_list)).all()
+            perm_ids = [perm.id for perm in perms]
+
+            if len(perm_ids) < len(set(perms_list)):
+                return False
+
+        return None not in perm_ids and \
+            self.get_perm_ids().issuperset(perm_ids)
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def invalidate_principal(mapper, connection, target):
+    """Drop an edited, deactivated or deleted user from the auth caches"""
+    delete_on_commit(
+        object_session(target), target.id, principals, auth_versions)
+
+
+@event.listens_for(Session, 'before_flush')
+def release_counters(session, flush_context, instances):
+    """
+    Take deleted users off the counters of the users, posts and comments
+    they followed or liked, before their rows cascade away. Their posts
+    and comments aren't deleted, they stay counted.
+    """
+    from src.blueprints.posts.models import Post, Comment, post_likes, \
+        comment_likes
+
+    users = User.__table__
+    posts = Post.__table__
+    comments = Comment.__table__
+
+    for target in session.deleted:
+        if not isinstance(target, User):
+            continue
+
+        id = target.id
+        release(session, users, 'follower_count', followers.c.followed_id,
+                followers.c.follower_id == id)
+        release(session, users, 'following_count', followers.c.follower_id,
+                followers.c.followed_id == id)
+        release(session, posts, 'like_count', post_likes.c.post_id,
+                post_likes.c.user_id == id)
+        release(session, comments, 'like_count', comment_likes.c.comment_id,
+                comment_likes.c.user_id == id)
+
+
+@event.listens_for(User, 'before_insert')
+@event.listens_for(User, 'before_update')
+def stamp_identity(mapper, connection, target):
+    """Stamp new usernames and emails with the next identity generation"""
+    state = inspect(target)
+
+    if state.has_identity and \
+            not state.attrs.username.history.has_changes() and \
+            not state.attrs.email.history.has_changes():
+        return
+
+    target.identity_gen = connection.execute(
+        select([identity_generation.next_value()])).scalar()
+
+
+@event.listens_for(User.is_active, 'set', active_history=True)
+@event.listens_for(User.is_admin, 'set', active_history=True)
+def revoke_claims(target, value, oldvalue, initiator):
+    """Tokens carry is_active and is_admin, revoke them once either is lost"""
+    if oldvalue is True and value is False:
+        target.bump_auth_version()
@@ -1,10 +1,14 @@
 from sqlalchemy import exc
 from marshmallow import ValidationError
-from flask import jsonify, request, url_for, Blueprint
+from flask import g, jsonify, request, url_for, Blueprint
 
 from src import db
 from src.utils.decorators import authenticate
-from src.blueprints.errors import error_response, bad_request, server_error
+from src.utils.hashing import hasher, HashingPoolBusy
+from src.utils.bloom import identities
+from src.utils.revocation import revocations
+from src.blueprints.errors import error_response, bad_request, \
+    server_error, service_unavailable
 from src.blueprints.auth.models import User
 from src.blueprints.profiles.models import Profile
 from src.blueprints.auth.schema import AuthSchema
@@ -22,6 +26,10 @@ def ping():
 @auth.route('/check-username', methods=['POST'])
 def check_username():
     data = request.get_json()
+
+    if not identities.might_exist(data.get('username')):
+        return {'res': True}
+
     user = User.find_by_identity(data.get('username'))
 
     if user is not None:
@@ -34,6 +42,10 @@ def check_username():
 @auth.route('/check-email', methods=['POST'])
 def check_email():
     data = request.get_json()
+
+    if not identities.might_exist(data.get('email')):
+        return {'res': True}
+
     user = User.find_by_identity(data.get('email'))
     return {'res': not isinstance(user, User)}
 
@@ -80,6 +92,9 @@ def register_user():
     # handle errors
     except ValidationError as err:
         return error_response(422, err.messages)
+    except HashingPoolBusy:
+        return service_unavailable(
+            'Server is busy, please try again shortly.', hasher.retry_after)
     except (exc.IntegrityError, ValueError):
         db.session.rollback()
         return server_error('Something went wrong, please try again.')
@@ -98,11 +113,15 @@ def login_user():
         user = User.find_by_identity(post_data.get('identity'))
 
         if user and user.check_password(post_data.get('password')):
+            user.upgrade_password(post_data.get('password'))
             user.update_activity_tracking(request.remote_addr)
 
             return jsonify({'token': user.encode_auth_token(user.id).decode()})
         else:
             return error_response(401, 'Invalid credentials.')
+    except HashingPoolBusy:
+        return service_unavailable(
+            'Server is busy, please try again shortly.', hasher.retry_after)
     except Exception:
         return server_error('Something went wrong, please try again.')
 
@@ -110,6 +129,21 @@ def login_user():
 @auth.route('/logout', methods=['GET'])
 @authenticate
 def logout_user(user):
+    """
+    Revoke the token used for this request, or with ?all=true every token
+    issued to the user so far.
+    """
+    try:
+        if request.args.get('all') == 'true':
+            user.bump_auth_version()
+            user.save()
+        else:
+            revocations.revoke(g.claims.get('jti'), g.claims.get('exp'))
+            db.session.commit()
+    except (exc.IntegrityError, ValueError):
+        db.session.rollback()
+        return server_error('Something went wrong, please try again.')
+
     return jsonify({'message': 'Successfully logged out.'})
 
 
@@ -136,7 +170,32 @@ def change_username(user):
 @auth.route('/change-password', methods=['PUT'])
 @authenticate
 def change_password(user):
-    pass
+    post_data = request.get_json()
+
+    if not post_data:
+        return bad_request("No input data provided")
+
+    try:
+        if not user.check_password(post_data.get('old_password') or ''):
+            return error_response(401, 'Invalid credentials.')
+
+        data = AuthSchema(only=('password',)).load(
+            {'password': post_data.get('new_password')})
+
+        user.set_password(data.get('password'))
+        user.save()
+
+        return jsonify({'token': user.encode_auth_token(user.id).decode()})
+
+    # handle errors
+    except ValidationError as err:
+        return error_response(422, err.messages)
+    except HashingPoolBusy:
+        return service_unavailable(
+            'Server is busy, please try again shortly.', hasher.retry_after)
+    except (exc.IntegrityError, ValueError):
+        db.session.rollback()
+        return server_error('Something went wrong, please try again.')
 
 
 @auth.route('/reset-password', methods=['GET'])
@@ -2,6 +2,8 @@ from flask import jsonify, Blueprint
 from werkzeug.http import HTTP_STATUS_CODES
 
 from src import db
+from src.utils.pagination import InvalidCursor
+from src.utils.fieldsets import InvalidFields
 
 errors = Blueprint('errors', __name__)
 
@@ -29,6 +31,13 @@ def server_error(message):
     return error_response(500, message)
 
 
+def service_unavailable(message, retry_after=None):
+    response = error_response(503, message)
+    if retry_after:
+        response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
 @errors.app_errorhandler(404)
 def not_found_error(error):
     return not_found('Not found.')
@@ -39,6 +48,16 @@ def not_allowed_error(error):
     return error_response(405, 'Method not allowed')
 
 
+@errors.app_errorhandler(InvalidCursor)
+def invalid_cursor_error(error):
+    return bad_request('Invalid cursor.')
+
+
+@errors.app_errorhandler(InvalidFields)
+def invalid_fields_error(error):
+    return bad_request('Invalid fields.')
+
+
 @errors.app_errorhandler(500)
 def internal_error(error):
     db.session.rollback()
@@ -1,5 +1,13 @@
+from datetime import datetime
+
+from sqlalchemy import cast, event, func, inspect, literal, or_, select, \
+    true
+from sqlalchemy.dialects.postgresql import insert
+
 from src import db
 from src.utils.models import ResourceMixin
+from src.utils.timeline import timeline
+from src.utils.counters import increment, like_counts
 
 
 post_likes = db.Table(
@@ -15,7 +23,10 @@ post_likes = db.Table(
         db.Integer,
         db.ForeignKey('posts.id', ondelete='CASCADE',  onupdate='CASCADE'),
         primary_key=True
-    )
+    ),
+    db.Column('created_on', db.DateTime, default=datetime.utcnow),
+    # The primary key only covers lookups by user
+    db.Index('ix_post_likes_post_id', 'post_id', 'created_on', 'user_id')
 )
 
 
@@ -32,6 +43,151 @@ comment_likes = db.Table(
         db.Integer,
         db.ForeignKey('comments.id', ondelete='CASCADE',  onupdate='CASCADE'),
         primary_key=True
+    ),
+    db.Column('created_on', db.DateTime, default=datetime.utcnow),
+    db.Index(
+        'ix_comment_likes_comment_id', 'comment_id', 'created_on', 'user_id')
+)
+
+
+def change_likes(likes, key, user_id, ids, liked):
+    """
+    Like or unlike posts or comments for a user, and count it, with a
+    single statement: an INSERT ... ON CONFLICT DO NOTHING, or a DELETE,
+    feeding an UPDATE of the counters with the rows it actually changed.
+    Repeating it changes nothing, concurrent double taps included.
+
+    With LIKE_COUNT_WRITE_BEHIND the counters aren't updated, the
+    changes are buffered in like_counts on commit instead, which keeps
+    hot rows out of the like's transaction.
+
+    :param likes: Likes table, post_likes or comment_likes
+    :param key: Name of the liked row's column, post_id or comment_id
+    :param user_id: User id
+    :param ids: Ids of the rows to like or unlike
+    :param liked: True to like, False to unlike
+    :return: dict of like counts by id, ids that don't exist are left out
+    """
+    ids = set(ids)
+
+    if not ids:
+        return {}
+
+    target = next(iter(likes.c[key].foreign_keys)).column.table
+
+    if liked:
+        changed = insert(likes).from_select(
+            ['user_id', key],
+            select([literal(user_id), target.c.id]).where(
+                target.c.id.in_(ids))
+        ).on_conflict_do_nothing().returning(likes.c[key]).cte('changed')
+    else:
+        changed = likes.delete().where(likes.c.user_id == user_id).where(
+            likes.c[key].in_(ids)).returning(likes.c[key]).cte('changed')
+
+    delta = select([func.count()]).where(
+        changed.c[key] == target.c.id).as_scalar()
+
+    if like_counts.enabled:
+        rows = db.session.execute(select([
+            target.c.id, target.c.like_count, delta
+        ]).where(target.c.id.in_(ids)))
+        counts = {}
+
+        for id, count, change in rows:
+            change = change if liked else -change
+
+            if change:
+                like_counts.add_on_commit(
+                    db.session, target, 'like_count', id, change)
+
+            counts[id] = count + change + \
+                like_counts.pending(target, 'like_count', id)
+
+        return counts
+
+    rows = db.session.execute(target.update().where(
+        target.c.id.in_(ids)
+    ).values(
+        like_count=target.c.like_count + (delta if liked else -delta),
+        updated_on=target.c.updated_on
+    ).returning(target.c.id, target.c.like_count))
+
+    return dict(rows.fetchall())
+
+
+def liked_ids(likes, key, user_id, ids):
+    """
+    Find which of some posts or comments a user liked, with one query
+    for all of them instead of an is_liked_by per row.
+
+    :param likes: Likes table, post_likes or comment_likes
+    :param key: Name of the liked row's column, post_id or comment_id
+    :param user_id: User id
+    :param ids: Ids of the rows
+    :return: set of the liked ids
+    """
+    ids = set(ids)
+
+    if not ids:
+        return set()
+
+    return {id for id, in db.session.execute(
+        select([likes.c[key]])
+        .where(likes.c.user_id == user_id)
+        .where(likes.c[key].in_(ids)))}
+
+
+def recent_likers(likes, key, ids, limit):
+    """
+    Get the latest users to like each of some posts or comments, with a
+    single lateral query over the likes index.
+
+    :param likes: Likes table, post_likes or comment_likes
+    :param key: Name of the liked row's column, post_id or comment_id
+    :param ids: Ids of the liked rows
+    :param limit: Likers per row
+    :return: dict of lists of users, newest like first, by liked row id
+    """
+    from src.blueprints.auth.models import User
+
+    ids = set(ids)
+    likers = {id: [] for id in ids}
+
+    if not ids or limit < 1:
+        return likers
+
+    target = next(iter(likes.c[key].foreign_keys)).column.table
+    liked = select([target.c.id]).where(target.c.id.in_(ids)).alias('liked')
+    recent = select([likes.c.user_id, likes.c.created_on]).where(
+        likes.c[key] == liked.c.id
+    ).order_by(likes.c.created_on.desc()).limit(limit).lateral('recent')
+
+    rows = db.session.query(liked.c.id, User).select_from(liked).join(
+        recent, true()
+    ).join(User, User.id == recent.c.user_id).order_by(
+        liked.c.id, recent.c.created_on.desc())
+
+    for id, user in rows:
+        likers[id].append(user)
+
+    return likers
+
+
+# Precomputed home timelines, see src.utils.timeline
+timelines = db.Table(
+    'timelines',
+    db.Column(
+        'user_id',
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE', onupdate='CASCADE'),
+        primary_key=True
+    ),
+    db.Column(
+        'post_id',
+        db.Integer,
+        db.ForeignKey('posts.id', ondelete='CASCADE', onupdate='CASCADE'),
+        primary_key=True
     )
 )
 
@@ -45,6 +201,15 @@ class Post(db.Model, ResourceMixin):
     user_id = db.Column(
         db.Integer,
         db.ForeignKey('users.id', ondelete='CASCADE', onupdate='CASCADE'))
+    # Pushed to the followers' timelines, or merged in when they're read
+    fanned_out = db.Column(
+        db.Boolean(), nullable=False, default=True,
+        server_default=true())
+    # Counters, see src.utils.counters
+    like_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0')
+    comment_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0')
     # relationships
     comments = db.relationship('Comment', backref='post')
     tags = db.relationship('Tag', backref='post')
@@ -52,6 +217,18 @@ class Post(db.Model, ResourceMixin):
         'User', secondary=post_likes, lazy='dynamic', backref=db.backref(
             'likes', lazy='dynamic'))
 
+    __table_args__ = (
+        # Per author scans when timelines are merged at read time
+        db.Index(
+            'ix_posts_pulled',
+            'user_id',
+            'id',
+            postgresql_where=db.text('NOT fanned_out')
+        ),
+        # Keyset pagination of an author's posts
+        db.Index('ix_posts_user_id_created_on', 'user_id', 'created_on', 'id'),
+    )
+
     def __repr__(self):
         return f'<Post {self.body}>'
 
@@ -59,6 +236,87 @@ class Post(db.Model, ResourceMixin):
         return self.likes.filter(
             post_likes.c.user_id == user.id).count() > 0
 
+    @classmethod
+    def liked_by(cls, user_id, ids):
+        """
+        Find which of some posts a user liked, see liked_ids.
+
+        :param user_id: User id
+        :param ids: Post ids
+        :return: set of the liked post ids
+        """
+        return liked_ids(post_likes, 'post_id', user_id, ids)
+
+    @classmethod
+    def recent_likers(cls, ids, limit):
+        """
+        Get the latest likers of some posts, see recent_likers.
+
+        :param ids: Post ids
+        :param limit: Likers per post
+        :return: dict of lists of users by post id
+        """
+        return recent_likers(post_likes, 'post_id', ids, limit)
+
+    @classmethod
+    def set_liked(cls, user_id, ids, liked):
+        """
+        Like or unlike posts, see change_likes.
+
+        :param user_id: User id
+        :param ids: Post ids
+        :param liked: True to like, False to unlike
+        :return: dict of like counts by post id
+        """
+        return change_likes(post_likes, 'post_id', user_id, ids, liked)
+
+    def like(self, user):
+        """
+        Like the post and count it, in the caller's transaction.
+
+        :param user: User liking the post
+        """
+        Post.set_liked(user.id, [self.id], True)
+        db.session.expire(self, ['like_count'])
+
+    def unlike(self, user):
+        """
+        Take back a like and uncount it, in the caller's transaction.
+
+        :param user: User who liked the post
+        """
+        Post.set_liked(user.id, [self.id], False)
+        db.session.expire(self, ['like_count'])
+
+
+@event.listens_for(Post, 'after_insert')
+def count_new_post(mapper, connection, target):
+    """Count a new post on its author"""
+    from src.blueprints.auth.models import User
+
+    increment(connection, User.__table__, target.user_id, post_count=1)
+
+
+@event.listens_for(Post, 'after_delete')
+def uncount_post(mapper, connection, target):
+    """Uncount a deleted post on its author"""
+    from src.blueprints.auth.models import User
+
+    increment(connection, User.__table__, target.user_id, post_count=-1)
+
+
+@event.listens_for(Post, 'before_insert')
+def decide_fan_out(mapper, connection, target):
+    """Leave posts by authors with too many followers to read time"""
+    target.fanned_out = timeline.fans_out(connection, target.user_id)
+
+
+@event.listens_for(Post, 'after_insert')
+def push_to_timelines(mapper, connection, target):
+    """Push a new post to its readers' timelines"""
+    timeline.push(
+        connection, target.id, target.user_id, target.fanned_out)
+
 
 class Comment(db.Model, ResourceMixin):
     __tablename__ = 'comments'
@@ -73,11 +331,37 @@ class Comment(db.Model, ResourceMixin):
         db.ForeignKey('posts.id', ondelete='CASCADE', onupdate='CASCADE'))
     comment_id = db.Column(db.Integer, db.ForeignKey(
         'comments.id', ondelete='SET NULL'))
-    replies = db.relationship('Comment', lazy='joined')
+    # Materialized path: the zero padded ids of the thread's comments,
+    # from its top-level comment down to this one, see place_comment
+    path = db.Column(db.Text)
+    depth = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0')
+    # Counters, see src.utils.counters
+    like_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0')
+    reply_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0')
+    # Threads are loaded a level at a time, see reply_trees
+    replies = db.relationship('Comment', lazy='dynamic')
     likes = db.relationship(
         'User', secondary=comment_likes, lazy='dynamic', backref=db.backref(
             'comment_likes', lazy='dynamic'))
 
+    __table_args__ = (
+        # Keyset pagination of a post's and an author's comments
+        db.Index(
+            'ix_comments_post_id_created_on', 'post_id', 'created_on', 'id'),
+        db.Index(
+            'ix_comments_user_id_created_on', 'user_id', 'created_on', 'id'),
+        # First replies of a comment, and prefix scans of a thread
+        db.Index('ix_comments_comment_id', 'comment_id', 'id'),
+        db.Index(
+            'ix_comments_path',
+            'path',
+            postgresql_ops={'path': 'text_pattern_ops'}
+        ),
+    )
+
     def __repr__(self):
         return f'<Post {self.body}>'
 
@@ -85,6 +369,235 @@ class Comment(db.Model, ResourceMixin):
         return self.likes.filter(
             comment_likes.c.user_id == user.id).count() > 0
 
+    @classmethod
+    def liked_by(cls, user_id, ids):
+        """
+        Find which of some comments a user liked, see liked_ids.
+
+        :param user_id: User id
+        :param ids: Comment ids
+        :return: set of the liked comment ids
+        """
+        return liked_ids(comment_likes, 'comment_id', user_id, ids)
+
+    @classmethod
+    def recent_likers(cls, ids, limit):
+        """
+        Get the latest likers of some comments, see recent_likers.
+
+        :param ids: Comment ids
+        :param limit: Likers per comment
+        :return: dict of lists of users by comment id
+        """
+        return recent_likers(comment_likes, 'comment_id', ids, limit)
+
+    @classmethod
+    def set_liked(cls, user_id, ids, liked):
+        """
+        Like or unlike comments, see change_likes.
+
+        :param user_id: User id
+        :param ids: Comment ids
+        :param liked: True to like, False to unlike
+        :return: dict of like counts by comment id
+        """
+        return change_likes(
+            comment_likes, 'comment_id', user_id, ids, liked)
+
+    def like(self, user):
+        """
+        Like the comment and count it, in the caller's transaction.
+
+        :param user: User liking the comment
+        """
+        Comment.set_liked(user.id, [self.id], True)
+        db.session.expire(self, ['like_count'])
+
+    def unlike(self, user):
+        """
+        Take back a like and uncount it, in the caller's transaction.
+
+        :param user: User who liked the comment
+        """
+        Comment.set_liked(user.id, [self.id], False)
+        db.session.expire(self, ['like_count'])
+
+    def thread(self, depth=None):
+        """
+        Query the replies below the comment, with a prefix scan of the path
+        index. Ordered by path, every reply comes right before its own
+        replies, siblings oldest first.
+
+        :param depth: Levels of replies, all of them by default
+        :return: SQLAlchemy query, without an ORDER BY
+        """
+        query = Comment.query.filter(Comment.path.like(f'{self.path}/%'))
+
+        if depth is not None:
+            query = query.filter(Comment.depth <= self.depth + depth)
+
+        return query
+
+    @classmethod
+    def reply_trees(cls, ids, limit, depth, options=()):
+        """
+        Get the first replies to some comments, and the first replies to
+        those, down to `depth` levels, with a single recursive query that
+        takes at most `limit` replies per comment off the comment_id index.
+        A page of comments costs the same however big its threads are.
+
+        :param ids: Comment ids
+        :param limit: Replies per comment
+        :param depth: Levels of replies
+        :param options: Loader options for the replies, see eager_options
+        :return: dict of lists of replies, oldest first, by comment id
+        """
+        ids = set(ids)
+        replies = {}
+
+        if not ids or limit < 1 or depth < 1:
+            return replies
+
+        comments = cls.__table__
+        tree = select([
+            comments.c.id, literal(0).label('level')
+        ]).where(comments.c.id.in_(ids)).cte('tree', recursive=True)
+        first = select([comments.c.id]).where(
+            comments.c.comment_id == tree.c.id
+        ).order_by(comments.c.id).limit(limit).lateral('first')
+        tree = tree.union_all(
+            select([first.c.id, tree.c.level + 1])
+            .select_from(tree.join(first, true()))
+            .where(tree.c.level < depth)
+        )
+
+        # Path order puts every reply after its parent's
+        rows = cls.query.options(*options).join(
+            tree, tree.c.id == cls.id).filter(
+            tree.c.level > 0).order_by(cls.path)
+
+        for reply in rows:
+            replies.setdefault(reply.comment_id, []).append(reply)
+
+        return replies
+
+    @classmethod
+    def backfill_paths(cls, chunk=1000, engine=None):
+        """
+        Set the path, depth and reply_count of the comments made before
+        they existed, or that drifted, walking each thread down from its
+        top-level comment with a recursive query. Threads are done
+        `chunk` top-level comments at a time, each chunk in a transaction
+        of its own so locks stay short.
+
+        :param chunk: Top-level comments per transaction
+        :param engine: Engine to use, defaults to the app's
+        :return: Number of comments fixed
+        """
+        engine = engine or db.engine
+        comments = cls.__table__
+        child = comments.alias('child')
+        replies = comments.alias('replies')
+        last = engine.execute(select([func.max(comments.c.id)])).scalar() or 0
+        fixed = 0
+
+        def segment(id):
+            return func.lpad(cast(id, db.Text), 10, '0')
+
+        count = select([func.count()]).where(
+            replies.c.comment_id == comments.c.id).as_scalar()
+
+        for start in range(0, last, chunk):
+            tree = select([
+                comments.c.id,
+                segment(comments.c.id).label('path'),
+                literal(0).label('depth')
+            ]).where(comments.c.comment_id.is_(None)).where(
+                comments.c.id > start).where(
+                comments.c.id <= start + chunk).cte('tree', recursive=True)
+            tree = tree.union_all(select([
+                child.c.id,
+                tree.c.path + '/' + segment(child.c.id),
+                tree.c.depth + 1
+            ]).where(child.c.comment_id == tree.c.id))
+
+            with engine.begin() as connection:
+                fixed += connection.execute(comments.update().where(
+                    comments.c.id == tree.c.id
+                ).where(or_(
+                    comments.c.path.is_distinct_from(tree.c.path),
+                    comments.c.depth != tree.c.depth,
+                    comments.c.reply_count != count
+                )).values(
+                    path=tree.c.path,
+                    depth=tree.c.depth,
+                    reply_count=count,
+                    updated_on=comments.c.updated_on
+                )).rowcount
+
+        return fixed
+
+
+@event.listens_for(Comment, 'before_insert')
+def place_comment(mapper, connection, target):
+    """
+    Take the id of a new comment ahead of its insert, to write its path
+    along with it, extending its parent's
+    """
+    comments = Comment.__table__
+    parent = comments.alias('parent')
+    id = target.id if target.id is not None else \
+        func.nextval('comments_id_seq')
+    row = connection.execute(select([
+        id,
+        select([parent.c.path]).where(
+            parent.c.id == target.comment_id).as_scalar(),
+        select([parent.c.depth]).where(
+            parent.c.id == target.comment_id).as_scalar(),
+    ])).first()
+
+    target.id = row[0]
+    target.path = f'{row[1]}/{row[0]:010d}' if row[1] else f'{row[0]:010d}'
+    target.depth = row[2] + 1 if row[2] is not None else 0
+
+
+@event.listens_for(Comment, 'after_insert')
+def count_new_comment(mapper, connection, target):
+    """Count a new comment on its post, and a reply on its parent"""
+    if target.post_id is not None:
+        increment(
+            connection, Post.__table__, target.post_id, comment_count=1)
+
+    if target.comment_id is not None:
+        increment(
+            connection, Comment.__table__, target.comment_id, reply_count=1)
+
+
+@event.listens_for(Comment, 'after_update')
+def count_moved_comment(mapper, connection, target):
+    """Move the count of a comment attached to another post"""
+    history = inspect(target).attrs.post_id.history
+
+    for post_id in history.deleted or ():
+        if post_id is not None:
+            increment(connection, Post.__table__, post_id, comment_count=-1)
+
+    for post_id in history.added or ():
+        if post_id is not None:
+            increment(connection, Post.__table__, post_id, comment_count=1)
+
+
+@event.listens_for(Comment, 'after_delete')
+def uncount_comment(mapper, connection, target):
+    """Uncount a deleted comment on its post, and a reply on its parent"""
+    if target.post_id is not None:
+        increment(
+            connection, Post.__table__, target.post_id, comment_count=-1)
+
+    if target.comment_id is not None:
+        increment(
+            connection, Comment.__table__, target.comment_id, reply_count=-1)
+
 
 class Tag(db.Model, ResourceMixin):
     name = db.Column(db.String(16), nullable=False, index=True, unique=True)
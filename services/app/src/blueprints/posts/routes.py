@@ -1,11 +1,24 @@
 from sqlalchemy import exc
+from marshmallow import ValidationError
 from flask import url_for, request, jsonify, Blueprint, current_app
 
 from src import db
 from src.utils.decorators import authenticate
-from src.blueprints.errors import server_error, not_found, error_response
-from src.blueprints.posts.models import Post, Comment
-from src.blueprints.posts.schema import PostSchema, CommentSchema
+from src.utils.timeline import timeline
+from src.utils.pagination import paginate, decode_cursor, encode_cursor, \
+    Page
+from src.utils.loading import eager_options
+from src.utils.serializers import fast_dump
+from src.utils.fieldsets import sparse
+from src.utils.counters import like_counts
+from src.blueprints.errors import server_error, not_found, error_response, \
+    bad_request
+from src.blueprints.auth.models import User
+from src.blueprints.posts.models import Post, Comment, post_likes, \
+    comment_likes
+from src.blueprints.posts.schema import PostSchema, CommentSchema, \
+    LikeSchema, like_context, thread_context
+from src.blueprints.users.schema import UserSchema, follow_context
 
 
 posts = Blueprint('posts', __name__, url_prefix='/api/posts')
@@ -19,22 +32,71 @@ def ping():
 @posts.route('/<int:post_id>', methods=['GET'])
 @authenticate
 def get_post(user, post_id):
+    schema = sparse(PostSchema)
+
     try:
         print(post_id)
-        post = Post.find_by_id(post_id)
+        post = Post.query.options(
+            *eager_options(Post, schema)).get(post_id)
 
         if not post:
             return not_found('Post not found')
     except Exception:
         return server_error('Something went wrong, please try again.')
     else:
-        return jsonify(PostSchema().dump(post))
+        schema.context = like_context(user, Post, [post])
+        return jsonify(schema.dump(post))
 
 
 @posts.route('/<feed>/page/<int:page>', methods=['GET'])
 @authenticate
 def get_post_feed(user, feed, page=1):
-    pass
+    """
+    Get a page of the user's home timeline, newest posts first. Pass the
+    previous page's next or prev as ?cursor= to page without an offset.
+    """
+    if feed != 'home':
+        return not_found('Feed not found.')
+
+    per_page = current_app.config['ITEMS_PER_PAGE']
+    cursor = request.args.get('cursor')
+    schema = sparse(PostSchema, many=True)
+    options = eager_options(Post, schema)
+
+    if cursor:
+        direction, (id,) = decode_cursor(cursor, (Post.id,))
+
+        if direction == 'next':
+            items, has_next = timeline.read(
+                user.id, per_page, before=id, options=options)
+            has_prev = True
+        else:
+            items, has_prev = timeline.read(
+                user.id, per_page, after=id, options=options)
+            has_next = True
+    else:
+        items, has_next = timeline.read(
+            user.id, per_page, offset=(max(page, 1) - 1) * per_page,
+            options=options)
+        has_prev = page > 1
+
+    home = Page(
+        items,
+        has_next,
+        has_prev,
+        next=encode_cursor('next', [items[-1].id])
+        if has_next and items else None,
+        prev=encode_cursor('prev', [items[0].id])
+        if has_prev and items else None,
+    )
+    schema.context = like_context(user, Post, home.items)
+
+    return {
+        'posts': fast_dump(schema, home.items),
+        'hasNext': home.has_next,
+        'next': home.next,
+        'prev': home.prev,
+    }
 
 
 @posts.route('', methods=['POST'])
@@ -53,7 +115,8 @@ def create_post(user):
         db.session.rollback()
         return server_error('Something went wrong, please try again.')
     else:
-        response = jsonify(PostSchema().dump(post))
+        response = jsonify(PostSchema(
+            context=like_context(user)).dump(post))
         response.status_code = 201
         response.headers['Location'] = url_for(
             'posts.get_post', post_id=post.id)
@@ -80,7 +143,8 @@ def update_post(user, post_id):
         db.session.rollback()
         return server_error('Something went wrong, please try again.')
     else:
-        return jsonify(PostSchema().dump(post))
+        return jsonify(PostSchema(
+            context=like_context(user, Post, [post])).dump(post))
 
 
 @posts.route('/<int:post_id>', methods=['DELETE'])
@@ -113,40 +177,199 @@ def update_like(user, post_id):
 
     try:
         if post.is_liked_by(user):
-            post.likes.remove(user)
+            post.unlike(user)
         else:
-            post.likes.append(user)
+            post.like(user)
 
         post.save()
     except (exc.IntegrityError, ValueError):
         db.session.rollback()
         return server_error('Something went wrong, please try again.')
     else:
-        return jsonify(PostSchema().dump(post))
+        return jsonify(PostSchema(
+            context=like_context(user, Post, [post])).dump(post))
+
+
+@posts.route('/<int:post_id>/likes', methods=['PUT', 'DELETE'])
+@authenticate
+def set_like(user, post_id):
+    """Like a post with PUT, unlike it with DELETE"""
+    return change_like(Post, user, post_id)
+
+
+@posts.route('/likes', methods=['POST'])
+@authenticate
+def batch_likes(user):
+    """
+    Apply likes and unlikes queued by a client, e.g. while offline, in
+    one transaction. The last change to each post or comment wins.
+    """
+    request_data = request.get_json()
+
+    if not request_data or not isinstance(request_data.get('likes'), list):
+        return bad_request('No input data provided')
+
+    if len(request_data['likes']) > current_app.config['LIKES_BATCH_LIMIT']:
+        return bad_request('Too many likes.')
+
+    try:
+        changes = LikeSchema(many=True).load(request_data['likes'])
+    except ValidationError as err:
+        return error_response(422, err.messages)
+
+    states = {}
+
+    for change in changes:
+        if 'post_id' in change:
+            states[Post, change['post_id']] = change['liked']
+        else:
+            states[Comment, change['comment_id']] = change['liked']
+
+    counts = {Post: {}, Comment: {}}
+
+    try:
+        for model in (Post, Comment):
+            for liked in (True, False):
+                ids = [
+                    id for (kind, id), state in states.items()
+                    if kind is model and state == liked
+                ]
+                counts[model].update(model.set_liked(user.id, ids, liked))
+
+        db.session.commit()
+    except (exc.IntegrityError, ValueError):
+        db.session.rollback()
+        return server_error('Something went wrong, please try again.')
+    else:
+        return {
+            key: [{
+                'id': id,
+                'like_count': count,
+                'liked_by_me': states[model, id],
+            } for id, count in counts[model].items()]
+            for key, model in (('posts', Post), ('comments', Comment))
+        }
+
+
+def change_like(model, user, id):
+    """
+    Like or unlike a post or comment with a single statement. Repeating
+    a request changes nothing.
+
+    :param model: Post or Comment
+    :param user: Current user
+    :param id: Post or comment id
+    :return: dict with the new like count
+    """
+    liked = request.method == 'PUT'
+
+    try:
+        counts = model.set_liked(user.id, [id], liked)
+        db.session.commit()
+    except (exc.IntegrityError, ValueError):
+        db.session.rollback()
+        return server_error('Something went wrong, please try again.')
+
+    if id not in counts:
+        return not_found(f'{model.__name__} not found.')
+
+    return {'id': id, 'like_count': counts[id], 'liked_by_me': liked}
+
+
+@posts.route('/<int:post_id>/likes/page/<int:page>', methods=['GET'])
+@posts.route('/<int:post_id>/likes', methods=['GET'])
+@authenticate
+def get_likers(user, post_id, page=1):
+    """Get list of users who liked a post"""
+    post = Post.find_by_id(post_id)
+
+    if not post:
+        return not_found('Post not found.')
+
+    return likers_page(user, post, post_likes, 'post_id', page)
 
 
 @posts.route('/<int:post_id>/comments/page/<int:page>', methods=['GET'])
+@posts.route('/<int:post_id>/comments', methods=['GET'])
 @authenticate
 def get_comments(user, post_id, page=1):
+    """
+    Get a page of a post's top-level comments, each with its first
+    replies nested, see thread_context.
+    """
     post = Post.find_by_id(post_id)
 
     if not post:
         return not_found('Post not found.')
 
+    schema = sparse(CommentSchema, many=True)
+    options = eager_options(Comment, schema)
+
     try:
-        comments = Comment.query.with_parent(post).order_by(
-                Comment.created_on.desc()).paginate(
-            page, current_app.config['ITEMS_PER_PAGE'])
+        comments = paginate(
+            Comment.query.with_parent(post).options(*options).filter(
+                Comment.comment_id.is_(None)),
+            (Comment.created_on, Comment.id),
+            current_app.config['ITEMS_PER_PAGE'],
+            page=page,
+            cursor=request.args.get('cursor'))
     except (exc.IntegrityError, ValueError):
         db.session.rollback()
         return server_error('Something went wrong, please try again.')
     else:
+        schema.context = thread_context(user, comments.items, options)
+
         return {
-            'comments': CommentSchema(many=True).dump(comments.items),
+            'comments': fast_dump(schema, comments.items),
             'hasNext': comments.has_next,
+            'next': comments.next,
+            'prev': comments.prev,
         }
 
 
+@posts.route(
+    '/<int:post_id>/comments/<int:comment_id>/replies/page/<int:page>',
+    methods=['GET'])
+@posts.route(
+    '/<int:post_id>/comments/<int:comment_id>/replies', methods=['GET'])
+@authenticate
+def get_replies(user, post_id, comment_id, page=1):
+    """
+    Load more of a comment's replies: a page of its thread, flat and in
+    thread order, every reply right before its own replies, down to
+    ?depth= levels. Nest them by comment_id, replies with a reply_count
+    but none below them go deeper.
+    """
+    comment = Comment.find_by_id(comment_id)
+
+    if not comment or comment.post_id != post_id:
+        return not_found('Comment not found.')
+
+    depth = min(
+        request.args.get(
+            'depth', current_app.config['COMMENT_DEPTH'], type=int),
+        current_app.config['COMMENT_DEPTH_LIMIT'])
+
+    schema = sparse(CommentSchema, many=True)
+    replies = paginate(
+        comment.thread(depth).options(*eager_options(Comment, schema)),
+        (Comment.path,),
+        current_app.config['ITEMS_PER_PAGE'],
+        page=page,
+        cursor=request.args.get('cursor'),
+        descending=False)
+
+    schema.context = like_context(user, Comment, replies.items)
+
+    return {
+        'replies': fast_dump(schema, replies.items),
+        'count': comment.reply_count,
+        'hasNext': replies.has_next,
+        'next': replies.next,
+        'prev': replies.prev,
+    }
+
+
 @posts.route('/<int:post_id>/comments', methods=['POST'])
 @posts.route('/<int:post_id>/comments/<int:comment_id>', methods=['POST'])
 @authenticate
@@ -167,7 +390,8 @@ def create_comment(user, post_id, comment_id=None):
         db.session.rollback()
         return server_error('Something went wrong, please try again.')
     else:
-        response = jsonify(CommentSchema().dump(comment))
+        response = jsonify(CommentSchema(
+            context=like_context(user)).dump(comment))
         response.status_code = 201
         return response
 
@@ -192,7 +416,8 @@ def update_comment(user, post_id, comment_id):
         db.session.rollback()
         return server_error('Something went wrong, please try again.')
     else:
-        return jsonify(CommentSchema().dump(comment))
+        return jsonify(CommentSchema(
+            context=like_context(user, Comment, [comment])).dump(comment))
 
 
 @posts.route('/<int:post_id>/comments/<int:comment_id>', methods=['DELETE'])
@@ -224,9 +449,9 @@ def update_comment_like(user, post_id, comment_id):
         return not_found('Comment not found')
 
     if comment.is_liked_by(user):
-        comment.likes.remove(user)
+        comment.unlike(user)
     else:
-        comment.likes.append(user)
+        comment.like(user)
 
     try:
         comment.save()
@@ -234,4 +459,73 @@ def update_comment_like(user, post_id, comment_id):
         db.session.rollback()
         return server_error('Something went wrong, please try again.')
     else:
-        return jsonify(CommentSchema().dump(comment))
+        return jsonify(CommentSchema(
+            context=like_context(user, Comment, [comment])).dump(comment))
+
+
+@posts.route(
+    '/<int:post_id>/comments/<int:comment_id>/likes',
+    methods=['PUT', 'DELETE'])
+@authenticate
+def set_comment_like(user, post_id, comment_id):
+    """Like a comment with PUT, unlike it with DELETE"""
+    return change_like(Comment, user, comment_id)
+
+
+@posts.route(
+    '/<int:post_id>/comments/<int:comment_id>/likes/page/<int:page>',
+    methods=['GET'])
+@posts.route('/<int:post_id>/comments/<int:comment_id>/likes', methods=['GET'])
+@authenticate
+def get_comment_likers(user, post_id, comment_id, page=1):
+    """Get list of users who liked a comment"""
+    comment = Comment.find_by_id(comment_id)
+
+    if not comment:
+        return not_found('Comment not found.')
+
+    return likers_page(
+        user, comment, comment_likes, 'comment_id', page)
+
+
+def likers_page(user, liked, likes, key, page):
+    """
+    Get a page of the users who liked a post or a comment, latest likes
+    first. The likes are paged by when they were made, along the likes
+    table's (key, created_on, user_id) index, then their users loaded.
+
+    :param user: Current user
+    :param liked: Post or Comment
+    :param likes: Likes table, post_likes or comment_likes
+    :param key: Name of the liked row's column, post_id or comment_id
+    :param page: Page number, used without ?cursor=
+    :return: dict
+    """
+    schema = sparse(
+        UserSchema,
+        many=True,
+        only=('id', 'username', 'profile', 'followed_by_me',))
+    likers = paginate(
+        db.session.query(likes.c.created_on, likes.c.user_id).filter(
+            likes.c[key] == liked.id),
+        (likes.c.created_on, likes.c.user_id),
+        current_app.config['ITEMS_PER_PAGE'],
+        page=page,
+        cursor=request.args.get('cursor'))
+
+    ids = [like.user_id for like in likers.items]
+    users = {
+        liker.id: liker for liker in User.query.options(
+            *eager_options(User, schema)).filter(User.id.in_(ids))
+    } if ids else {}
+    items = [users[id] for id in ids if id in users]
+
+    schema.context = follow_context(user, items)
+
+    return {
+        'likers': fast_dump(schema, items),
+        'count': like_counts.current(liked, 'like_count'),
+        'hasNext': likers.has_next,
+        'next': likers.next,
+        'prev': likers.prev,
+    }
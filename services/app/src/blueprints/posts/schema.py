@@ -1,31 +1,146 @@
 import re
-from marshmallow import Schema, fields, validate, validates, ValidationError
+from flask import request, current_app
+from marshmallow import Schema, fields, validate, validates, \
+    validates_schema, ValidationError, missing
 
+from src.utils.counters import like_counts
+from src.utils.serializers import fast_dump
+from src.blueprints.users.schema import UserSchema
 
-class PostSchema(Schema):
+
+def like_context(user, model=None, items=()):
+    """
+    Schema context for the like fields of posts or comments: which of
+    the items the current user liked, found with one query, and, when
+    asked for with ?likers=, their recent likers, capped at
+    RECENT_LIKERS_LIMIT.
+
+    :param user: Current user
+    :param model: Post or Comment
+    :param items: Posts or comments about to be dumped
+    :return: dict
+    """
+    context = {'user': user}
+    ids = [item.id for item in items]
+
+    if model is not None:
+        context['liked'] = model.liked_by(user.id, ids)
+
+    limit = min(
+        request.args.get('likers', 0, type=int),
+        current_app.config['RECENT_LIKERS_LIMIT'])
+
+    if model is not None and limit > 0:
+        context['recent_likers'] = model.recent_likers(ids, limit)
+
+    return context
+
+
+def thread_context(user, items=(), options=()):
+    """
+    Schema context for a page of comments: their first replies, down to
+    a few levels, see Comment.reply_trees, and the like fields of all of
+    them. ?replies= and ?depth= pick how many and how deep, capped at
+    COMMENT_REPLIES_LIMIT and COMMENT_DEPTH_LIMIT.
+
+    :param user: Current user
+    :param items: Comments about to be dumped
+    :param options: Loader options for the replies, see eager_options
+    :return: dict
+    """
+    from src.blueprints.posts.models import Comment
+
+    config = current_app.config
+    limit = min(
+        request.args.get('replies', config['COMMENT_REPLIES'], type=int),
+        config['COMMENT_REPLIES_LIMIT'])
+    depth = min(
+        request.args.get('depth', config['COMMENT_DEPTH'], type=int),
+        config['COMMENT_DEPTH_LIMIT'])
+
+    replies = Comment.reply_trees(
+        [item.id for item in items], limit, depth, options)
+    context = like_context(user, Comment, list(items) + [
+        reply for level in replies.values() for reply in level])
+    context['replies'] = replies
+
+    return context
+
+
+class LikesMixin(object):
+    """
+    Like fields computed from the schema context, see like_context.
+    """
+    like_count = fields.Method('get_like_count', dump_only=True)
+    liked_by_me = fields.Method('get_liked_by_me', dump_only=True)
+    recent_likers = fields.Method('get_recent_likers', dump_only=True)
+
+    def get_like_count(self, obj):
+        if getattr(obj, 'like_count', None) is None:
+            return missing
+
+        # Likes not flushed yet count too, see CounterBuffer
+        return like_counts.current(obj, 'like_count')
+
+    def get_liked_by_me(self, obj):
+        if 'liked' in self.context:
+            return obj.id in self.context['liked']
+
+        user = self.context.get('user')
+        return obj.is_liked_by(user) if user is not None else missing
+
+    def get_recent_likers(self, obj):
+        if 'recent_likers' not in self.context:
+            return missing
+
+        return UserSchema(many=True, only=('id', 'username', 'profile',)) \
+            .dump(self.context['recent_likers'].get(obj.id, []))
+
+
+class PostSchema(LikesMixin, Schema):
     id = fields.Int(dump_only=True)
     body = fields.Str(required=True)
     created_on = fields.DateTime(dump_only=True)
     updated_on = fields.DateTime(dump_only=True)
     author = fields.Nested('UserSchema', dump_only=True, only=(
         'id', 'username', 'profile',))
-    likes = fields.List(fields.Nested(
-        lambda: PostSchema(only=('id',)), dump_only=True))
+    comment_count = fields.Int(dump_only=True)
     comments = fields.List(fields.Nested(
         lambda: CommentSchema(only=('id',)), dump_only=True))
 
 
-class CommentSchema(Schema):
+class CommentSchema(LikesMixin, Schema):
     id = fields.Int(dump_only=True)
     body = fields.Str(required=True)
     created_on = fields.DateTime(dump_only=True)
     updated_on = fields.DateTime(dump_only=True)
     author = fields.Nested(
         'UserSchema', dump_only=True, only=('id', 'username', 'profile',))
-    replies = fields.List(
-        fields.Nested(lambda: CommentSchema(), dump_only=True))
-    likes = fields.List(fields.Nested(
-        lambda: CommentSchema(only=('id',)), dump_only=True))
+    comment_id = fields.Int(dump_only=True)
+    depth = fields.Int(dump_only=True)
+    reply_count = fields.Int(dump_only=True)
+    replies = fields.Method('get_replies', dump_only=True)
+
+    def get_replies(self, obj):
+        # Only the replies loaded ahead, see thread_context
+        if 'replies' not in self.context:
+            return missing
+
+        return fast_dump(
+            CommentSchema(many=True, context=self.context),
+            self.context['replies'].get(obj.id, []))
+
+
+class LikeSchema(Schema):
+    """A queued like or unlike of a post or a comment."""
+    post_id = fields.Int()
+    comment_id = fields.Int()
+    liked = fields.Bool(required=True)
+
+    @validates_schema
+    def validate_target(self, data, **kwargs):
+        if ('post_id' in data) == ('comment_id' in data):
+            raise ValidationError('Give either a post_id or a comment_id.')
 
 
 class TagSchema(Schema):
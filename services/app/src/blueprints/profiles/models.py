@@ -1,7 +1,11 @@
 from hashlib import md5
 
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+
 from src import db
 from src.utils.models import ResourceMixin
+from src.utils.cache import principals, delete_on_commit
 
 
 class Profile(db.Model, ResourceMixin):
@@ -26,3 +30,10 @@ class Profile(db.Model, ResourceMixin):
     def set_avatar(email, size=128):
         digest = md5(email.lower().encode('utf-8')).hexdigest()
         return f'https://www.gravatar.com/avatar/{digest}?s={size}&d=mm&r=pg'
+
+
+@event.listens_for(Profile, 'after_update')
+@event.listens_for(Profile, 'after_delete')
+def invalidate_principal(mapper, connection, target):
+    """Cached users carry their profile, drop them when it changes"""
+    delete_on_commit(object_session(target), target.user_id, principals)
@@ -2,6 +2,8 @@ from flask import jsonify, request, Blueprint
 from marshmallow import ValidationError
 
 from src.utils.decorators import authenticate
+from src.utils.loading import eager_options
+from src.utils.fieldsets import sparse
 from src.blueprints.errors import error_response, \
     bad_request, server_error, not_found
 from src.blueprints.profiles.schema import ProfileSchema
@@ -14,10 +16,12 @@ profile = Blueprint('profile', __name__, url_prefix='/api')
 @profile.route('/profile/<username>', methods=['GET'])
 @authenticate
 def get_profile(user, username):
-    user = User.find_by_identity(username)
+    schema = sparse(UserSchema)
+    user = User.find_by_identity(
+        username, options=eager_options(User, schema))
 
     if user:
-        return jsonify(UserSchema().dump(user))
+        return jsonify(schema.dump(user))
 
     return not_found('User not found.')
 
@@ -1,13 +1,18 @@
 from sqlalchemy import exc
-from flask import Blueprint, current_app, jsonify
+from flask import Blueprint, current_app, jsonify, request
 
 from src import db
 from src.utils.decorators import authenticate
+from src.utils.pagination import paginate
+from src.utils.loading import eager_options
+from src.utils.serializers import fast_dump
+from src.utils.fieldsets import sparse
 from src.blueprints.errors import server_error, not_found
 from src.blueprints.auth.models import User
 from src.blueprints.posts.models import Post, Comment
-from src.blueprints.users.schema import UserSchema
-from src.blueprints.posts.schema import PostSchema, CommentSchema
+from src.blueprints.users.schema import UserSchema, follow_context
+from src.blueprints.posts.schema import PostSchema, CommentSchema, \
+    like_context
 
 
 users = Blueprint('users', __name__, url_prefix='/api/users')
@@ -61,112 +66,176 @@ def unfollow(user, id):
 @users.route('/following', methods=['GET'])
 @authenticate
 def get_all_following(user):
-    return jsonify(UserSchema(many=True, only=('id',)).dump(user.followed))
+    schema = sparse(UserSchema, many=True, only=('id',))
+    return jsonify(schema.dump(
+        user.followed.options(*eager_options(User, schema))))
 
 
 @users.route('/followers', methods=['GET'])
 @authenticate
 def get_all_followers(user):
-    return jsonify(UserSchema(many=True, only=('id',)).dump(user.followers))
+    schema = sparse(UserSchema, many=True, only=('id',))
+    return jsonify(schema.dump(
+        user.followers.options(*eager_options(User, schema))))
 
 
 @users.route('/likes', methods=['GET'])
 @authenticate
 def get_all_likes(user):
-    return jsonify(PostSchema(many=True, only=('id',)).dump(user.likes))
+    schema = sparse(PostSchema, many=True, only=('id',))
+    return jsonify(schema.dump(
+        user.likes.options(*eager_options(Post, schema))))
 
 
 @users.route('/<username>/followers/page/<int:page>', methods=['GET'])
+@users.route('/<username>/followers', methods=['GET'])
 @authenticate
-def get_followers(user, username, page=1):
+def get_followers(current_user, username, page=1):
     """Get list of users following a user"""
     user = User.find_by_identity(username)
+    schema = sparse(
+        UserSchema,
+        many=True,
+        only=('id', 'username', 'profile', 'followed_by_me',))
+
     try:
-        followers = user.followers.paginate(
-            page, current_app.config['ITEMS_PER_PAGE'], False)
+        followers = paginate(
+            user.followers.options(*eager_options(User, schema)),
+            (User.created_on, User.id),
+            current_app.config['ITEMS_PER_PAGE'],
+            page=page,
+            cursor=request.args.get('cursor'))
     except (exc.IntegrityError, ValueError):
         db.session.rollback()
         return server_error('Something went wrong, please try again.')
     else:
+        schema.context = follow_context(current_user, followers.items)
+
         return {
-            'followers': UserSchema(many=True, only=(
-                'id', 'username', 'profile',)).dump(followers.items),
-            'count': user.followers.count(),
+            'followers': fast_dump(schema, followers.items),
+            'count': user.follower_count,
             'hasNext': followers.has_next,
+            'next': followers.next,
+            'prev': followers.prev,
         }
 
 
 @users.route('/<username>/following/page/<int:page>', methods=['GET'])
+@users.route('/<username>/following', methods=['GET'])
 @authenticate
-def get_following(user, username, page=1):
+def get_following(current_user, username, page=1):
     """Get list of users following a user"""
     user = User.find_by_identity(username)
+    schema = sparse(
+        UserSchema,
+        many=True,
+        only=('id', 'username', 'profile', 'followed_by_me',))
+
     try:
-        following = user.followed.paginate(
-            page, current_app.config['ITEMS_PER_PAGE'], False)
+        following = paginate(
+            user.followed.options(*eager_options(User, schema)),
+            (User.created_on, User.id),
+            current_app.config['ITEMS_PER_PAGE'],
+            page=page,
+            cursor=request.args.get('cursor'))
     except (exc.IntegrityError, ValueError):
         db.session.rollback()
         return server_error('Something went wrong, please try again.')
     else:
+        schema.context = follow_context(current_user, following.items)
+
         return {
-            'following': UserSchema(many=True, only=(
-                'id', 'username', 'profile',)).dump(following.items),
+            'following': fast_dump(schema, following.items),
             'hasNext': following.has_next,
-            'count': user.followed.count(),
+            'next': following.next,
+            'prev': following.prev,
+            'count': user.following_count,
         }
 
 
 @users.route('/<username>/posts/page/<int:page>', methods=['GET'])
+@users.route('/<username>/posts', methods=['GET'])
 @authenticate
-def get_user_posts(user, username, page=1):
+def get_user_posts(current_user, username, page=1):
     """Get a users list of posts"""
     user = User.find_by_identity(username)
+    schema = sparse(PostSchema, many=True)
+
     try:
-        posts = Post.query.with_parent(user).order_by(
-            Post.created_on.desc()).paginate(
-                page, current_app.config['ITEMS_PER_PAGE'])
+        posts = paginate(
+            Post.query.with_parent(user).options(*eager_options(Post, schema)),
+            (Post.created_on, Post.id),
+            current_app.config['ITEMS_PER_PAGE'],
+            page=page,
+            cursor=request.args.get('cursor'))
     except (exc.IntegrityError, ValueError):
         db.session.rollback()
         return server_error('Something went wrong, please try again.')
     else:
+        schema.context = like_context(current_user, Post, posts.items)
+
         return {
-            'posts': PostSchema(many=True).dump(posts.items),
+            'posts': fast_dump(schema, posts.items),
             'hasNext': posts.has_next,
+            'next': posts.next,
+            'prev': posts.prev,
         }
 
 
 @users.route('/<username>/comments/page/<int:page>', methods=['GET'])
+@users.route('/<username>/comments', methods=['GET'])
 @authenticate
-def get_user_comments(user, username, page=1):
+def get_user_comments(current_user, username, page=1):
     """Get a users list of comments"""
     user = User.find_by_identity(username)
+    schema = sparse(CommentSchema, many=True)
+
     try:
-        comments = Comment.query.with_parent(user).order_by(
-            Comment.created_on.desc()).paginate(
-                page, current_app.config['ITEMS_PER_PAGE'])
+        comments = paginate(
+            Comment.query.with_parent(user).options(
+                *eager_options(Comment, schema)),
+            (Comment.created_on, Comment.id),
+            current_app.config['ITEMS_PER_PAGE'],
+            page=page,
+            cursor=request.args.get('cursor'))
     except (exc.IntegrityError, ValueError):
         db.session.rollback()
         return server_error('Something went wrong, please try again.')
     else:
+        schema.context = like_context(current_user, Comment, comments.items)
+
         return {
-            'comments': CommentSchema(many=True).dump(comments.items),
+            'comments': fast_dump(schema, comments.items),
             'hasNext': comments.has_next,
+            'next': comments.next,
+            'prev': comments.prev,
         }
 
 
 @users.route('/<username>/likes/page/<int:page>', methods=['GET'])
+@users.route('/<username>/likes', methods=['GET'])
 @authenticate
-def get_liked_posts(user, username, page=1):
+def get_liked_posts(current_user, username, page=1):
     """Get a users list of liked posts"""
     user = User.find_by_identity(username)
+    schema = sparse(PostSchema, many=True)
+
     try:
-        liked_posts = user.likes.order_by(Post.created_on.desc()).paginate(
-            page, current_app.config['ITEMS_PER_PAGE'])
+        liked_posts = paginate(
+            user.likes.options(*eager_options(Post, schema)),
+            (Post.created_on, Post.id),
+            current_app.config['ITEMS_PER_PAGE'],
+            page=page,
+            cursor=request.args.get('cursor'))
     except (exc.IntegrityError, ValueError):
         db.session.rollback()
         return server_error('Something went wrong, please try again.')
     else:
+        schema.context = like_context(current_user, Post, liked_posts.items)
+
         return {
-            'likes': PostSchema(many=True).dump(liked_posts.items),
+            'likes': fast_dump(schema, liked_posts.items),
             'hasNext': liked_posts.has_next,
+            'next': liked_posts.next,
+            'prev': liked_posts.prev,
         }
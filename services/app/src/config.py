@@ -7,6 +7,58 @@ load_dotenv()
 class BaseConfig:
     """Base configuration"""
     ITEMS_PER_PAGE = 7
+    # The auth caches are per process. A user deactivated, or a token
+    # revoked through logout, in one worker stays valid in the others for
+    # up to PRINCIPAL_CACHE_TTL seconds, or AUTH_VERSION_CACHE_TTL with
+    # AUTH_STATELESS.
+    PRINCIPAL_CACHE_SIZE = 10000
+    PRINCIPAL_CACHE_TTL = 60
+    AUTH_STATELESS = False
+    AUTH_VERSION_CACHE_SIZE = 100000
+    AUTH_VERSION_CACHE_TTL = 30
+    # Permission changes reach other workers after PERMISSION_CACHE_TTL
+    PERMISSION_CACHE_SIZE = 10000
+    PERMISSION_CACHE_TTL = 60
+    PERMISSION_REGISTRY_INTERVAL = 30
+    # database to share logouts between workers, or local for a single
+    # process, which needs a path outside development and testing
+    REVOCATION_BACKEND = os.environ.get('REVOCATION_BACKEND', 'database')
+    REVOCATION_LIST_PATH = os.environ.get('REVOCATION_LIST_PATH')
+    REVOCATION_SYNC_INTERVAL = 30
+    # Rows committed this much later than created are still pulled
+    REVOCATION_SYNC_OVERLAP = 60
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_QUEUE_DEPTH = 8
+    PASSWORD_HASH_TIMEOUT = 10
+    PASSWORD_HASH_RETRY_AFTER = 1
+    # Without iterations, werkzeug's default PBKDF2 iterations are used
+    PASSWORD_HASH_METHOD = os.environ.get(
+        'PASSWORD_HASH_METHOD', 'pbkdf2:sha256')
+    ACTIVITY_WRITE_BEHIND = False
+    ACTIVITY_FLUSH_INTERVAL = 5
+    ACTIVITY_FLUSH_SIZE = 500
+    IDENTITY_FILTER_ERROR_RATE = 0.01
+    # Identities registered by other workers can be reported available
+    # for this long, see IdentityFilter
+    IDENTITY_FILTER_REFRESH_INTERVAL = 5
+    IDENTITY_FILTER_OVERLAP = 60
+    TIMELINE_LENGTH = 800
+    # Authors with more followers are merged into timelines at read time
+    TIMELINE_FANOUT_LIMIT = 10000
+    # Cap on ?likers=, the recent likers previewed on posts and comments
+    RECENT_LIKERS_LIMIT = 5
+    # Replies previewed per comment, and levels of them, with ?replies=
+    # and ?depth= capped at the limits
+    COMMENT_REPLIES = 3
+    COMMENT_REPLIES_LIMIT = 10
+    COMMENT_DEPTH = 1
+    COMMENT_DEPTH_LIMIT = 5
+    # Most likes and unlikes accepted by one batch request
+    LIKES_BATCH_LIMIT = 100
+    # Buffer like counts and flush them in bulk, see CounterBuffer
+    LIKE_COUNT_WRITE_BEHIND = False
+    LIKE_COUNT_FLUSH_INTERVAL = 1
+    LIKE_COUNT_FLUSH_SIZE = 1000
     SECRET_KEY = os.environ.get('SECRET_DEV_KEY')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     TESTING = False
@@ -22,6 +74,9 @@ class DevelopmentConfig(BaseConfig):
 class TestingConfig(BaseConfig):
     """Testing configuration"""
     ITEMS_PER_PAGE = 2
+    IDENTITY_FILTER_REFRESH_INTERVAL = 0
+    PASSWORD_HASH_WORKERS = 0
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
     PRESERVE_CONTEXT_ON_EXCEPTION = False
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_TEST_URL')
     TESTING = True
@@ -2,7 +2,8 @@ import pytest
 
 from src import create_app, db as _db
 from src.config import TestingConfig
-from src.utils.perms import set_model_perms
+from src.utils.perms import apply_manifest, PERMISSIONS
+from src.utils.bloom import identities
 from src.tests.utils import add_user, add_group, add_post, add_comment
 from src.blueprints.auth.models import User
 from src.blueprints.posts.models import Post
@@ -50,10 +51,10 @@ def db(app):
     _db.create_all()
     _db.session.commit()
 
-    set_model_perms(User)
-    set_model_perms(Group)
+    apply_manifest(PERMISSIONS)
 
     add_user(name='admin', username='user', email='adminuser@test.com')
+    identities.build()
 
     return _db
 
@@ -69,6 +70,9 @@ def session(db):
     yield db.session
     db.session.rollback()
 
+    # The availability filter may have caught up with rolled back users
+    identities.build()
+
     return db
 
 
@@ -175,7 +179,7 @@ def posts(db, session, users):
         u3.id,
         comments=[c4]
     )
-    p1.likes.append(u1)
-    p2.likes.append(u1)
+    p1.like(u1)
+    p2.like(u1)
 
     return db
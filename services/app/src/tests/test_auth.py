@@ -1,5 +1,11 @@
 import json
 
+import pytest
+from flask import current_app
+
+from src import db
+from src.utils.cache import principals
+from src.utils.activity import activity
 from src.blueprints.auth.models import User
 
 
@@ -110,6 +116,43 @@ def test_valid_user_login(client, users):
     assert (old_sign_in_count + 1) == new_sign_in_count
 
 
+def test_login_write_behind_activity(client, users):
+    current_app.config['ACTIVITY_WRITE_BEHIND'] = True
+    try:
+        user = User.find_by_identity('regularuser@test.com')
+        old_sign_in_count = user.sign_in_count
+
+        for ip in ('10.0.0.1', '10.0.0.2'):
+            response = client.post(
+                '/api/auth/login',
+                data=json.dumps({
+                    'identity': 'regularuser@test.com',
+                    'password': 'password'
+                }),
+                content_type='application/json',
+                environ_base={'REMOTE_ADDR': ip}
+            )
+            assert response.status_code == 200
+
+        assert user.sign_in_count == old_sign_in_count
+
+        class Broken(object):
+            def execute(self, *args):
+                raise RuntimeError('Database is down.')
+
+        with pytest.raises(RuntimeError):
+            activity.flush(Broken())
+
+        assert activity.flush(db.session) == 1
+
+        db.session.refresh(user)
+        assert user.sign_in_count == old_sign_in_count + 2
+        assert user.last_sign_in_ip == '10.0.0.1'
+        assert user.current_sign_in_ip == '10.0.0.2'
+    finally:
+        current_app.config['ACTIVITY_WRITE_BEHIND'] = False
+
+
 def test_login_user_incorrect_password(client, users):
     response = client.post(
         '/api/auth/login',
@@ -149,6 +192,88 @@ def test_logout_user(client, token):
     assert response.status_code == 200
     assert 'logged out' in data.get('message')
 
+    response = client.get(
+        '/api/auth/user',
+        headers={'Authorization': f'Bearer {token}'}
+    )
+    assert response.status_code == 401
+
+
+def test_logout_only_revokes_used_token(client, users):
+    user = User.find_by_identity('adminuser@test.com')
+    token = user.encode_auth_token(user.id).decode()
+    other = user.encode_auth_token(user.id).decode()
+
+    response = client.get(
+        '/api/auth/logout',
+        headers={'Authorization': f'Bearer {token}'}
+    )
+    assert response.status_code == 200
+
+    response = client.get(
+        '/api/auth/user',
+        headers={'Authorization': f'Bearer {other}'}
+    )
+    assert response.status_code == 200
+
+
+def test_logout_everywhere(client, users):
+    user = User.find_by_identity('adminuser@test.com')
+    token = user.encode_auth_token(user.id).decode()
+    other = user.encode_auth_token(user.id).decode()
+
+    response = client.get(
+        '/api/auth/logout?all=true',
+        headers={'Authorization': f'Bearer {token}'}
+    )
+    assert response.status_code == 200
+
+    response = client.get(
+        '/api/auth/user',
+        headers={'Authorization': f'Bearer {other}'}
+    )
+    assert response.status_code == 401
+
+
+def test_change_password(client, token):
+    response = client.put(
+        '/api/auth/change-password',
+        data=json.dumps({
+            'old_password': 'password',
+            'new_password': 'newpassword'
+        }),
+        headers={'Authorization': f'Bearer {token}'},
+        content_type='application/json'
+    )
+    data = json.loads(response.data.decode())
+    assert response.status_code == 200
+    assert User.find_by_identity('adminuser').check_password('newpassword')
+
+    response = client.get(
+        '/api/auth/user',
+        headers={'Authorization': f'Bearer {token}'}
+    )
+    assert response.status_code == 401
+
+    response = client.get(
+        '/api/auth/user',
+        headers={'Authorization': f'Bearer {data.get("token")}'}
+    )
+    assert response.status_code == 200
+
+
+def test_change_password_invalid_credentials(client, token):
+    response = client.put(
+        '/api/auth/change-password',
+        data=json.dumps({
+            'old_password': 'asecret',
+            'new_password': 'newpassword'
+        }),
+        headers={'Authorization': f'Bearer {token}'},
+        content_type='application/json'
+    )
+    assert response.status_code == 401
+
 
 def test_get_user(client, token):
     response = client.get(
@@ -160,3 +285,53 @@ def test_get_user(client, token):
     assert isinstance(data, dict) is True
     assert data.get('username') == 'adminuser'
     assert data.get('profile')['name'] == 'admin'
+
+
+def test_get_user_cached_principal(client, token):
+    db.session.expunge_all()
+    response = client.get(
+        '/api/auth/user',
+        headers={'Authorization': f'Bearer {token}'}
+    )
+    user = User.find_by_identity('adminuser')
+    assert response.status_code == 200
+    assert principals.get(user.id) is not None
+
+    user.is_active = False
+    db.session.flush()
+    assert principals.get(user.id) is not None
+
+    user.save()
+    assert principals.get(user.id) is None
+
+    db.session.expunge_all()
+    response = client.get(
+        '/api/auth/user',
+        headers={'Authorization': f'Bearer {token}'}
+    )
+    assert response.status_code == 401
+
+
+def test_stateless_auth(client, token):
+    current_app.config['AUTH_STATELESS'] = True
+    try:
+        db.session.expunge_all()
+        response = client.get(
+            '/api/auth/user',
+            headers={'Authorization': f'Bearer {token}'}
+        )
+        data = json.loads(response.data.decode())
+        assert response.status_code == 200
+        assert data.get('username') == 'adminuser'
+
+        user = User.find_by_identity('adminuser')
+        user.is_active = False
+        user.save()
+
+        response = client.get(
+            '/api/auth/user',
+            headers={'Authorization': f'Bearer {token}'}
+        )
+        assert response.status_code == 401
+    finally:
+        current_app.config['AUTH_STATELESS'] = False
@@ -0,0 +1,75 @@
+from sqlalchemy import event
+
+from src import db
+from src.utils.bloom import BloomFilter, identities
+from src.tests.utils import add_user
+from src.blueprints.auth.models import User, identity_generation
+
+
+def test_bloom_filter():
+    bloom = BloomFilter(capacity=100, error_rate=0.01)
+    keys = [f'user{i}' for i in range(100)]
+
+    for key in keys:
+        bloom.add(key)
+
+    assert bloom.add('user1') is False
+    assert len(bloom) == 100
+    assert all(key in bloom for key in keys)
+    misses = sum(f'other{i}' in bloom for i in range(1000))
+    assert misses < 50
+
+
+def test_identity_generation(users):
+    user = User.find_by_identity('regularuser')
+    generation = user.identity_gen
+
+    user.sign_in_count += 1
+    user.save()
+    assert user.identity_gen == generation
+
+    user.username = 'renameduser'
+    user.save()
+    assert user.identity_gen > generation
+
+
+def test_identity_filter(users):
+    assert identities.might_exist('regularuser') is True
+    assert identities.might_exist('regularuser@test.com') is True
+    assert identities.might_exist('') is False
+
+    add_user(name='new', username='newuser', email='newuser@test.com')
+    assert identities.might_exist('newuser') is True
+    assert identities.might_exist('newuser@test.com') is True
+
+
+def test_identity_filter_out_of_order(users):
+    # A generation handed out before the filter catches up, committed after
+    late = db.session.connection().execute(identity_generation)
+    add_user(name='early', username='earlyuser', email='early@test.com')
+    assert identities.might_exist('earlyuser') is True
+
+    add_user(name='late', username='lateuser', email='late@test.com')
+    User.query.filter_by(username='lateuser').update(
+        {'identity_gen': late})
+    db.session.commit()
+    assert identities.might_exist('lateuser') is True
+
+
+def test_identity_filter_refresh_interval(users, monkeypatch):
+    monkeypatch.setattr(identities, 'refresh_interval', 60)
+    identities.might_exist('regularuser')
+    seen = []
+
+    def count(conn, cursor, statement, *args):
+        seen.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', count)
+
+    try:
+        identities.might_exist('regularuser')
+        identities.might_exist('someoneelse')
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count)
+
+    assert seen == []
@@ -0,0 +1,50 @@
+import time
+
+from src.utils.cache import TTLCache
+
+
+def test_cache_get_set():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    assert cache.get('b', 0) == 0
+
+    cache.delete('a')
+    assert 'a' not in cache
+
+
+def test_cache_lru_eviction():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert len(cache) == 2
+    assert 'a' in cache
+    assert 'b' not in cache
+
+
+def test_cache_expiry():
+    cache = TTLCache(maxsize=2, ttl=0.01)
+    cache.set('a', 1)
+    time.sleep(0.02)
+    assert cache.get('a') is None
+
+
+def test_cache_disabled():
+    cache = TTLCache(maxsize=2, ttl=0)
+    cache.set('a', 1)
+    assert cache.get('a') is None
+
+
+def test_cache_set_after_delete():
+    cache = TTLCache(maxsize=2, ttl=60)
+    since = time.monotonic()
+    cache.delete('a')
+    cache.set('a', 1, since)
+    assert cache.get('a') is None
+
+    cache.set('a', 1, time.monotonic())
+    assert cache.get('a') == 1
@@ -0,0 +1,96 @@
+import json
+
+import pytest
+from sqlalchemy import select
+
+from src import db
+from src.utils.counters import like_counts
+from src.blueprints.auth.models import User
+from src.blueprints.posts.models import Post
+
+
+def stored_like_count(post_id):
+    posts = Post.__table__
+    return db.session.execute(select([posts.c.like_count]).where(
+        posts.c.id == post_id)).scalar()
+
+
+@pytest.fixture
+def write_behind(app):
+    """
+    Buffer like counts, flushing them to the test database.
+
+    :param app: Pytest fixture
+    """
+    like_counts.init_app(app, 'LIKE_COUNT')
+    like_counts.enabled = True
+
+    yield like_counts
+
+    like_counts.enabled = False
+    like_counts.flush()
+
+
+def test_like_counts_write_behind(client, token, posts, write_behind):
+    post = Post.query.order_by(Post.id).all()[-1]
+    headers = {'Authorization': f'Bearer {token}'}
+
+    for _ in range(2):
+        response = client.put(f'/api/posts/{post.id}/likes', headers=headers)
+        data = json.loads(response.data.decode())
+        assert data.get('like_count') == 1
+
+    assert stored_like_count(post.id) == 0
+    assert write_behind.pending(Post.__table__, 'like_count', post.id) == 1
+
+    response = client.get(f'/api/posts/{post.id}', headers=headers)
+    data = json.loads(response.data.decode())
+    assert data.get('like_count') == 1
+
+    assert write_behind.flush() == 1
+    assert stored_like_count(post.id) == 1
+    assert write_behind.pending(Post.__table__, 'like_count', post.id) == 0
+
+    response = client.delete(f'/api/posts/{post.id}/likes', headers=headers)
+    data = json.loads(response.data.decode())
+    assert data.get('like_count') == 0
+
+    write_behind.flush()
+    assert stored_like_count(post.id) == 0
+
+
+def test_like_counts_rollback(posts, write_behind):
+    post = Post.query.order_by(Post.id).all()[-1]
+    user = User.find_by_identity('commonuser@test.com')
+
+    assert Post.set_liked(user.id, [post.id], True) == {post.id: 1}
+    db.session.rollback()
+
+    assert write_behind.pending(Post.__table__, 'like_count', post.id) == 0
+    assert write_behind.flush() == 0
+
+
+def test_like_counts_overlapping_flushes(posts, write_behind):
+    id = Post.query.order_by(Post.id).all()[-1].id
+    table = Post.__table__
+    write_behind.interval = 60
+    write_behind.add(table, 'like_count', id, 1)
+    # No such post, nothing to update
+    write_behind.add(table, 'like_count', 0, 1)
+    seen = []
+
+    class Slow(object):
+        def execute(self, *args):
+            # A change and a flush while the first flush is writing
+            write_behind.add(table, 'like_count', id, 1)
+            seen.append(write_behind.flush(blocking=False))
+            seen.append(write_behind.pending(table, 'like_count', id))
+            return db.session.execute(*args)
+
+    assert write_behind.flush(Slow()) == 1
+    assert seen == [0, 2]
+    assert write_behind.pending(table, 'like_count', id) == 1
+    db.session.commit()
+
+    assert write_behind.flush() == 1
+    assert stored_like_count(id) == 2
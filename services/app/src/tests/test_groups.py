@@ -8,31 +8,43 @@ from src.blueprints.admin.models import Group, Permission
 app = create_app(config=TestingConfig)
 
 
-def test_get_group(client, groups):
+def test_get_group(client, groups, token):
     group = Group.find_by_name('test group 1')
-    response = client.get(f'/api/admin/groups/{group.id}',)
+    response = client.get(
+        f'/api/admin/groups/{group.id}',
+        headers={'Authorization': f'Bearer {token}'}
+    )
     data = json.loads(response.data.decode())
     assert response.status_code == 200
     assert data.get('name') == 'test group 1'
 
 
-def test_get_group_invalid_id(client, groups):
-    response = client.get('/api/admin/groups/66853')
+def test_get_group_invalid_id(client, groups, token):
+    response = client.get(
+        '/api/admin/groups/66853',
+        headers={'Authorization': f'Bearer {token}'}
+    )
     data = json.loads(response.data.decode())
     assert response.status_code == 404
     assert 'Group not found' in data.get('message')
     assert 'Not Found' in data.get('error')
 
 
-def test_get_all_groups(client, groups):
-    response = client.get('/api/admin/groups')
+def test_get_all_groups(client, groups, token):
+    response = client.get(
+        '/api/admin/groups',
+        headers={'Authorization': f'Bearer {token}'}
+    )
     data = json.loads(response.data.decode())
     assert response.status_code == 200
     assert len(data.get('items')) == app.config['ITEMS_PER_PAGE']
 
 
-def test_all_groups_with_pagination_first_page(client, groups):
-    response = client.get('/api/admin/groups/page/1')
+def test_all_groups_with_pagination_first_page(client, groups, token):
+    response = client.get(
+        '/api/admin/groups/page/1',
+        headers={'Authorization': f'Bearer {token}'}
+    )
     data = json.loads(response.data.decode())
     assert response.status_code == 200
     assert len(data.get('items')) <= app.config['ITEMS_PER_PAGE']
@@ -40,8 +52,11 @@ def test_all_groups_with_pagination_first_page(client, groups):
     assert data.get('prev_url') is None
 
 
-def test_all_groups_with_pagination_last_page(client, groups):
-    response = client.get('/api/admin/groups/page/2')
+def test_all_groups_with_pagination_last_page(client, groups, token):
+    response = client.get(
+        '/api/admin/groups/page/2',
+        headers={'Authorization': f'Bearer {token}'}
+    )
     data = json.loads(response.data.decode())
     assert response.status_code == 200
     assert len(data.get('items')) <= app.config['ITEMS_PER_PAGE']
@@ -49,53 +64,57 @@ def test_all_groups_with_pagination_last_page(client, groups):
     assert data.get('next_url') is None
 
 
-def test_add_group_no_data(client):
+def test_add_group_no_data(client, token):
     response = client.post(
         '/api/admin/groups',
         data=json.dumps({}),
-        content_type='application/json'
+        content_type='application/json',
+        headers={'Authorization': f'Bearer {token}'}
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 400
     assert 'No input data provided' in data.get('message')
 
 
-def test_add_group_invalid_data(client):
+def test_add_group_invalid_data(client, token):
     response = client.post(
         '/api/admin/groups',
         data=json.dumps({
             'name': 'co/d^mmon',
             'description': 'just a common group',
         }),
-        content_type='application/json'
+        content_type='application/json',
+        headers={'Authorization': f'Bearer {token}'}
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 422
     assert data.get('message') is not None
 
 
-def test_add_group_duplicate_name(client, groups):
+def test_add_group_duplicate_name(client, groups, token):
     response = client.post(
         '/api/admin/groups',
         data=json.dumps({
             'name': 'test group 1',
             'description': 'Another common group',
         }),
-        content_type='application/json'
+        content_type='application/json',
+        headers={'Authorization': f'Bearer {token}'}
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 400
     assert 'Group already exist.' in data.get('message')
 
 
-def test_add_group_valid(client, groups):
+def test_add_group_valid(client, groups, token):
     response = client.post(
         '/api/admin/groups',
         data=json.dumps({
             'name': 'test group 4',
             'description': 'just a test group',
         }),
-        content_type='application/json'
+        content_type='application/json',
+        headers={'Authorization': f'Bearer {token}'}
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 201
@@ -104,7 +123,7 @@ def test_add_group_valid(client, groups):
     assert data.get('name') == 'test group 4'
 
 
-def test_update_group_duplicate_name(client, groups):
+def test_update_group_duplicate_name(client, groups, token):
     group = Group.find_by_name('test group 2')
     response = client.put(
         f'/api/admin/groups/{group.id}',
@@ -112,38 +131,41 @@ def test_update_group_duplicate_name(client, groups):
             'name': 'test group 1',
             'description': 'just a common group',
         }),
-        content_type='application/json'
+        content_type='application/json',
+        headers={'Authorization': f'Bearer {token}'}
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 400
     assert 'Group already exists.' in data.get('message')
 
 
-def test_update_group_no_data(client, groups):
+def test_update_group_no_data(client, groups, token):
     group = Group.find_by_name('test group 2')
     response = client.put(
         f'/api/admin/groups/{group.id}',
         data=json.dumps({}),
-        content_type='application/json'
+        content_type='application/json',
+        headers={'Authorization': f'Bearer {token}'}
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 400
     assert 'No input data provided' in data.get('message')
 
 
-def test_update_group_invalid_data(client, groups):
+def test_update_group_invalid_data(client, groups, token):
     group = Group.find_by_name('test group 2')
     response = client.put(
         f'/api/admin/groups/{group.id}',
         data=json.dumps({'name': 'tr*st1'}),
-        content_type='application/json'
+        content_type='application/json',
+        headers={'Authorization': f'Bearer {token}'}
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 422
     assert data.get('message') is not None
 
 
-def test_update_group(client, groups):
+def test_update_group(client, groups, token):
     group = Group.find_by_name('test group 2')
     response = client.put(
         f'/api/admin/groups/{group.id}',
@@ -151,7 +173,8 @@ def test_update_group(client, groups):
             'description': 'test group',
             'name': 'test group',
         }),
-        content_type='application/json'
+        content_type='application/json',
+        headers={'Authorization': f'Bearer {token}'}
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 200
@@ -159,22 +182,28 @@ def test_update_group(client, groups):
     assert data.get('name') == 'test group'
 
 
-def test_delete_group(client, groups):
+def test_delete_group(client, groups, token):
     group = Group.find_by_name('test group 2')
-    response = client.delete(f'/api/admin/groups/{group.id}')
+    response = client.delete(
+        f'/api/admin/groups/{group.id}',
+        headers={'Authorization': f'Bearer {token}'}
+    )
     data = json.loads(response.data.decode())
     assert response.status_code == 200
     assert 'deleted group' in data.get('message')
 
 
-def test_delete_group_invalid_id(client, groups):
-    response = client.delete('/api/admin/groups/333')
+def test_delete_group_invalid_id(client, groups, token):
+    response = client.delete(
+        '/api/admin/groups/333',
+        headers={'Authorization': f'Bearer {token}'}
+    )
     data = json.loads(response.data.decode())
     assert response.status_code == 404
     assert 'Group does not exist.' in data.get('message')
 
 
-def test_add_group_members(client, users, groups):
+def test_add_group_members(client, users, groups, token):
     user1 = User.find_by_identity('adminuser@test.com')
     user2 = User.find_by_identity('regularuser@test.com')
     group = Group.find_by_name('test group 1')
@@ -182,16 +211,43 @@ def test_add_group_members(client, users, groups):
     response = client.put(
         f'/api/admin/groups/{group.id}/members',
         content_type='application/json',
-        data=json.dumps({'users': [user1.id, user2.id]})
+        data=json.dumps({'users': [user1.id, user2.id]}),
+        headers={'Authorization': f'Bearer {token}'}
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 200
     assert len(data.get('members')) == 2
     assert data.get('members')[0]['username'] == 'adminuser'
     assert data.get('members')[1]['username'] == 'regularuser'
+    assert data.get('added') == 2
+    assert data.get('unchanged') == 0
+
+    response = client.put(
+        f'/api/admin/groups/{group.id}/members',
+        content_type='application/json',
+        data=json.dumps({'users': [user1.id, 66853]}),
+        headers={'Authorization': f'Bearer {token}'}
+    )
+    data = json.loads(response.data.decode())
+    assert response.status_code == 200
+    assert data.get('added') == 0
+    assert data.get('unchanged') == 1
+    assert data.get('not_found') == 1
+
+
+def test_add_group_members_invalid_ids(client, groups, token):
+    group = Group.find_by_name('test group 1')
+
+    response = client.put(
+        f'/api/admin/groups/{group.id}/members',
+        content_type='application/json',
+        data=json.dumps({'users': ['abc']}),
+        headers={'Authorization': f'Bearer {token}'}
+    )
+    assert response.status_code == 400
 
 
-def test_remove_group_members(client, users, groups):
+def test_remove_group_members(client, users, groups, token):
     user1 = User.find_by_identity('adminuser@test.com')
     user2 = User.find_by_identity('regularuser@test.com')
     group = Group.find_by_name('test group 3')
@@ -201,14 +257,15 @@ def test_remove_group_members(client, users, groups):
     response = client.delete(
         f'/api/admin/groups/{group.id}/members',
         content_type='application/json',
-        data=json.dumps({'users': [user1.id, user2.id]})
+        data=json.dumps({'users': [user1.id, user2.id]}),
+        headers={'Authorization': f'Bearer {token}'}
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 200
     assert len(data.get('members')) == 0
 
 
-def test_add_group_perms(client, groups):
+def test_add_group_perms(client, groups, token):
     name1 = Permission.set_code_name('can view groups')
     name2 = Permission.set_code_name('can delete users')
     perm1 = Permission.find_by_name(name1)
@@ -218,7 +275,8 @@ def test_add_group_perms(client, groups):
     response = client.put(
         f'/api/admin/groups/{group.id}/permissions',
         content_type='application/json',
-        data=json.dumps({'perms': [perm1.id, perm2.id]})
+        data=json.dumps({'perms': [perm1.id, perm2.id]}),
+        headers={'Authorization': f'Bearer {token}'}
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 200
@@ -227,7 +285,7 @@ def test_add_group_perms(client, groups):
     assert data.get('permissions')[0]['name'] == 'can delete users'
 
 
-def test_remove_group_perms(client, groups):
+def test_remove_group_perms(client, groups, token):
     name1 = Permission.set_code_name('can view groups')
     name2 = Permission.set_code_name('can delete users')
     perm1 = Permission.find_by_name(name1)
@@ -239,8 +297,82 @@ def test_remove_group_perms(client, groups):
     response = client.delete(
         f'/api/admin/groups/{group.id}/permissions',
         content_type='application/json',
-        data=json.dumps({'perms': [perm1.id, perm2.id]})
+        data=json.dumps({'perms': [perm1.id, perm2.id]}),
+        headers={'Authorization': f'Bearer {token}'}
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 200
     assert len(data.get('permissions')) == 0
+
+
+def test_admin_routes_require_auth(client, groups):
+    response = client.get('/api/admin/groups')
+    assert response.status_code == 403
+
+
+def test_admin_routes_require_permission(client, groups):
+    user = User.find_by_identity('regularuser@test.com')
+    token = user.encode_auth_token(user.id).decode()
+    headers = {'Authorization': f'Bearer {token}'}
+
+    response = client.get('/api/admin/groups', headers=headers)
+    data = json.loads(response.data.decode())
+    assert response.status_code == 403
+    assert 'Permission denied' in data.get('message')
+
+    perm = Permission.find_by_name('can_view_groups')
+    group = Group.find_by_name('test group 1')
+    group.add_members([user])
+    group.add_permissions([perm])
+
+    response = client.get('/api/admin/groups', headers=headers)
+    assert response.status_code == 200
+
+
+def test_set_group_members(client, users, groups, token):
+    user1 = User.find_by_identity('adminuser@test.com')
+    user2 = User.find_by_identity('regularuser@test.com')
+    user3 = User.find_by_identity('commonuser@test.com')
+    group = Group.find_by_name('test group 2')
+    group.add_members([user1, user2])
+
+    response = client.patch(
+        f'/api/admin/groups/{group.id}/members',
+        content_type='application/json',
+        data=json.dumps({'users': [user2.id, user3.id]}),
+        headers={'Authorization': f'Bearer {token}'}
+    )
+    data = json.loads(response.data.decode())
+    assert response.status_code == 200
+    assert {member['id'] for member in data.get('members')} == {
+        user2.id, user3.id}
+    assert data.get('added') == 1
+    assert data.get('removed') == 1
+    assert data.get('unchanged') == 1
+
+
+def test_set_group_permissions(client, groups, token):
+    perm = Permission.find_by_name('can_view_groups')
+    group = Group.find_by_name('test group 2')
+    group.add_permissions([Permission.find_by_name('can_add_groups')])
+
+    response = client.patch(
+        f'/api/admin/groups/{group.id}/permissions',
+        content_type='application/json',
+        data=json.dumps({'perms': [perm.id]}),
+        headers={'Authorization': f'Bearer {token}'}
+    )
+    data = json.loads(response.data.decode())
+    assert response.status_code == 200
+    assert [p['code_name'] for p in data.get('permissions')] == [
+        'can_view_groups']
+
+    response = client.patch(
+        f'/api/admin/groups/{group.id}/permissions',
+        content_type='application/json',
+        data=json.dumps({'perms': []}),
+        headers={'Authorization': f'Bearer {token}'}
+    )
+    data = json.loads(response.data.decode())
+    assert data.get('permissions') == []
+    assert data.get('removed') == 1
@@ -0,0 +1,99 @@
+import json
+
+import pytest
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS
+
+from src.utils.hashing import hasher, calibrate, PasswordHasher, \
+    HashingPoolBusy
+from src.blueprints.auth.models import User
+
+
+def test_hasher_pool():
+    pool = PasswordHasher(workers=1, queue_depth=1)
+    try:
+        pwhash = pool.generate('password')
+        assert pwhash.startswith('pbkdf2:')
+        assert pool.check(pwhash, 'password') is True
+        assert pool.check(pwhash, 'secret') is False
+    finally:
+        pool.shutdown()
+
+
+def test_hasher_pool_saturated():
+    pool = PasswordHasher(workers=1, queue_depth=0)
+    try:
+        pool._slots.acquire()
+        with pytest.raises(HashingPoolBusy):
+            pool.generate('password')
+    finally:
+        pool.shutdown()
+
+
+def test_login_hashing_pool_saturated(client, users, monkeypatch):
+    def busy(*args):
+        raise HashingPoolBusy()
+
+    monkeypatch.setattr(hasher, 'check', busy)
+    response = client.post(
+        '/api/auth/login',
+        data=json.dumps({
+            'identity': 'regularuser@test.com',
+            'password': 'password'
+        }),
+        content_type='application/json'
+    )
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(hasher.retry_after)
+
+
+def test_hasher_needs_rehash():
+    pool = PasswordHasher(method='pbkdf2:sha256')
+    assert pool.method == f'pbkdf2:sha256:{DEFAULT_PBKDF2_ITERATIONS}'
+    assert pool.needs_rehash(f'{pool.method}$salt$hash') is False
+    assert pool.needs_rehash('pbkdf2:sha256:50000$salt$hash') is True
+
+
+def test_calibrate():
+    method, elapsed = calibrate(0.005, rounds=1)
+    assert method.startswith('pbkdf2:sha256:')
+    assert elapsed > 0
+
+
+def test_check_password_does_not_rehash(users, monkeypatch):
+    monkeypatch.setattr(hasher, 'method', 'pbkdf2:sha256:2000')
+    user = User.find_by_identity('regularuser')
+    old_password = user.password
+    assert user.check_password('password') is True
+    assert user.password == old_password
+
+
+def test_login_rehashes_password(client, users, monkeypatch):
+    monkeypatch.setattr(hasher, 'method', 'pbkdf2:sha256:2000')
+    response = client.post(
+        '/api/auth/login',
+        data=json.dumps({
+            'identity': 'regularuser@test.com',
+            'password': 'password'
+        }),
+        content_type='application/json'
+    )
+    user = User.find_by_identity('regularuser')
+    assert response.status_code == 200
+    assert user.password.startswith('pbkdf2:sha256:2000$')
+    assert user.check_password('password') is True
+
+
+def test_hasher_pool_recovers_from_dead_worker():
+    pool = PasswordHasher(workers=1, queue_depth=1)
+    try:
+        pool.generate('password')
+        for process in pool._pool._processes.values():
+            process.kill()
+            process.join()
+
+        with pytest.raises(HashingPoolBusy):
+            pool.generate('password')
+
+        assert pool.generate('password').startswith('pbkdf2:')
+    finally:
+        pool.shutdown()
@@ -0,0 +1,97 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event, inspect
+
+from src import db
+from src.utils.loading import eager_options
+from src.utils.serializers import fast_dump
+from src.blueprints.auth.models import User
+from src.blueprints.posts.models import Post
+from src.blueprints.users.schema import UserSchema
+from src.blueprints.posts.schema import PostSchema
+from src.tests.utils import add_user, add_post
+
+
+@contextmanager
+def statements():
+    """Collect the SQL statements run in the block"""
+    seen = []
+
+    def count(conn, cursor, statement, *args):
+        seen.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', count)
+
+    try:
+        yield seen
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count)
+
+
+def test_eager_options_follow_schema():
+    options = eager_options(User, UserSchema())
+
+    # The profile, permissions, followers and followed, the last two
+    # with their columns other than id left out
+    assert len(options) == 6
+    assert len(eager_options(
+        User, UserSchema(exclude=('followers', 'followed')))) == 2
+
+
+def test_eager_options_nested():
+    options = eager_options(Post, PostSchema())
+
+    # The author, the author's profile and the comments, the author and
+    # the comments with the columns they don't dump left out
+    assert len(options) == 5
+
+
+def test_eager_options_sparse_columns(users):
+    schema = UserSchema(many=True, only=('id', 'username'))
+    options = eager_options(User, schema)
+    db.session.expire_all()
+
+    assert len(options) == 1
+
+    items = User.query.options(*options).all()
+    loaded = inspect(items[0]).dict
+
+    assert 'username' in loaded and 'id' in loaded
+    assert 'password' not in loaded and 'email' not in loaded
+    assert fast_dump(schema, items) == schema.dump(items)
+
+
+def dump_users(schema):
+    db.session.expire_all()
+
+    with statements() as seen:
+        users = User.query.options(*eager_options(User, schema)).all()
+        schema.dump(users)
+
+    return len(seen)
+
+
+def test_eager_loading_constant_queries(users):
+    schema = UserSchema(many=True)
+    few = dump_users(schema)
+
+    for i in range(5):
+        user = add_user(
+            name=f'extra {i}', username=f'extra{i}',
+            email=f'extra{i}@test.com')
+        user.follow(User.find_by_identity('adminuser@test.com'))
+        add_post(f'post {i}', user.id)
+
+    assert dump_users(schema) == few
+
+
+def test_eager_loading_posts(posts):
+    schema = PostSchema(many=True)
+    db.session.expire_all()
+
+    with statements() as seen:
+        items = Post.query.options(*eager_options(Post, schema)).all()
+        data = schema.dump(items)
+
+    assert len(seen) == 2
+    assert all(post['author']['profile'] for post in data)
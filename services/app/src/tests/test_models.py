@@ -3,6 +3,9 @@ from src import db
 from src.blueprints.auth.models import User
 from src.blueprints.profiles.models import Profile
 from src.blueprints.admin.models import Group, Permission
+from src.blueprints.posts.models import Post, Comment
+from src.utils.counters import counters, reconcile
+from src.tests.utils import add_comment
 
 
 # auth
@@ -51,6 +54,16 @@ def test_decode_token_invalid(token):
 #     assert 'Signature expired', payload
 
 
+def test_deactivate_bumps_auth_version(users):
+    user = User.find_by_identity('regularuser@test.com')
+    version = user.auth_version
+    db.session.expire(user)
+
+    user.is_active = False
+    db.session.commit()
+    assert user.auth_version == version + 1
+
+
 def test_follow(users):
     u1 = User.find_by_identity('regularuser@test.com')
     u2 = User.find_by_identity('commonuser@test.com')
@@ -64,12 +77,76 @@ def test_follow(users):
     assert u1.followed.first().username == 'commonuser'
     assert u2.followers.count() == 1
     assert u2.followers.first().username == 'regularuser'
+    assert u1.following_count == 1
+    assert u2.follower_count == 1
 
     u1.unfollow(u2)
     db.session.commit()
     assert u1.is_following(u2) is False
     assert u1.followed.count() == 0
     assert u2.followers.count() == 0
+    assert u1.following_count == 0
+    assert u2.follower_count == 0
+
+
+def test_post_counters(posts):
+    admin = User.find_by_identity('adminuser@test.com')
+    user = User.find_by_identity('commonuser@test.com')
+    post = Post.query.filter_by(user_id=admin.id).order_by(Post.id).first()
+    assert admin.post_count == 2
+    assert post.like_count == 1
+    assert post.comment_count == 1
+
+    post.like(user)
+    post.like(user)
+    db.session.commit()
+    assert post.like_count == 2
+
+    post.unlike(user)
+    db.session.commit()
+    assert post.like_count == 1
+
+    comment = add_comment('counted', user.id, post_id=post.id)
+    assert post.comment_count == 2
+
+    comment.delete()
+    assert post.comment_count == 1
+
+    post.delete()
+    assert admin.post_count == 1
+
+
+def test_delete_user_releases_counters(posts):
+    admin = User.find_by_identity('adminuser@test.com')
+    user = User.find_by_identity('commonuser@test.com')
+    post = Post.query.filter_by(user_id=admin.id).order_by(Post.id).first()
+    post.like(user)
+    comment = add_comment('counted', user.id, post_id=post.id)
+    add_comment('reply', user.id, post_id=post.id, comment_id=comment.id)
+    assert post.like_count == 2
+    assert post.comment_count == 3
+    assert comment.reply_count == 1
+
+    user.delete()
+    assert admin.follower_count == 0
+    assert post.like_count == 1
+    # The user's comments stay, without an author
+    assert post.comment_count == 3
+    assert comment.reply_count == 1
+    assert Comment.query.with_parent(post).count() == 3
+
+
+def test_reconcile_counters(posts):
+    users = User.__table__
+    admin = User.find_by_identity('adminuser@test.com')
+    db.session.execute(users.update().where(users.c.id == admin.id).values(
+        follower_count=5, post_count=0))
+    db.session.commit()
+
+    assert sum(reconcile(*counter, chunk=1) for counter in counters()) == 2
+    assert admin.follower_count == 1
+    assert admin.post_count == 2
+    assert sum(reconcile(*counter) for counter in counters()) == 0
 
 
 def test_user_perms(users):
@@ -107,16 +184,36 @@ def test_user_get_all_perms(users, groups):
     assert user.has_permissions([perm1.code_name, perm2.code_name]) is True
 
 
+def test_user_perm_ids_are_cached(users, groups):
+    perm = Permission.find_by_name(Permission.set_code_name('can add users'))
+    user = User.find_by_identity('adminuser@test.com')
+    grp = Group.find_by_name('test group 1')
+
+    assert user.get_perm_ids() == frozenset()
+    assert user.get_perm_ids() is user.get_perm_ids()
+
+    grp.add_members([user])
+    grp.add_permissions([perm])
+    assert user.get_perm_ids() == {perm.id}
+
+    grp.remove_members([user])
+    assert user.has_permission(perm.code_name) is False
+    assert user.has_permissions([perm.code_name, 'unknown']) is False
+
+
 def test_group_members(users, groups):
     admin = User.find_by_identity('adminuser@test.com')
     regular = User.find_by_identity('regularuser@test.com')
     grp = Group.find_by_name('test group 1')
 
-    grp.add_members([regular, admin])
+    assert grp.add_members([regular, admin]) == {
+        'added': 2, 'unchanged': 0, 'not_found': 0}
     assert grp.is_group_member(regular) is True
     assert grp.members.count() == 2
+    assert grp.add_members([regular.id])['unchanged'] == 1
 
-    grp.remove_members([regular])
+    assert grp.remove_members([regular, regular.id + 1000]) == {
+        'removed': 1, 'unchanged': 1}
     assert grp.is_group_member(regular) is False
     assert grp.members.count() == 1
 
@@ -0,0 +1,71 @@
+from datetime import datetime
+
+import pytest
+
+from src import db
+from src.utils.pagination import paginate, encode_cursor, decode_cursor, \
+    InvalidCursor
+from src.blueprints.auth.models import User
+from src.blueprints.posts.models import Post
+from src.tests.utils import add_post
+
+
+def test_cursor_round_trip():
+    now = datetime.utcnow()
+    cursor = encode_cursor('next', [now, 7])
+
+    assert decode_cursor(cursor, (Post.created_on, Post.id)) == \
+        ('next', (now, 7))
+
+
+@pytest.mark.parametrize('cursor', [
+    'nope', encode_cursor('back', [1]), encode_cursor('next', [1])])
+def test_invalid_cursor(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor, (Post.created_on, Post.id))
+
+
+def test_paginate_ties(posts):
+    user = User.find_by_identity('commonuser@test.com')
+    created_on = datetime.utcnow()
+
+    for i in range(4):
+        add_post(f'tied {i}', user.id).created_on = created_on
+
+    db.session.commit()
+
+    query = Post.query.with_parent(user)
+    columns = (Post.created_on, Post.id)
+    seen = []
+    page = paginate(query, columns, 2)
+    assert page.has_prev is False
+
+    while True:
+        seen.extend(post.id for post in page.items)
+
+        if not page.has_next:
+            break
+
+        page = paginate(query, columns, 2, cursor=page.next)
+
+    assert len(seen) == 5
+    assert seen == sorted(seen, reverse=True)
+
+    page = paginate(query, columns, 2, cursor=page.prev)
+    assert [post.id for post in page.items] == seen[2:4]
+    assert page.has_next is True
+    assert page.has_prev is True
+
+
+def test_paginate_page_numbers(posts):
+    user = User.find_by_identity('adminuser@test.com')
+    query = Post.query.with_parent(user)
+    columns = (Post.created_on, Post.id)
+
+    page = paginate(query, columns, 1, page=2)
+    assert len(page.items) == 1
+    assert page.has_next is False
+    assert page.has_prev is True
+
+    page = paginate(query, columns, 1, cursor=page.prev)
+    assert page.items == paginate(query, columns, 1, page=1).items
@@ -0,0 +1,58 @@
+import pytest
+
+from src import db as _db
+from src.utils.perms import apply_manifest, PERMISSIONS
+from src.utils.permissions import permission_registry
+from src.blueprints.admin.models import Model, Permission
+
+
+@pytest.fixture(scope='function')
+def registry(app, db):
+    # Other tests create apps with other configs, load it for this one
+    permission_registry.init_app(app)
+    return permission_registry
+
+
+def test_registry_lookups(registry):
+    perm = Permission.query.filter(
+        Permission.code_name == 'can_view_users').first()
+
+    assert registry.loaded is True
+    assert registry.id_for('can_view_users') == perm.id
+    assert registry.ids_for(['can_view_users', 'unknown']) == [
+        perm.id, None]
+    assert registry.get(perm.id) is perm
+    assert Permission.find_by_name('unknown') is None
+
+
+def test_registry_reloads_on_commit(registry, session):
+    model = Model(name='registry tests')
+    model.save()
+    perm = Permission(name='can test registry')
+    perm.model_id = model.id
+    perm.save()
+
+    assert registry.id_for('can_test_registry') == perm.id
+
+
+def test_registry_notices_other_workers(app, registry, session):
+    model = Model.query.filter(Model.name == 'users').first()
+
+    with _db.get_engine(app).begin() as connection:
+        connection.execute(Permission.__table__.insert().values(
+            name='can audit users', code_name='can_audit_users',
+            model_id=model.id))
+
+    assert registry.id_for('can_audit_users') is None
+
+    registry._checked_on = 0
+    assert registry.id_for('can_audit_users') is not None
+
+
+def test_apply_manifest(registry, session):
+    assert apply_manifest(PERMISSIONS) == 0
+    assert apply_manifest({'manifests': ('view', 'edit')}) == 2
+    assert apply_manifest({'manifests': ('view', 'share')}) == 1
+
+    assert Model.query.filter(Model.name == 'manifests').count() == 1
+    assert registry.id_for('can_share_manifests') is not None
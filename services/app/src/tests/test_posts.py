@@ -1,15 +1,20 @@
 import json
 
-from src import create_app
+from sqlalchemy import event
+
+from src import create_app, db
 from src.config import TestingConfig
-from src.blueprints.posts.models import Post
+from src.utils.timeline import timeline
+from src.blueprints.auth.models import User
+from src.blueprints.posts.models import Post, Comment, timelines
+from src.tests.utils import add_post, add_comment
 
 
 app = create_app(config=TestingConfig)
 
 
 def test_get_post(client, token, posts):
-    post = Post.query.all()[0]
+    post = Post.query.order_by(Post.id).all()[0]
     response = client.get(
         f'/api/posts/{post.id}',
         headers={'Authorization': f'Bearer {token}'}
@@ -17,6 +22,73 @@ def test_get_post(client, token, posts):
     data = json.loads(response.data.decode())
     assert response.status_code == 200
     assert isinstance(data, dict) is True
+    assert data.get('like_count') == 1
+    assert data.get('liked_by_me') is True
+    assert 'likes' not in data
+    assert 'recent_likers' not in data
+
+
+def test_get_post_fields(client, token, posts):
+    post = Post.query.order_by(Post.id).all()[0]
+    response = client.get(
+        f'/api/posts/{post.id}?fields=id,like_count,author.username',
+        headers={'Authorization': f'Bearer {token}'}
+    )
+    data = json.loads(response.data.decode())
+    assert response.status_code == 200
+    assert data == {
+        'id': post.id, 'like_count': 1, 'author': {'username': 'adminuser'}}
+
+
+def test_get_post_recent_likers(client, token, posts):
+    post = Post.query.order_by(Post.id).all()[0]
+    user = User.find_by_identity('commonuser@test.com')
+    post.like(user)
+    post.save()
+
+    response = client.get(
+        f'/api/posts/{post.id}?likers=1',
+        headers={'Authorization': f'Bearer {token}'}
+    )
+    data = json.loads(response.data.decode())
+    assert data.get('like_count') == 2
+    assert [liker['username'] for liker in data.get('recent_likers')] == \
+        ['commonuser']
+
+
+def test_get_likers(client, token, posts):
+    post = Post.query.order_by(Post.id).all()[0]
+    post.like(User.find_by_identity('commonuser@test.com'))
+    post.like(User.find_by_identity('regularuser@test.com'))
+    post.save()
+    headers = {'Authorization': f'Bearer {token}'}
+
+    response = client.get(f'/api/posts/{post.id}/likes', headers=headers)
+    data = json.loads(response.data.decode())
+    assert response.status_code == 200
+    assert data.get('count') == 3
+    assert data.get('hasNext') is True
+
+    # Latest likes first
+    assert [liker['username'] for liker in data.get('likers')] == \
+        ['regularuser', 'commonuser']
+
+    response = client.get(
+        f'/api/posts/{post.id}/likes?cursor={data.get("next")}',
+        headers=headers
+    )
+    data = json.loads(response.data.decode())
+    assert [liker['username'] for liker in data.get('likers')] == \
+        ['adminuser']
+    assert data.get('hasNext') is False
+
+    response = client.get(
+        f'/api/posts/{post.id}/likes?cursor={data.get("prev")}',
+        headers=headers
+    )
+    data = json.loads(response.data.decode())
+    assert [liker['username'] for liker in data.get('likers')] == \
+        ['regularuser', 'commonuser']
 
 
 # def test_get_top_post(client, token):
@@ -56,7 +128,7 @@ def test_create_post(client, token):
 
 
 def test_update_post(client, token, posts):
-    post = Post.query.all()[0]
+    post = Post.query.order_by(Post.id).all()[0]
     response = client.put(
         f'/api/posts/{post.id}',
         data=json.dumps({'post': 'ullamco laboris nisi ut'}),
@@ -69,7 +141,7 @@ def test_update_post(client, token, posts):
 
 
 def test_update_post_invalid(client, token, posts):
-    post = Post.query.all()[-1]
+    post = Post.query.order_by(Post.id).all()[-1]
     response = client.put(
         f'/api/posts/{post.id}',
         data=json.dumps({'post': 'ullamco laboris nisi ut'}),
@@ -80,7 +152,7 @@ def test_update_post_invalid(client, token, posts):
 
 
 def test_delete_post(client, token, posts):
-    post = Post.query.all()[0]
+    post = Post.query.order_by(Post.id).all()[0]
     response = client.delete(
         f'/api/posts/{post.id}',
         headers={'Authorization': f'Bearer {token}'}
@@ -91,7 +163,7 @@ def test_delete_post(client, token, posts):
 
 
 def test_delete_post_invalid(client, token, posts):
-    post = Post.query.all()[-1]
+    post = Post.query.order_by(Post.id).all()[-1]
     response = client.delete(
         f'/api/posts/{post.id}',
         headers={'Authorization': f'Bearer {token}'}
@@ -100,7 +172,7 @@ def test_delete_post_invalid(client, token, posts):
 
 
 def test_like_post(client, token, posts):
-    post = Post.query.all()[-1]
+    post = Post.query.order_by(Post.id).all()[-1]
     response = client.post(
         f'/api/posts/{post.id}/likes',
         headers={'Authorization': f'Bearer {token}'}
@@ -111,7 +183,7 @@ def test_like_post(client, token, posts):
 
 
 def test_unlike_post(client, token, posts):
-    post = Post.query.all()[0]
+    post = Post.query.order_by(Post.id).all()[0]
     response = client.post(
         f'/api/posts/{post.id}/likes',
         headers={'Authorization': f'Bearer {token}'}
@@ -121,8 +193,60 @@ def test_unlike_post(client, token, posts):
     assert isinstance(data, dict) is True
 
 
+def test_put_delete_like(client, token, posts):
+    post = Post.query.order_by(Post.id).all()[-1]
+    headers = {'Authorization': f'Bearer {token}'}
+
+    for _ in range(2):
+        response = client.put(f'/api/posts/{post.id}/likes', headers=headers)
+        data = json.loads(response.data.decode())
+        assert response.status_code == 200
+        assert data == {'id': post.id, 'like_count': 1, 'liked_by_me': True}
+
+    for _ in range(2):
+        response = client.delete(
+            f'/api/posts/{post.id}/likes', headers=headers)
+        data = json.loads(response.data.decode())
+        assert data.get('like_count') == 0
+
+    response = client.put(f'/api/posts/{post.id + 100}/likes', headers=headers)
+    assert response.status_code == 404
+
+
+def test_batch_likes(client, token, posts):
+    post = Post.query.order_by(Post.id).all()[0]
+    comment = post.comments[0]
+    response = client.post(
+        '/api/posts/likes',
+        data=json.dumps({'likes': [
+            {'post_id': post.id, 'liked': True},
+            {'comment_id': comment.id, 'liked': True},
+            {'post_id': post.id, 'liked': False},
+            {'post_id': post.id + 100, 'liked': True},
+        ]}),
+        headers={'Authorization': f'Bearer {token}'},
+        content_type='application/json'
+    )
+    data = json.loads(response.data.decode())
+    assert response.status_code == 200
+    assert data.get('posts') == [
+        {'id': post.id, 'like_count': 0, 'liked_by_me': False}]
+    assert data.get('comments') == [
+        {'id': comment.id, 'like_count': 1, 'liked_by_me': True}]
+
+
+def test_batch_likes_invalid(client, token):
+    response = client.post(
+        '/api/posts/likes',
+        data=json.dumps({'likes': [{'liked': True}]}),
+        headers={'Authorization': f'Bearer {token}'},
+        content_type='application/json'
+    )
+    assert response.status_code == 422
+
+
 def test_get_comments(client, token, posts):
-    post = Post.query.all()[0]
+    post = Post.query.order_by(Post.id).all()[0]
     response = client.get(
         f'/api/posts/{post.id}/comments/page/1',
         headers={'Authorization': f'Bearer {token}'}
@@ -134,8 +258,176 @@ def test_get_comments(client, token, posts):
     assert data.get('hasNext') is False
 
 
+def add_thread(post, user, replies):
+    """
+    Add a top-level comment with `replies` replies, the first of which
+    has a reply of its own.
+    """
+    root = add_comment('root', user.id, post_id=post.id)
+    children = [
+        add_comment(f'reply {i}', user.id, post_id=post.id,
+                    comment_id=root.id)
+        for i in range(replies)
+    ]
+    add_comment('nested', user.id, post_id=post.id,
+                comment_id=children[0].id)
+
+    return root, children
+
+
+def test_comment_paths(posts):
+    post = Post.query.order_by(Post.id).all()[0]
+    user = User.find_by_identity('adminuser@test.com')
+    root, children = add_thread(post, user, 2)
+    nested = children[0].thread().one()
+
+    assert root.depth == 0 and root.path == f'{root.id:010d}'
+    assert children[1].depth == 1
+    assert children[1].path == f'{root.path}/{children[1].id:010d}'
+    assert nested.depth == 2
+    assert nested.path.startswith(children[0].path + '/')
+
+    db.session.refresh(root)
+    assert root.reply_count == 2
+    assert [c.id for c in root.thread().order_by(Comment.path)] == [
+        children[0].id, nested.id, children[1].id]
+    assert root.thread(1).count() == 2
+
+
+def test_get_comments_replies(client, token, posts):
+    post = Post.query.order_by(Post.id).all()[0]
+    user = User.find_by_identity('adminuser@test.com')
+    root, children = add_thread(post, user, 4)
+
+    response = client.get(
+        f'/api/posts/{post.id}/comments?replies=2&depth=2',
+        headers={'Authorization': f'Bearer {token}'}
+    )
+    data = json.loads(response.data.decode())
+    assert response.status_code == 200
+
+    # Replies are only listed under their parents
+    comment = data['comments'][0]
+    assert [c['id'] for c in data['comments']] == [root.id]
+    assert comment['reply_count'] == 4
+    assert [c['id'] for c in comment['replies']] == [
+        children[0].id, children[1].id]
+    assert len(comment['replies'][0]['replies']) == 1
+    assert comment['replies'][1]['replies'] == []
+    assert comment['liked_by_me'] is False
+
+
+def test_liked_by_me_batched(client, token, posts):
+    user = User.find_by_identity('adminuser@test.com')
+    ids = [post.id for post in Post.query.with_parent(user)]
+
+    assert Post.liked_by(user.id, ids + [0]) == set(ids)
+    assert Post.liked_by(user.id, []) == set()
+
+    response = client.get(
+        '/api/users/adminuser/posts',
+        headers={'Authorization': f'Bearer {token}'}
+    )
+    data = json.loads(response.data.decode())
+    assert [post['liked_by_me'] for post in data['posts']] == [True, True]
+
+
+def test_get_comments_bounded_queries(client, token, posts):
+    post = Post.query.order_by(Post.id).all()[0]
+    user = User.find_by_identity('adminuser@test.com')
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    def comments_page():
+        statements.clear()
+        event.listen(db.engine, 'before_cursor_execute', count)
+
+        try:
+            client.get(
+                f'/api/posts/{post.id}/comments?replies=5&depth=3',
+                headers={'Authorization': f'Bearer {token}'})
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+
+        return len(statements)
+
+    add_thread(post, user, 1)
+    small = comments_page()
+    add_thread(post, user, 6)
+
+    assert comments_page() == small
+
+
+def test_get_replies(client, token, posts):
+    post = Post.query.order_by(Post.id).all()[0]
+    user = User.find_by_identity('adminuser@test.com')
+    root, children = add_thread(post, user, 3)
+    url = f'/api/posts/{post.id}/comments/{root.id}/replies?depth=2'
+    headers = {'Authorization': f'Bearer {token}'}
+    ids = []
+
+    while url:
+        response = client.get(url, headers=headers)
+        data = json.loads(response.data.decode())
+        assert response.status_code == 200
+        assert len(data['replies']) <= app.config['ITEMS_PER_PAGE']
+        assert data['count'] == 3
+
+        ids += [(c['id'], c['depth']) for c in data['replies']]
+        url = data['next'] and f'/api/posts/{post.id}/comments/' \
+            f'{root.id}/replies?depth=2&cursor={data["next"]}'
+
+    nested = children[0].thread().one()
+    assert ids == [
+        (children[0].id, 1), (nested.id, 2),
+        (children[1].id, 1), (children[2].id, 1)]
+
+    response = client.get(
+        f'/api/posts/{post.id}/comments/{root.id}/replies',
+        headers=headers)
+    data = json.loads(response.data.decode())
+    assert [c['id'] for c in data['replies']] == \
+        [children[0].id, children[1].id]
+
+
+def test_backfill_comment_paths(posts):
+    user = User.find_by_identity('adminuser@test.com')
+    post = Post.query.order_by(Post.id).first()
+    root = add_comment('root', user.id, post_id=post.id)
+    reply = add_comment('reply', user.id, post_id=post.id, comment_id=root.id)
+    nested = add_comment(
+        'nested', user.id, post_id=post.id, comment_id=reply.id)
+    thread = [(c.id, c.path, c.depth, c.reply_count)
+              for c in (root, reply, nested)]
+
+    # As comments made before paths were stored
+    comments = Comment.__table__
+    db.session.execute(comments.update().values(
+        path=None, depth=0, reply_count=0))
+    db.session.commit()
+
+    assert Comment.backfill_paths(chunk=1) >= 3
+    assert Comment.backfill_paths() == 0
+
+    db.session.expire_all()
+    assert [(c.id, c.path, c.depth, c.reply_count)
+            for c in (root, reply, nested)] == thread
+    assert [c.id for c in root.thread().order_by(Comment.path)] == \
+        [reply.id, nested.id]
+
+
+def test_get_replies_invalid(client, token, posts):
+    response = client.get(
+        '/api/posts/1/comments/0/replies',
+        headers={'Authorization': f'Bearer {token}'}
+    )
+    assert response.status_code == 404
+
+
 def test_create_comment(client, token, posts):
-    post = Post.query.all()[0]
+    post = Post.query.order_by(Post.id).all()[0]
     response = client.post(
         f'/api/posts/{post.id}/comments',
         data=json.dumps({'comment': 'ullamco laboris nisi ut aliquip ex ea'}),
@@ -148,7 +440,7 @@ def test_create_comment(client, token, posts):
 
 
 def test_update_comment(client, token, posts):
-    post = Post.query.all()[1]
+    post = Post.query.order_by(Post.id).all()[1]
     comment = post.comments[0]
     response = client.put(
         f'/api/posts/{post.id}/comments/{comment.id}',
@@ -162,7 +454,7 @@ def test_update_comment(client, token, posts):
 
 
 def test_update_comment_invalid(client, token, posts):
-    post = Post.query.all()[-1]
+    post = Post.query.order_by(Post.id).all()[-1]
     comment = post.comments[-1]
     response = client.put(
         f'/api/posts/{post.id}/comments/{comment.id}',
@@ -174,7 +466,7 @@ def test_update_comment_invalid(client, token, posts):
 
 
 def test_delete_comment(client, token, posts):
-    post = Post.query.all()[1]
+    post = Post.query.order_by(Post.id).all()[1]
     comment = post.comments[0]
     response = client.delete(
         f'/api/posts/{post.id}/comments/{comment.id}',
@@ -186,7 +478,7 @@ def test_delete_comment(client, token, posts):
 
 
 def test_delete_comment_invalid(client, token, posts):
-    post = Post.query.all()[-1]
+    post = Post.query.order_by(Post.id).all()[-1]
     comment = post.comments[-1]
     response = client.delete(
         f'/api/posts/{post.id}/comments/{comment.id}',
@@ -196,7 +488,7 @@ def test_delete_comment_invalid(client, token, posts):
 
 
 def test_like_comment(client, token, posts):
-    post = Post.query.all()[0]
+    post = Post.query.order_by(Post.id).all()[0]
     comment = post.comments[-1]
     response = client.post(
         f'/api/posts/{post.id}/comments/{comment.id}/likes',
@@ -207,3 +499,147 @@ def test_like_comment(client, token, posts):
     assert isinstance(data, dict) is True
 
 
+def test_home_feed(client, posts):
+    user = User.find_by_identity('commonuser@test.com')
+    token = user.encode_auth_token(user.id).decode()
+    headers = {'Authorization': f'Bearer {token}'}
+
+    response = client.get('/api/posts/home/page/1', headers=headers)
+    data = json.loads(response.data.decode())
+    assert response.status_code == 200
+    assert len(data.get('posts')) == 2
+    assert data.get('hasNext') is True
+
+    assert data.get('prev') is None
+    first = [post['id'] for post in data.get('posts')]
+
+    response = client.get(
+        f'/api/posts/home/page/1?cursor={data.get("next")}',
+        headers=headers
+    )
+    data = json.loads(response.data.decode())
+    assert len(data.get('posts')) == 1
+    assert data.get('hasNext') is False
+    assert data.get('next') is None
+
+    response = client.get(
+        f'/api/posts/home/page/1?cursor={data.get("prev")}',
+        headers=headers
+    )
+    data = json.loads(response.data.decode())
+    assert [post['id'] for post in data.get('posts')] == first
+    assert data.get('prev') is None
+
+    response = client.get(
+        '/api/posts/home/page/1?cursor=nope', headers=headers)
+    assert response.status_code == 400
+
+    response = client.get('/api/posts/home/page/2', headers=headers)
+    data = json.loads(response.data.decode())
+    assert len(data.get('posts')) == 1
+
+
+def test_home_feed_follow(client, posts):
+    admin = User.find_by_identity('adminuser@test.com')
+    user = User.find_by_identity('commonuser@test.com')
+    token = user.encode_auth_token(user.id).decode()
+    headers = {'Authorization': f'Bearer {token}'}
+
+    user.unfollow(admin)
+    user.save()
+    response = client.get('/api/posts/home/page/1', headers=headers)
+    data = json.loads(response.data.decode())
+    assert len(data.get('posts')) == 1
+
+    user.follow(admin)
+    user.save()
+    response = client.get('/api/posts/home/page/1', headers=headers)
+    data = json.loads(response.data.decode())
+    assert data.get('hasNext') is True
+
+
+def test_timeline_trim(posts):
+    user = User.find_by_identity('commonuser@test.com')
+    length = timeline.length
+    timeline.length = 2
+
+    try:
+        add_post('trimmed', user.id)
+        assert len(timeline.read(user.id, 10)[0]) == 4
+        assert timeline.trim_all(chunk=1) == 2
+        assert timeline.trim_all() == 0
+    finally:
+        timeline.length = length
+
+    posts, has_next = timeline.read(user.id, 10)
+    assert [post.body for post in posts][0] == 'trimmed'
+    assert len(posts) == 2
+    assert has_next is False
+
+
+def test_timeline_backfill(posts):
+    admin = User.find_by_identity('adminuser@test.com')
+    user = User.find_by_identity('commonuser@test.com')
+    before = [post.id for post in timeline.read(user.id, 10)[0]]
+    db.session.execute(timelines.delete())
+    db.session.commit()
+    assert timeline.read(user.id, 10)[0] == []
+
+    assert timeline.backfill(chunk=1) > 0
+    assert [post.id for post in timeline.read(user.id, 10)[0]] == before
+    assert timeline.backfill() == 0
+
+    fanout_limit = timeline.fanout_limit
+    timeline.fanout_limit = 0
+    db.session.execute(timelines.delete())
+    db.session.commit()
+
+    try:
+        timeline.backfill()
+    finally:
+        timeline.fanout_limit = fanout_limit
+
+    db.session.expire_all()
+    assert not any(post.fanned_out for post in admin.posts)
+    assert [post.id for post in timeline.read(user.id, 10)[0]] == before
+
+
+def test_timeline_pulled(posts):
+    admin = User.find_by_identity('adminuser@test.com')
+    user = User.find_by_identity('commonuser@test.com')
+    assert admin.follower_count == 1
+    fanout_limit = timeline.fanout_limit
+    timeline.fanout_limit = 0
+
+    try:
+        post = add_post('pulled', admin.id)
+    finally:
+        timeline.fanout_limit = fanout_limit
+
+    assert post.fanned_out is False
+
+    posts, has_next = timeline.read(user.id, 10)
+    assert [post.body for post in posts].count('pulled') == 1
+    assert posts[0].body == 'pulled'
+
+    posts, has_next = timeline.read(user.id, 10, before=post.id)
+    assert 'pulled' not in [post.body for post in posts]
+
+    newer, has_prev = timeline.read(user.id, 1, after=posts[0].id)
+    assert [post.body for post in newer] == ['pulled']
+    assert has_prev is False
+
+    user.unfollow(admin)
+    user.save()
+    assert admin.follower_count == 0
+
+    posts, has_next = timeline.read(user.id, 10)
+    assert 'pulled' not in [post.body for post in posts]
+
+
+def test_unknown_feed(client, token):
+    response = client.get(
+        '/api/posts/nope/page/1',
+        headers={'Authorization': f'Bearer {token}'}
+    )
+    assert response.status_code == 404
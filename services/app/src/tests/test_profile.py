@@ -1,5 +1,9 @@
 import json
 
+from sqlalchemy import event
+
+from src import db
+
 
 def test_get_profile(client, users, token):
     response = client.get(
@@ -13,6 +17,51 @@ def test_get_profile(client, users, token):
     assert data.get('profile')['name'] == 'admin'
 
 
+def test_get_profile_fields(client, users, token):
+    response = client.get(
+        '/api/profile/adminuser?fields=username,profile.avatar',
+        headers={'Authorization': f'Bearer {token}'}
+    )
+    data = json.loads(response.data.decode())
+    assert response.status_code == 200
+    assert set(data) == {'username', 'profile'}
+    assert set(data['profile']) == {'avatar'}
+
+
+def test_get_profile_include(client, users, token):
+    seen = []
+
+    def count(conn, cursor, statement, *args):
+        seen.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', count)
+
+    try:
+        response = client.get(
+            '/api/profile/adminuser?fields=username'
+            '&include=followers,followed,permissions',
+            headers={'Authorization': f'Bearer {token}'}
+        )
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count)
+
+    data = json.loads(response.data.decode())
+    assert response.status_code == 200
+    assert set(data) == {'username', 'followers', 'followed', 'permissions'}
+    assert len(data['followers']) == 1
+
+    # The relationships are selected in along the user, not lazily
+    assert len([s for s in seen if 'users_1.id IN' in s]) == 3
+
+
+def test_get_profile_invalid_nested_field(client, users, token):
+    response = client.get(
+        '/api/profile/adminuser?fields=username,followers.email',
+        headers={'Authorization': f'Bearer {token}'}
+    )
+    assert response.status_code == 400
+
+
 def test_update_profile_valid(client, token):
     response = client.put(
         '/api/profile',
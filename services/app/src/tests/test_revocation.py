@@ -0,0 +1,84 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask
+
+from src.utils.revocation import RevocationList, utc_now
+from src.blueprints.auth.models import revoked_tokens
+
+
+def test_revoke():
+    revocations = RevocationList(backend='local')
+    exp = int(time.time()) + 3600
+    revocations.revoke('a' * 32, exp)
+
+    assert revocations.is_revoked('a' * 32, exp)
+    assert not revocations.is_revoked('b' * 32, exp)
+    assert not revocations.is_revoked(None, exp)
+
+
+def test_expired_buckets_are_evicted():
+    revocations = RevocationList(backend='local', interval=0, granularity=1)
+    revocations.revoke('a' * 32, int(time.time()) - 10)
+    revocations.revoke('b' * 32, int(time.time()) + 3600)
+
+    assert len(revocations) == 1
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / 'revoked')
+    exp = int(time.time()) + 3600
+
+    revocations = RevocationList(backend='local', path=path)
+    revocations.revoke('a' * 32, exp)
+    revocations.save()
+
+    # Another process saving its own list keeps the first one's entries
+    other = RevocationList(backend='local', path=path)
+    other.revoke('b' * 32, exp)
+    other.save()
+
+    loaded = RevocationList(backend='local', path=path)
+    loaded.load()
+
+    assert len(loaded) == 2
+    assert loaded.is_revoked('a' * 32, exp)
+    assert loaded.is_revoked('b' * 32, exp)
+
+
+def test_local_backend_needs_path():
+    app = Flask(__name__)
+    app.config.update(REVOCATION_BACKEND='local')
+
+    with pytest.raises(RuntimeError):
+        RevocationList().init_app(app)
+
+    app.config.update(REVOCATION_LIST_PATH='/tmp/revoked')
+    RevocationList().init_app(app)
+
+
+def test_database_backend(app, session):
+    exp = int(time.time()) + 3600
+    revocations = RevocationList(backend='database')
+    revocations.app = app
+    revocations.revoke('c' * 32, exp)
+
+    other = RevocationList(backend='database')
+    other.sync(session)
+
+    assert other.is_revoked('c' * 32, exp)
+
+
+def test_database_backend_late_commits(app, session):
+    exp = int(time.time()) + 3600
+    other = RevocationList(backend='database', overlap=60)
+    other.sync(session)
+
+    # Created before the last sync, committed after it
+    session.execute(revoked_tokens.insert().values(
+        jti='d' * 32, expires_on=datetime.utcfromtimestamp(exp),
+        created_on=utc_now() - timedelta(seconds=30)))
+    other.sync(session)
+
+    assert other.is_revoked('d' * 32, exp)
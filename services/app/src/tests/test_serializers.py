@@ -0,0 +1,109 @@
+import pytest
+from marshmallow import Schema, fields, post_dump
+
+from src.utils.serializers import fast_dump
+from src.blueprints.auth.models import User
+from src.blueprints.posts.models import Post, Comment
+from src.blueprints.admin.models import Group, Permission
+from src.blueprints.users.schema import UserSchema, follow_context
+from src.blueprints.posts.schema import PostSchema, CommentSchema, \
+    like_context, thread_context
+from src.blueprints.admin.schema import GroupSchema, PermissionSchema
+from src.blueprints.profiles.schema import ProfileSchema
+from src.tests.utils import add_comment
+
+
+def assert_parity(schema, data):
+    assert fast_dump(schema, data) == schema.dump(data)
+
+
+@pytest.mark.parametrize('options', [
+    {},
+    {'only': ('id', 'username', 'profile',)},
+    {'only': ('id', 'username', 'profile.avatar',)},
+    {'exclude': ('permissions', 'followers',)},
+])
+def test_user_parity(users, options):
+    admin = User.find_by_identity('adminuser@test.com')
+
+    assert_parity(UserSchema(many=True, **options), User.query.all())
+    assert_parity(
+        UserSchema(many=True, context=follow_context(admin, [admin]),
+                   **options),
+        User.query.all())
+
+
+@pytest.mark.parametrize('args', ['', '?likers=2'])
+def test_post_parity(app, posts, args):
+    user = User.find_by_identity('adminuser@test.com')
+    items = Post.query.order_by(Post.id).all()
+
+    with app.test_request_context(f'/{args}'):
+        assert_parity(PostSchema(many=True), items)
+        assert_parity(PostSchema(
+            many=True, context=like_context(user, Post, items)), items)
+        assert_parity(PostSchema(
+            only=('id', 'author.username',),
+            context=like_context(user, Post, items)), items[0])
+
+
+def test_comment_parity(app, posts):
+    user = User.find_by_identity('adminuser@test.com')
+    post = Post.query.order_by(Post.id).first()
+    root = add_comment('root', user.id, post_id=post.id)
+    reply = add_comment('reply', user.id, post_id=post.id, comment_id=root.id)
+    add_comment('nested', user.id, post_id=post.id, comment_id=reply.id)
+    items = Comment.query.filter(Comment.comment_id.is_(None)).all()
+
+    with app.test_request_context('/?depth=2&likers=1'):
+        schema = CommentSchema(
+            many=True, context=thread_context(user, items))
+        data = fast_dump(schema, items)
+
+    assert data == schema.dump(items)
+    assert any(comment['replies'] for comment in data)
+
+
+def test_admin_parity(groups):
+    assert_parity(GroupSchema(many=True), Group.query.all())
+    assert_parity(PermissionSchema(many=True), Permission.query.all())
+    assert_parity(
+        ProfileSchema(many=True), [user.profile for user in User.query])
+
+
+def test_parity_edge_cases(users):
+    user = User.find_by_identity('adminuser@test.com')
+    schema = UserSchema(only=('id', 'username', 'created_on',))
+
+    assert fast_dump(schema, None) == schema.dump(None)
+    assert fast_dump(schema, [], many=True) == []
+    assert fast_dump(schema, []) == schema.dump([])
+    assert fast_dump(schema, {'id': 1, 'username': 'x'}) == \
+        schema.dump({'id': 1, 'username': 'x'})
+    assert fast_dump(PostSchema(), user.id) == PostSchema().dump(user.id)
+
+    user.username = 12
+    assert fast_dump(schema, user) == schema.dump(user)
+
+
+class PlainSchema(Schema):
+    id = fields.Int()
+    name = fields.Function(lambda obj: obj.username.upper())
+    tags = fields.List(fields.Str())
+    role = fields.Str(default='member')
+
+
+class HookedSchema(PlainSchema):
+    @post_dump
+    def wrap(self, data, **kwargs):
+        return {'wrapped': data}
+
+
+def test_parity_fallbacks(users):
+    user = User.find_by_identity('adminuser@test.com')
+    user.tags = ['a', 'b']
+
+    assert fast_dump(PlainSchema(), user) == PlainSchema().dump(user) == {
+        'id': user.id, 'name': 'ADMINUSER', 'tags': ['a', 'b'],
+        'role': 'member'}
+    assert fast_dump(HookedSchema(), user) == HookedSchema().dump(user)
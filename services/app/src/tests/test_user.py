@@ -73,9 +73,41 @@ def test_get_followers(client, token):
     assert data.get('count') == 1
     assert data.get('hasNext') is False
     assert data.get('followers')[0]['username'] == 'commonuser'
+    assert data.get('followers')[0]['followed_by_me'] is False
     assert len(data.get('followers')) <= app.config['ITEMS_PER_PAGE']
 
 
+def test_get_followers_fields(client, token):
+    headers = {'Authorization': f'Bearer {token}'}
+    response = client.get(
+        '/api/users/adminuser/followers?fields=id,username', headers=headers)
+    data = json.loads(response.data.decode())
+    assert response.status_code == 200
+    assert set(data.get('followers')[0]) == {'id', 'username'}
+
+    # Limited to what the endpoint dumps
+    response = client.get(
+        '/api/users/adminuser/followers?fields=id,email', headers=headers)
+    assert response.status_code == 400
+
+
+def test_get_followers_followed_by_me(client, users, token):
+    admin = User.find_by_identity('adminuser@test.com')
+    common = User.find_by_identity('commonuser@test.com')
+    regular = User.find_by_identity('regularuser@test.com')
+    admin.follow(common)
+    admin.save()
+
+    assert admin.following_ids([common.id, regular.id]) == {common.id}
+
+    response = client.get(
+        '/api/users/adminuser/followers',
+        headers={'Authorization': f'Bearer {token}'}
+    )
+    data = json.loads(response.data.decode())
+    assert data.get('followers')[0]['followed_by_me'] is True
+
+
 def test_get_following(client, token):
     response = client.get(
         '/api/users/commonuser/following/page/1',
@@ -8,32 +8,69 @@ from src.blueprints.admin.models import Permission
 app = create_app(config=TestingConfig)
 
 
-def test_get_user(client, users):
+def test_get_user(client, users, token):
     user = User.find_by_identity('adminuser@test.com')
-    response = client.get(f'/api/admin/users/{user.id}',)
+    response = client.get(
+        f'/api/admin/users/{user.id}',
+        headers={'Authorization': f'Bearer {token}'}
+    )
     data = json.loads(response.data.decode())
     assert response.status_code == 200
     assert data.get('username') == 'adminuser'
     assert data.get('profile')['name'] == 'admin'
 
 
-def test_get_user_invalid_id(client, users):
-    response = client.get('/api/admin/users/66853')
+def test_get_user_invalid_id(client, users, token):
+    response = client.get(
+        '/api/admin/users/66853',
+        headers={'Authorization': f'Bearer {token}'}
+    )
     data = json.loads(response.data.decode())
     assert response.status_code == 404
     assert 'User not found' in data.get('message')
     assert 'Not Found' in data.get('error')
 
 
-def test_get_all_users(client, users):
-    response = client.get('/api/admin/users')
+def test_get_all_users(client, users, token):
+    response = client.get(
+        '/api/admin/users',
+        headers={'Authorization': f'Bearer {token}'}
+    )
     data = json.loads(response.data.decode())
     assert response.status_code == 200
     assert len(data.get('items')) == app.config['ITEMS_PER_PAGE']
 
 
-def test_all_users_with_pagination_first_page(client, users):
-    response = client.get('/api/admin/users/page/1')
+def test_get_all_users_sparse(client, users, token):
+    headers = {'Authorization': f'Bearer {token}'}
+
+    response = client.get(
+        '/api/admin/users?fields=id,username&include=profile',
+        headers=headers)
+    data = json.loads(response.data.decode())
+    assert response.status_code == 200
+    assert all(set(user) == {'id', 'username', 'profile'}
+               for user in data['items'])
+
+    # Only the relationships asked for, with every other field
+    response = client.get(
+        '/api/admin/users?include=permissions', headers=headers)
+    user = json.loads(response.data.decode())['items'][0]
+    assert 'permissions' in user and 'email' in user
+    assert 'profile' not in user and 'followers' not in user
+
+    for query in ('fields=id,nope', 'include=email', 'fields=profile.nope'):
+        response = client.get(f'/api/admin/users?{query}', headers=headers)
+        data = json.loads(response.data.decode())
+        assert response.status_code == 400
+        assert data.get('message') == 'Invalid fields.'
+
+
+def test_all_users_with_pagination_first_page(client, users, token):
+    response = client.get(
+        '/api/admin/users/page/1',
+        headers={'Authorization': f'Bearer {token}'}
+    )
     data = json.loads(response.data.decode())
     assert response.status_code == 200
     assert len(data.get('items')) <= app.config['ITEMS_PER_PAGE']
@@ -41,8 +78,11 @@ def test_all_users_with_pagination_first_page(client, users):
     assert data.get('prev_url') is None
 
 
-def test_all_users_with_pagination_last_page(client, users):
-    response = client.get('/api/admin/users/page/2')
+def test_all_users_with_pagination_last_page(client, users, token):
+    response = client.get(
+        '/api/admin/users/page/2',
+        headers={'Authorization': f'Bearer {token}'}
+    )
     data = json.loads(response.data.decode())
     assert response.status_code == 200
     assert len(data.get('items')) <= app.config['ITEMS_PER_PAGE']
@@ -50,18 +90,48 @@ def test_all_users_with_pagination_last_page(client, users):
     assert data.get('next_url') is None
 
 
-def test_add_user_no_data(client):
+def test_all_users_with_cursor(client, users, token):
+    headers = {'Authorization': f'Bearer {token}'}
+    response = client.get('/api/admin/users', headers=headers)
+    first = json.loads(response.data.decode())
+    assert first.get('prev') is None
+
+    response = client.get(first.get('next_url'), headers=headers)
+    data = json.loads(response.data.decode())
+    assert response.status_code == 200
+    assert len(data.get('items')) == 1
+    assert data.get('next_url') is None
+
+    response = client.get(data.get('prev_url'), headers=headers)
+    data = json.loads(response.data.decode())
+    assert [user['id'] for user in data.get('items')] == \
+        [user['id'] for user in first.get('items')]
+    assert data.get('prev_url') is None
+
+
+def test_all_users_invalid_cursor(client, users, token):
+    response = client.get(
+        '/api/admin/users?cursor=nope',
+        headers={'Authorization': f'Bearer {token}'}
+    )
+    data = json.loads(response.data.decode())
+    assert response.status_code == 400
+    assert data.get('message') == 'Invalid cursor.'
+
+
+def test_add_user_no_data(client, token):
     response = client.post(
         '/api/admin/users',
         data=json.dumps({}),
-        content_type='application/json'
+        content_type='application/json',
+        headers={'Authorization': f'Bearer {token}'}
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 400
     assert 'No input data provided' in data.get('message')
 
 
-def test_add_user_invalid_data(client):
+def test_add_user_invalid_data(client, token):
     response = client.post(
         '/api/admin/users',
         data=json.dumps({
@@ -70,14 +140,15 @@ def test_add_user_invalid_data(client):
             'email': 'commonuser.host',
             'password': 'password',
         }),
-        content_type='application/json'
+        content_type='application/json',
+        headers={'Authorization': f'Bearer {token}'}
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 422
     assert data.get('message') is not None
 
 
-def test_add_user_duplicate_email(client):
+def test_add_user_duplicate_email(client, token):
     response = client.post(
         '/api/admin/users',
         data=json.dumps({
@@ -86,14 +157,15 @@ def test_add_user_duplicate_email(client):
             'email': 'adminuser@test.com',
             'password': 'password',
         }),
-        content_type='application/json'
+        content_type='application/json',
+        headers={'Authorization': f'Bearer {token}'}
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 400
     assert 'user already exists.' in data.get('message')
 
 
-def test_add_user_duplicate_username(client):
+def test_add_user_duplicate_username(client, token):
     response = client.post(
         '/api/admin/users',
         data=json.dumps({
@@ -102,14 +174,15 @@ def test_add_user_duplicate_username(client):
             'email': 'user@test.host',
             'password': 'password',
         }),
-        content_type='application/json'
+        content_type='application/json',
+        headers={'Authorization': f'Bearer {token}'}
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 400
     assert 'user already exists.' in data.get('message')
 
 
-def test_add_user_valid(client):
+def test_add_user_valid(client, token):
     response = client.post(
         '/api/admin/users',
         data=json.dumps({
@@ -118,7 +191,8 @@ def test_add_user_valid(client):
             'email': 'testuser@test.host',
             'password': 'password',
         }),
-        content_type='application/json'
+        content_type='application/json',
+        headers={'Authorization': f'Bearer {token}'}
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 201
@@ -127,7 +201,7 @@ def test_add_user_valid(client):
     assert data.get('username') == 'test'
 
 
-def test_update_user_duplicate_username(client, users):
+def test_update_user_duplicate_username(client, users, token):
     user = User.find_by_identity('regularuser@test.com')
     response = client.put(
         f'/api/admin/users/{user.id}',
@@ -140,26 +214,28 @@ def test_update_user_duplicate_username(client, users):
             'name': 'test',
             'bio': 'Another user.'
         }),
-        content_type='application/json'
+        content_type='application/json',
+        headers={'Authorization': f'Bearer {token}'}
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 400
     assert 'Username already exists.' in data.get('message')
 
 
-def test_update_user_no_data(client, users):
+def test_update_user_no_data(client, users, token):
     user = User.find_by_identity('adminuser@test.com')
     response = client.put(
         f'/api/admin/users/{user.id}',
         data=json.dumps({}),
-        content_type='application/json'
+        content_type='application/json',
+        headers={'Authorization': f'Bearer {token}'}
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 400
     assert 'No input data provided' in data.get('message')
 
 
-def test_update_user_invalid_data(client, users):
+def test_update_user_invalid_data(client, users, token):
     response = client.put(
         '/api/admin/users/2',
         data=json.dumps({
@@ -168,14 +244,15 @@ def test_update_user_invalid_data(client, users):
             'bio': 'test user',
             'email': 'user1@test.host',
         }),
-        content_type='application/json'
+        content_type='application/json',
+        headers={'Authorization': f'Bearer {token}'}
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 422
     assert data.get('message') is not None
 
 
-def test_update_user(client, users):
+def test_update_user(client, users, token):
     user = User.find_by_identity('commonuser@test.com')
     response = client.put(
         f'/api/admin/users/{user.id}',
@@ -188,7 +265,8 @@ def test_update_user(client, users):
                 'is_admin': True,
             }
         }),
-        content_type='application/json'
+        content_type='application/json',
+        headers={'Authorization': f'Bearer {token}'}
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 200
@@ -196,25 +274,27 @@ def test_update_user(client, users):
     assert data.get('username') == 'testuser'
 
 
-def test_delete_user(client, users):
+def test_delete_user(client, users, token):
     user = User.find_by_identity('commonuser@test.com')
     response = client.delete(
-        f'/api/admin/users/{user.id}',)
+        f'/api/admin/users/{user.id}',
+        headers={'Authorization': f'Bearer {token}'})
     data = json.loads(response.data.decode())
     assert response.status_code == 200
     assert 'deleted user' in data.get('message')
 
 
-def test_delete_user_invalid_id(client, users):
+def test_delete_user_invalid_id(client, users, token):
     response = client.delete(
         '/api/admin/users/333',
+        headers={'Authorization': f'Bearer {token}'}
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 404
     assert 'User does not exist.' in data.get('message')
 
 
-def test_add_user_perms(client, users):
+def test_add_user_perms(client, users, token):
     name1 = Permission.set_code_name('can view groups')
     name2 = Permission.set_code_name('can delete users')
     perm1 = Permission.find_by_name(name1)
@@ -224,7 +304,8 @@ def test_add_user_perms(client, users):
     response = client.put(
         f'/api/admin/users/{user.id}/permissions',
         content_type='application/json',
-        data=json.dumps({'perms': [perm1.id, perm2.id]})
+        data=json.dumps({'perms': [perm1.id, perm2.id]}),
+        headers={'Authorization': f'Bearer {token}'}
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 200
@@ -233,7 +314,7 @@ def test_add_user_perms(client, users):
     assert data.get('permissions')[0]['name'] == 'can delete users'
 
 
-def test_remove_user_perms(client, users):
+def test_remove_user_perms(client, users, token):
     name1 = Permission.set_code_name('can view groups')
     name2 = Permission.set_code_name('can delete users')
     perm1 = Permission.find_by_name(name1)
@@ -245,8 +326,29 @@ def test_remove_user_perms(client, users):
     response = client.delete(
         f'/api/admin/users/{user.id}/permissions',
         content_type='application/json',
-        data=json.dumps({'perms': [perm1.id, perm2.id]})
+        data=json.dumps({'perms': [perm1.id, perm2.id]}),
+        headers={'Authorization': f'Bearer {token}'}
     )
     data = json.loads(response.data.decode())
     assert response.status_code == 200
     assert len(data.get('permissions')) == 0
+
+
+def test_set_user_perms(client, users, token):
+    perm1 = Permission.find_by_name('can_view_groups')
+    perm2 = Permission.find_by_name('can_delete_users')
+    user = User.find_by_identity('regularuser@test.com')
+    user.add_permissions([perm1])
+
+    response = client.patch(
+        f'/api/admin/users/{user.id}/permissions',
+        content_type='application/json',
+        data=json.dumps({'perms': [perm2.id]}),
+        headers={'Authorization': f'Bearer {token}'}
+    )
+    data = json.loads(response.data.decode())
+    assert response.status_code == 200
+    assert [p['name'] for p in data.get('permissions')] == [
+        'can delete users']
+    assert data.get('added') == 1
+    assert data.get('removed') == 1
@@ -0,0 +1,108 @@
+import atexit
+from datetime import datetime
+
+from sqlalchemy import text
+
+from src.utils.buffers import WriteBehindBuffer
+
+
+class ActivityBuffer(WriteBehindBuffer):
+    """
+    Buffer sign-in events in memory and write them to the users table in
+    bulk, with one multi-row UPDATE every `interval` seconds or every
+    `size` events, see WriteBehindBuffer.
+    """
+
+    label = 'sign-in activity'
+
+    def __init__(self, interval=5, size=500):
+        super(ActivityBuffer, self).__init__(interval, size)
+
+    def init_app(self, app):
+        """
+        Configure the buffer from the app config.
+
+        :param app: Flask app
+        """
+        super(ActivityBuffer, self).init_app(app, 'ACTIVITY')
+
+    def record(self, user_id, ip_address):
+        """
+        Record a sign-in, to be written on the next flush.
+
+        :param user_id: User id
+        :param ip_address: str
+        """
+        with self._lock:
+            # Only the last two sign-ins of a user end up in the row
+            events = self._pending.setdefault(user_id, [0, None, None])
+            events[0] += 1
+            events[1] = events[2]
+            events[2] = (datetime.utcnow(), ip_address)
+            pending = self._added()
+
+        if pending >= self.size:
+            self._flush_quietly()
+
+    def _write(self, events, connection):
+        """
+        Write sign-ins with a single UPDATE statement.
+
+        :param events: Buffered sign-ins by user id
+        :param connection: Connection or session to write with
+        :return: Number of users updated
+        """
+        rows = []
+        params = {}
+
+        for i, (user_id, (count, last, current)) in enumerate(events.items()):
+            rows.append(
+                f'(:id{i}, :count{i}, CAST(:last_on{i} AS timestamp), '
+                f'CAST(:last_ip{i} AS varchar), '
+                f'CAST(:current_on{i} AS timestamp), '
+                f'CAST(:current_ip{i} AS varchar))'
+            )
+            params.update({
+                f'id{i}': user_id,
+                f'count{i}': count,
+                f'last_on{i}': last and last[0],
+                f'last_ip{i}': last and last[1],
+                f'current_on{i}': current[0],
+                f'current_ip{i}': current[1],
+            })
+
+        # With a single buffered sign-in the previous one is still the
+        # row's current sign-in
+        statement = text(f"""
+            UPDATE users SET
+                sign_in_count = users.sign_in_count + v.count,
+                last_sign_in_on = CASE WHEN v.count > 1
+                    THEN v.last_on ELSE users.current_sign_in_on END,
+                last_sign_in_ip = CASE WHEN v.count > 1
+                    THEN v.last_ip ELSE users.current_sign_in_ip END,
+                current_sign_in_on = v.current_on,
+                current_sign_in_ip = v.current_ip,
+                updated_on = v.current_on
+            FROM (VALUES {', '.join(rows)})
+                AS v(id, count, last_on, last_ip, current_on, current_ip)
+            WHERE users.id = v.id
+        """)
+
+        return connection.execute(statement, params).rowcount
+
+    def _merge(self, events):
+        # Call with the lock held
+        for user_id, (count, last, current) in events.items():
+            newer = self._pending.get(user_id)
+            self._count += count
+
+            if newer is not None:
+                count += newer[0]
+                last = newer[1] if newer[1] is not None else current
+                current = newer[2]
+
+            self._pending[user_id] = [count, last, current]
+
+
+activity = ActivityBuffer()
+atexit.register(activity.flush)
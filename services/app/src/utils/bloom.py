@@ -0,0 +1,250 @@
+import math
+import time
+import hashlib
+import threading
+
+from sqlalchemy import exc, select, text
+
+from src import db
+
+
+class BloomFilter(object):
+    """
+    A fixed size Bloom filter over strings. A miss means the key was never
+    added, a hit means it probably was, wrong about `error_rate` of the
+    time while at most `capacity` keys are in it.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = max(int(capacity), 1)
+        self.size = max(int(
+            -self.capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(
+            int(round(self.size / self.capacity * math.log(2))), 1)
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, key):
+        return all(
+            self._bits[i >> 3] & (1 << (i & 7)) for i in self._indexes(key))
+
+    def add(self, key):
+        """
+        Add a key, keys already in the filter are not counted again.
+
+        :param key: str
+        :return: True if the key was new
+        """
+        if key in self:
+            return False
+
+        for i in self._indexes(key):
+            self._bits[i >> 3] |= 1 << (i & 7)
+
+        self.count += 1
+        return True
+
+    def _indexes(self, key):
+        # Double hashing, k indexes out of one 128 bit digest
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+
+def current_generation(bind):
+    """
+    Get the last identity generation handed out, committed or not.
+
+    :param bind: Connection or session to read with
+    :return: int
+    """
+    from src.blueprints.auth.models import identity_generation
+
+    value, called = bind.execute(text(
+        f'SELECT last_value, is_called FROM {identity_generation.name}'
+    )).first()
+
+    return value if called else 0
+
+
+class IdentityFilter(object):
+    """
+    Bloom filter over every username and email, so availability checks
+    can answer "definitely available" without searching the users table.
+
+    New and changed identities are stamped with an identity generation
+    from a sequence, see src.blueprints.auth.models. At most every
+    `refresh_interval` seconds a check reads the sequence and adds
+    whatever was stamped since, so identities registered by other
+    workers are reported as available for that long at most, the users
+    table's unique constraints still refuse them. Generations can commit
+    out of order, each catch up re-reads the ones handed out in the last
+    `overlap` seconds. Deleted identities stay in the filter until the
+    next build, they only cost a query.
+    """
+
+    def __init__(self, error_rate=0.01, refresh_interval=5, overlap=60):
+        self.app = None
+        self.error_rate = error_rate
+        self.refresh_interval = refresh_interval
+        self.overlap = overlap
+        self._filter = None
+        # (monotonic time, generation) of the last catch ups
+        self._readings = []
+        self._checked_on = 0
+        self._building = False
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Configure the filter from the app config and build it.
+
+        :param app: Flask app
+        """
+        self.app = app
+        self.error_rate = app.config.get(
+            'IDENTITY_FILTER_ERROR_RATE', self.error_rate)
+        self.refresh_interval = app.config.get(
+            'IDENTITY_FILTER_REFRESH_INTERVAL', self.refresh_interval)
+        self.overlap = app.config.get(
+            'IDENTITY_FILTER_OVERLAP', self.overlap)
+
+        try:
+            with db.get_engine(app).connect() as connection:
+                self.build(connection)
+        except Exception:
+            # e.g. before db_init, checks query the table until it's built
+            app.logger.warning('Identity filter not built.')
+
+    def build(self, bind=None):
+        """
+        Build the filter from the users table.
+
+        :param bind: Connection or session to read with, defaults to the
+        current session
+        """
+        from src.blueprints.auth.models import User
+
+        bind = bind or db.session
+        users = User.__table__
+        generation = current_generation(bind)
+        count = bind.execute(
+            select([db.func.count()]).select_from(users)).scalar()
+        bloom = BloomFilter(max(count * 4, 1024), self.error_rate)
+
+        for username, email in bind.execute(
+                select([users.c.username, users.c.email])
+                .execution_options(stream_results=True)):
+            bloom.add(username)
+            bloom.add(email)
+
+        with self._lock:
+            self._filter = bloom
+            # Earlier readings keep the overlap across rebuilds, unless
+            # the sequence was reset since
+            self._readings = [
+                reading for reading in self._readings
+                if reading[1] <= generation
+            ] + [(time.monotonic(), generation)]
+            self._building = False
+
+    def might_exist(self, identity):
+        """
+        Check if an identity may be taken, False means it's available.
+
+        :param identity: Username or email
+        :return: boolean
+        """
+        if not identity:
+            return False
+
+        now = time.monotonic()
+
+        with self._lock:
+            bloom = self._filter
+            due = now - self._checked_on >= self.refresh_interval
+
+            # One check at a time catches up, the others use the filter
+            if due:
+                self._checked_on = now
+
+        if bloom is None:
+            return True
+
+        if due:
+            self._catch_up(bloom, now)
+
+        return identity in bloom
+
+    def _floor(self, now):
+        # Call with the lock held. The generation read at least `overlap`
+        # seconds ago, anything stamped before it has committed by now.
+        older = [reading for reading in self._readings
+                 if reading[0] <= now - self.overlap]
+        floor = older[-1] if older else self._readings[0]
+        self._readings = [floor] + [
+            reading for reading in self._readings if reading[0] > floor[0]]
+
+        return floor[1]
+
+    def _catch_up(self, bloom, now):
+        """
+        Add the identities stamped since the floor generation.
+
+        :param bloom: Filter the check started with
+        :param now: Monotonic time of the check
+        """
+        from src.blueprints.auth.models import User
+
+        generation = current_generation(db.session)
+
+        with self._lock:
+            floor = self._floor(now)
+
+        rows = []
+
+        if generation != floor:
+            rows = db.session.query(User.username, User.email).filter(
+                User.identity_gen > floor).all()
+
+        with self._lock:
+            if self._filter is not bloom:
+                return
+
+            for username, email in rows:
+                bloom.add(username)
+                bloom.add(email)
+
+            self._readings.append((now, generation))
+
+            if len(bloom) > bloom.capacity:
+                self._rebuild()
+
+    def _rebuild(self):
+        # Call with the lock held. The full filter keeps answering, only
+        # with more false positives, while a new one is built.
+        if self._building or self.app is None:
+            return
+
+        self._building = True
+        thread = threading.Thread(target=self._build_in_background)
+        thread.daemon = True
+        thread.start()
+
+    def _build_in_background(self):
+        try:
+            with db.get_engine(self.app).connect() as connection:
+                self.build(connection)
+        except exc.SQLAlchemyError:
+            self.app.logger.exception('Could not rebuild identity filter.')
+
+            with self._lock:
+                self._building = False
+
+
+identities = IdentityFilter()
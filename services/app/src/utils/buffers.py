@@ -0,0 +1,143 @@
+import threading
+
+from src import db
+
+
+class WriteBehindBuffer(object):
+    """
+    Base of the buffers that collect writes in memory and apply them in
+    bulk, every `interval` seconds or every `size` buffered changes,
+    whichever comes first. Whatever is left is flushed when the process
+    exits, register the instance's flush with atexit.
+
+    Subclasses buffer changes in `_pending` under `_lock`, then call
+    `_added`, and implement `_write` and `_merge`. One flush runs at a
+    time, the batch it's writing is `_flushing` until it's committed or
+    put back.
+    """
+
+    # What's buffered, for the log
+    label = 'buffered writes'
+
+    def __init__(self, interval, size):
+        self.app = None
+        self.interval = interval
+        self.size = size
+        self._pending = {}
+        self._flushing = {}
+        self._count = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer = None
+
+    def init_app(self, app, prefix):
+        """
+        Configure the buffer from the app config.
+
+        :param app: Flask app
+        :param prefix: Config key prefix, e.g. ACTIVITY
+        """
+        self.app = app
+        self.interval = app.config.get(
+            f'{prefix}_FLUSH_INTERVAL', self.interval)
+        self.size = app.config.get(f'{prefix}_FLUSH_SIZE', self.size)
+
+    def flush(self, connection=None, blocking=True):
+        """
+        Write all buffered changes.
+
+        :param connection: Connection or session to write with, defaults
+        to a transaction of its own
+        :param blocking: Wait for a flush already running, or return
+        :return: Number of rows updated
+        """
+        if not self._flush_lock.acquire(blocking):
+            return 0
+
+        try:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._flushing = batch
+                self._count = 0
+
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+
+            if not batch:
+                return 0
+
+            try:
+                if connection is not None:
+                    updated = self._write(batch, connection)
+                else:
+                    with self.app.app_context(), \
+                            db.engine.begin() as connection:
+                        updated = self._write(batch, connection)
+            except Exception:
+                self._restore(batch)
+                raise
+
+            with self._lock:
+                self._flushing = {}
+
+            return updated
+        finally:
+            self._flush_lock.release()
+
+    def _write(self, batch, connection):
+        """
+        Apply a batch of buffered changes.
+
+        :param batch: Changes taken out of the buffer
+        :param connection: Connection or session to write with
+        :return: Number of rows updated
+        """
+        raise NotImplementedError
+
+    def _merge(self, batch):
+        """
+        Put back changes whose flush failed, in front of the ones buffered
+        since, counting them in `_count`. Called with the lock held.
+
+        :param batch: Changes taken out of the buffer
+        """
+        raise NotImplementedError
+
+    def _added(self, count=1):
+        # Call with the lock held, after buffering changes
+        self._count += count
+        self._schedule()
+
+        return self._count
+
+    def _schedule(self):
+        # Call with the lock held
+        if self._timer is None and self._pending:
+            self._timer = threading.Timer(self.interval, self._flush_quietly)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush_quietly(self):
+        # Background and size triggered flushes must not fail a request,
+        # the changes stay buffered and are retried on the next flush.
+        # They're skipped while another flush runs, a timer is set for
+        # what it left.
+        try:
+            self.flush(blocking=False)
+        except Exception:
+            if self.app is not None:
+                self.app.logger.exception(f'Could not flush {self.label}.')
+        finally:
+            with self._lock:
+                if self._timer is not None and \
+                        self._timer is threading.current_thread():
+                    self._timer = None
+
+                self._schedule()
+
+    def _restore(self, batch):
+        with self._lock:
+            self._merge(batch)
+            self._flushing = {}
+            self._schedule()
@@ -0,0 +1,148 @@
+import time
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+_missing = object()
+
+
+class TTLCache(object):
+    """
+    A small thread safe in-process cache whose entries expire after a
+    fixed time to live, evicting the least recently used entry once it
+    holds more than `maxsize` items.
+
+    A ttl of 0 disables the cache, every lookup is then a miss.
+
+    The cache is local to the process, other workers keep serving their
+    own copy of a dropped entry until it expires.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._dropped = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+
+    def init_app(self, app, prefix):
+        """
+        Configure the cache from the app config.
+
+        :param app: Flask app
+        :param prefix: Config key prefix, e.g. PRINCIPAL_CACHE
+        """
+        self.maxsize = app.config.get(f'{prefix}_SIZE', self.maxsize)
+        self.ttl = app.config.get(f'{prefix}_TTL', self.ttl)
+        self.clear()
+
+    def get(self, key, default=None):
+        """
+        Get a cached value, refreshing its position in the LRU order.
+
+        :param key: Cache key
+        :param default: Returned when the key is missing or expired
+        :return: Cached value
+        """
+        with self._lock:
+            entry = self._data.get(key)
+
+            if entry is None:
+                return default
+
+            expires, value = entry
+
+            if expires <= time.monotonic():
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, since=None):
+        """
+        Cache a value for `ttl` seconds.
+
+        Pass the time.monotonic() at which the value was read as `since`,
+        it is then not cached if the key was dropped in the meantime, as
+        the value may predate the change that dropped it.
+
+        :param key: Cache key
+        :param value: Value to cache
+        :param since: When the value was read
+        """
+        if not self.ttl or self.maxsize <= 0:
+            return
+
+        with self._lock:
+            if since is not None and self._dropped.get(key, since) > since:
+                return
+
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """
+        Drop a key from the cache, if present.
+
+        :param key: Cache key
+        """
+        with self._lock:
+            self._data.pop(key, None)
+            self._dropped[key] = time.monotonic()
+            self._dropped.move_to_end(key)
+
+            while len(self._dropped) > self.maxsize:
+                self._dropped.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._dropped.clear()
+
+
+def delete_on_commit(session, key, *caches):
+    """
+    Drop a key from caches once the session's transaction commits.
+
+    Dropping it at flush time would let a concurrent reader cache the
+    old committed value again before the change is visible.
+
+    :param session: SQLAlchemy session making the change
+    :param key: Cache key
+    :param caches: TTLCache instances
+    """
+    pending = session.info.setdefault('cache_deletes', set())
+
+    for cache in caches:
+        pending.add((cache, key))
+
+
+@event.listens_for(Session, 'after_commit')
+def apply_cache_deletes(session):
+    for cache, key in session.info.pop('cache_deletes', ()):
+        cache.delete(key)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_cache_deletes(session):
+    session.info.pop('cache_deletes', None)
+
+
+# Authenticated users keyed by user id, see src.utils.decorators.authenticate
+principals = TTLCache()
+
+# Current auth_version per user id, checked against the token's claims
+auth_versions = TTLCache()
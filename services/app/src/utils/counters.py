@@ -0,0 +1,258 @@
+import atexit
+
+from sqlalchemy import event, func, select, text
+from sqlalchemy.orm import Session
+
+from src import db
+from src.utils.buffers import WriteBehindBuffer
+
+
+def increment(bind, table, id, **deltas):
+    """
+    Add to counter columns of a row in place, with a single UPDATE and no
+    read, so concurrent changes add up instead of overwriting each other.
+    updated_on is left alone, a new like doesn't edit a post.
+
+    :param bind: Connection or session to write with
+    :param table: Table holding the counters
+    :param id: Row id
+    :param deltas: Amount to add, per counter column
+    """
+    values = {name: table.c[name] + delta for name, delta in deltas.items()}
+
+    if 'updated_on' in table.c:
+        values['updated_on'] = table.c.updated_on
+
+    bind.execute(table.update().where(table.c.id == id).values(values))
+
+
+def release(bind, table, counter, key, condition):
+    """
+    Take rows that are about to go away off a counter, with a single
+    UPDATE ... FROM over the rows they're counted on.
+
+    :param bind: Connection or session to write with
+    :param table: Table holding the counter
+    :param counter: Counter column name
+    :param key: Column of the counted rows pointing at `table`
+    :param condition: Clause selecting the counted rows
+    """
+    counts = select([
+        key.label('id'), func.count().label('n')
+    ]).where(condition).group_by(key).alias('counts')
+
+    values = {counter: table.c[counter] - counts.c.n}
+
+    if 'updated_on' in table.c:
+        values['updated_on'] = table.c.updated_on
+
+    bind.execute(
+        table.update().where(table.c.id == counts.c.id).values(values))
+
+
+def counters():
+    """
+    Every denormalized counter, as the table and column holding it and
+    the column of the counted rows pointing at it.
+
+    :return: list of (table, counter, key) tuples
+    """
+    from src.blueprints.auth.models import User, followers
+    from src.blueprints.posts.models import Post, Comment, post_likes, \
+        comment_likes
+
+    users = User.__table__
+    posts = Post.__table__
+    comments = Comment.__table__
+    replies = comments.alias('replies')
+
+    return [
+        (users, 'follower_count', followers.c.followed_id),
+        (users, 'following_count', followers.c.follower_id),
+        (users, 'post_count', posts.c.user_id),
+        (posts, 'like_count', post_likes.c.post_id),
+        (posts, 'comment_count', comments.c.post_id),
+        (comments, 'like_count', comment_likes.c.comment_id),
+        (comments, 'reply_count', replies.c.comment_id),
+    ]
+
+
+def reconcile(table, counter, key, chunk=1000, engine=None):
+    """
+    Recompute a counter and fix the rows that drifted, `chunk` rows at a
+    time, each chunk in a transaction of its own so locks stay short.
+
+    :param table: Table holding the counter
+    :param counter: Counter column name
+    :param key: Column of the counted rows pointing at `table`
+    :param chunk: Rows per transaction
+    :param engine: Engine to use, defaults to the app's
+    :return: Number of rows fixed
+    """
+    engine = engine or db.engine
+    actual = select([func.count()]).where(key == table.c.id).as_scalar()
+    last = engine.execute(select([func.max(table.c.id)])).scalar() or 0
+    fixed = 0
+
+    for start in range(0, last, chunk):
+        with engine.begin() as connection:
+            fixed += connection.execute(
+                table.update()
+                .where(table.c.id > start)
+                .where(table.c.id <= start + chunk)
+                .where(table.c[counter] != actual)
+                .values({
+                    counter: actual,
+                    'updated_on': table.c.updated_on
+                })
+            ).rowcount
+
+    return fixed
+
+
+class CounterBuffer(WriteBehindBuffer):
+    """
+    Coalesce counter changes in memory and write them in bulk, with one
+    multi-row UPDATE per table every `interval` seconds or every `size`
+    changes, see WriteBehindBuffer. A viral post then takes one counter
+    update per flush instead of one per like, so the likes themselves
+    don't queue up behind its row lock.
+
+    Changes are buffered once their transaction commits. Reads add the
+    pending delta to the stored value, see `current`. Deltas buffered by
+    other workers only show once they're flushed.
+    """
+
+    label = 'counters'
+
+    def __init__(self, interval=1, size=1000):
+        super(CounterBuffer, self).__init__(interval, size)
+        self.enabled = False
+
+    def init_app(self, app, prefix):
+        """
+        Configure the buffer from the app config.
+
+        :param app: Flask app
+        :param prefix: Config key prefix, e.g. LIKE_COUNT
+        """
+        super(CounterBuffer, self).init_app(app, prefix)
+        self.enabled = app.config.get(f'{prefix}_WRITE_BEHIND', False)
+
+    def add(self, table, counter, id, delta):
+        """
+        Buffer a change to a counter, to be written on the next flush.
+
+        :param table: Table holding the counter
+        :param counter: Counter column name
+        :param id: Row id
+        :param delta: Amount to add
+        """
+        with self._lock:
+            deltas = self._pending.setdefault((table.name, counter), {})
+            deltas[id] = deltas.get(id, 0) + delta
+            pending = self._added()
+
+        if pending >= self.size:
+            self._flush_quietly()
+
+    def add_on_commit(self, session, table, counter, id, delta):
+        """
+        Buffer a change to a counter once the session's transaction
+        commits, it's dropped on a rollback.
+
+        :param session: SQLAlchemy session making the change
+        :param table: Table holding the counter
+        :param counter: Counter column name
+        :param id: Row id
+        :param delta: Amount to add
+        """
+        session.info.setdefault('counter_deltas', []).append(
+            (self, table, counter, id, delta))
+
+    def pending(self, table, counter, id):
+        """
+        Get the buffered change to a counter.
+
+        :param table: Table holding the counter
+        :param counter: Counter column name
+        :param id: Row id
+        :return: int
+        """
+        key = (table.name, counter)
+
+        # Changes being flushed count until their UPDATE commits
+        with self._lock:
+            return self._pending.get(key, {}).get(id, 0) + \
+                self._flushing.get(key, {}).get(id, 0)
+
+    def current(self, obj, counter):
+        """
+        Get a model instance's counter with the buffered change added.
+
+        :param obj: Model instance
+        :param counter: Counter attribute name
+        :return: int
+        """
+        return getattr(obj, counter) + \
+            self.pending(obj.__table__, counter, obj.id)
+
+    def _write(self, deltas, connection):
+        """
+        Write counter changes with one UPDATE per counter.
+
+        :param deltas: Buffered changes by table and counter, then row id
+        :param connection: Connection or session to write with
+        :return: Number of rows updated
+        """
+        updated = 0
+
+        for (table, counter), rows in deltas.items():
+            rows = sorted(
+                (id, delta) for id, delta in rows.items() if delta)
+
+            if not rows:
+                continue
+
+            # Rows in id order, flushes from other workers don't deadlock
+            values = ', '.join(
+                f'(:id{i}, :delta{i})' for i in range(len(rows)))
+            params = {}
+
+            for i, (id, delta) in enumerate(rows):
+                params[f'id{i}'] = id
+                params[f'delta{i}'] = delta
+
+            updated += connection.execute(text(f"""
+                UPDATE {table} SET {counter} = {table}.{counter} + v.delta
+                FROM (VALUES {values}) AS v(id, delta)
+                WHERE {table}.id = v.id
+            """), params).rowcount
+
+        return updated
+
+    def _merge(self, deltas):
+        # Call with the lock held
+        for key, rows in deltas.items():
+            pending = self._pending.setdefault(key, {})
+
+            for id, delta in rows.items():
+                pending[id] = pending.get(id, 0) + delta
+                self._count += 1
+
+
+@event.listens_for(Session, 'after_commit')
+def apply_counter_deltas(session):
+    for buffer, table, counter, id, delta in \
+            session.info.pop('counter_deltas', ()):
+        buffer.add(table, counter, id, delta)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_counter_deltas(session):
+    session.info.pop('counter_deltas', None)
+
+
+# Like counts of posts and comments, see change_likes
+like_counts = CounterBuffer()
+atexit.register(like_counts.flush)
@@ -0,0 +1,90 @@
+from flask import request
+
+from src.utils.loading import nested_schema
+
+
+class InvalidFields(Exception):
+    """Raised when ?fields= or ?include= names something not dumped"""
+
+
+def _names(arg):
+    """
+    Get the comma separated names of a query string argument.
+
+    :param arg: Argument name
+    :return: list of names
+    """
+    return [
+        name.strip() for name in request.args.get(arg, '').split(',')
+        if name.strip()
+    ]
+
+
+def _dumps(schema, name):
+    """
+    Check if a schema dumps a field, nested ones with dots. Nested schemas
+    limited to some fields of theirs don't dump the others.
+
+    :param schema: Schema instance
+    :param name: Field name, e.g. author.username
+    :return: boolean
+    """
+    dumped = schema.dump_fields
+    *path, last = name.split('.')
+
+    for part in path:
+        nested = nested_schema(dumped[part]) if part in dumped else None
+
+        if nested is None:
+            return False
+
+        dumped = nested.dump_fields
+
+    return last in dumped
+
+
+def sparse(schema_class, only=None, **kwargs):
+    """
+    Build a schema dumping only what the client asked for. ?fields=
+    picks fields, nested ones with dots, e.g. id,username,profile.avatar,
+    and ?include= picks relationships, the other fields are kept when no
+    ?fields= is given. Either is limited to what the endpoint dumps by
+    default, `only`. Loader options built from the schema, see
+    eager_options, then skip what isn't dumped.
+
+    :param schema_class: Schema class
+    :param only: Fields the endpoint dumps, all of them by default
+    :param kwargs: Other schema arguments, e.g. many
+    :return: Schema instance
+    :raises InvalidFields: When a name isn't dumped by the endpoint
+    """
+    schema = schema_class(only=only, **kwargs)
+    fields = _names('fields')
+    include = _names('include')
+
+    if not fields and not include:
+        return schema
+
+    dumped = schema.dump_fields
+    relations = {
+        name for name, field in dumped.items()
+        if nested_schema(field) is not None
+    }
+
+    if any(name not in relations for name in include) or any(
+            not _dumps(schema, name) for name in fields):
+        raise InvalidFields()
+
+    if not fields:
+        fields = [name for name in dumped if name not in relations]
+
+    try:
+        schema = schema_class(only=tuple(fields + include), **kwargs)
+
+        # Nested fields are only checked once the nested schemas are built
+        for field in schema.dump_fields.values():
+            nested_schema(field)
+    except ValueError as error:
+        raise InvalidFields() from error
+
+    return schema
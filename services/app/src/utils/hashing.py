@@ -0,0 +1,191 @@
+import os
+import time
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import generate_password_hash, check_password_hash, \
+    DEFAULT_PBKDF2_ITERATIONS
+
+
+class HashingPoolBusy(Exception):
+    """Raised when the password hashing pool can't take more work."""
+
+
+class PasswordHasher(object):
+    """
+    Run PBKDF2 hashing in a bounded process pool, off the request workers.
+
+    At most `workers + queue_depth` hashes are in flight at any time, any
+    call beyond that raises HashingPoolBusy right away instead of queueing
+    behind a login burst. With 0 workers hashing runs inline.
+    """
+
+    def __init__(self, workers=0, queue_depth=0, timeout=10, retry_after=1,
+                 method='pbkdf2:sha256'):
+        self.configure(workers, queue_depth, timeout, retry_after, method)
+
+    def init_app(self, app):
+        """
+        Configure the hasher from the app config.
+
+        :param app: Flask app
+        """
+        self.configure(
+            app.config.get('PASSWORD_HASH_WORKERS', 0),
+            app.config.get('PASSWORD_HASH_QUEUE_DEPTH', 0),
+            app.config.get('PASSWORD_HASH_TIMEOUT', 10),
+            app.config.get('PASSWORD_HASH_RETRY_AFTER', 1),
+            app.config.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256')
+        )
+
+    def configure(self, workers, queue_depth, timeout, retry_after, method):
+        self.shutdown()
+        self.method = normalize_method(method)
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._slots = threading.BoundedSemaphore(workers + queue_depth or 1)
+
+    def shutdown(self):
+        """Stop the worker processes, if any were started."""
+        pool = getattr(self, '_pool', None)
+
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def generate(self, password):
+        """
+        Hash a plaintext password using PBKDF2.
+
+        :param password: Password in plain text
+        :return: str
+        """
+        return self._run(generate_password_hash, password, self.method)
+
+    def check(self, pwhash, password):
+        """
+        Check a plaintext password against a PBKDF2 hash.
+
+        :param pwhash: Stored password hash
+        :param password: Password in plain text
+        :return: boolean
+        """
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """
+        Check if a hash was made with other parameters than the configured
+        ones.
+
+        :param pwhash: Stored password hash
+        :return: boolean
+        """
+        return pwhash.split('$', 1)[0] != self.method
+
+    def _get_pool(self):
+        # Pools don't survive a fork, start a fresh one in each worker
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                self._pid = os.getpid()
+
+            return self._pool
+
+    def _discard_pool(self, pool):
+        # A worker process died, the next call starts a new pool
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+
+        pool.shutdown(wait=False)
+
+    def _run(self, func, *args):
+        if not self.workers:
+            return func(*args)
+
+        if not self._slots.acquire(blocking=False):
+            raise HashingPoolBusy('Password hashing pool is saturated.')
+
+        pool = self._get_pool()
+
+        try:
+            future = pool.submit(func, *args)
+        except BrokenProcessPool:
+            self._slots.release()
+            self._discard_pool(pool)
+            raise HashingPoolBusy('Password hashing pool is restarting.')
+        except Exception:
+            self._slots.release()
+            raise
+
+        future.add_done_callback(lambda f: self._slots.release())
+
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise HashingPoolBusy('Password hashing timed out.')
+        except BrokenProcessPool:
+            self._discard_pool(pool)
+            raise HashingPoolBusy('Password hashing pool is restarting.')
+
+
+def normalize_method(method):
+    """
+    Spell out the PBKDF2 iterations the way werkzeug stores them in the
+    hash, e.g. pbkdf2:sha256 -> pbkdf2:sha256:150000 on werkzeug 1.0.
+
+    :param method: werkzeug hash method
+    :return: str
+    """
+    if method.startswith('pbkdf2:') and method.count(':') == 1:
+        return f'{method}:{DEFAULT_PBKDF2_ITERATIONS}'
+
+    return method
+
+
+def time_method(method, rounds=5):
+    """
+    Time hashing a password with the given method on this host.
+
+    :param method: werkzeug hash method
+    :param rounds: Number of timed hashes, the fastest is kept
+    :return: Seconds per hash
+    """
+    timings = []
+
+    for _ in range(rounds):
+        start = time.perf_counter()
+        generate_password_hash('benchmark password', method)
+        timings.append(time.perf_counter() - start)
+
+    return min(timings)
+
+
+def calibrate(target, digest='sha256', rounds=5, step=1000):
+    """
+    Find the PBKDF2 method whose hashing time on this host is closest to
+    the target latency. PBKDF2 time is linear in its iterations, so one
+    probe is scaled to the target and then checked.
+
+    :param target: Target seconds per hash
+    :param digest: PBKDF2 hash function
+    :param rounds: Number of timed hashes per measurement
+    :param step: Iterations are rounded to a multiple of this
+    :return: Tuple of method and its measured seconds per hash
+    """
+    probe = 10 * step
+    elapsed = time_method(f'pbkdf2:{digest}:{probe}', rounds)
+
+    iterations = max(step, round(probe * target / elapsed / step) * step)
+    method = f'pbkdf2:{digest}:{iterations}'
+
+    return method, time_method(method, rounds)
+
+
+hasher = PasswordHasher()
@@ -0,0 +1,92 @@
+from marshmallow import fields
+from sqlalchemy import inspect
+from sqlalchemy.orm import joinedload, load_only, selectinload
+
+
+def nested_schema(field):
+    """
+    Get the schema a field nests, directly or as the items of a list.
+
+    :param field: Marshmallow field
+    :return: Schema instance or None
+    """
+    if isinstance(field, fields.List):
+        field = field.inner
+
+    if isinstance(field, fields.Nested):
+        return field.schema
+
+    return None
+
+
+def _columns(mapper, schema):
+    """
+    Get the columns to load for a schema that dumps some fields only:
+    the ones it dumps, by name, the primary key and the foreign keys
+    relationships are loaded by.
+
+    :param mapper: Mapper of the dumped model
+    :param schema: Schema instance
+    :return: list of column attributes
+    """
+    names = {field.attribute or name
+             for name, field in schema.dump_fields.items()}
+
+    return [
+        getattr(mapper.class_, prop.key) for prop in mapper.column_attrs
+        if prop.key in names or any(
+            column.primary_key or column.foreign_keys
+            for column in prop.columns)
+    ]
+
+
+def _paths(mapper, schema, loader, depth):
+    for name, field in schema.dump_fields.items():
+        nested = nested_schema(field)
+        relationship = mapper.relationships.get(field.attribute or name)
+
+        # Dynamic relationships are queries, they can't be loaded ahead
+        if nested is None or relationship is None or \
+                relationship.lazy == 'dynamic':
+            continue
+
+        attribute = getattr(mapper.class_, relationship.key)
+
+        # One query for all the rows' collections, a join for the rest
+        if relationship.uselist:
+            option = loader.selectinload(attribute) if loader \
+                else selectinload(attribute)
+        else:
+            option = loader.joinedload(attribute) if loader \
+                else joinedload(attribute)
+
+        yield option
+
+        # Fields left out of a nested schema aren't loaded either
+        if nested.only is not None:
+            yield option.load_only(*_columns(relationship.mapper, nested))
+
+        if depth > 1:
+            yield from _paths(relationship.mapper, nested, option, depth - 1)
+
+
+def eager_options(model, schema, depth=3):
+    """
+    Build the loader options that fetch every relationship a schema is
+    about to dump, nested ones included, so dumping a page of rows takes
+    a fixed number of queries instead of a few per row. The schema's
+    only and exclude are honoured, relationships left out aren't loaded,
+    and with only, columns left out aren't either, see _columns.
+
+    :param model: Model the schema dumps
+    :param schema: Schema instance, with its only and exclude
+    :param depth: Levels of nested relationships to follow
+    :return: list of loader options, for Query.options
+    """
+    mapper = inspect(model)
+    options = list(_paths(mapper, schema, None, depth))
+
+    if schema.only is not None:
+        options.append(load_only(*_columns(mapper, schema)))
+
+    return options
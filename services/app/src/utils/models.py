@@ -1,5 +1,8 @@
 from datetime import datetime
 
+from sqlalchemy import func, literal, select
+from sqlalchemy.dialects.postgresql import insert
+
 from src import db
 
 
@@ -45,3 +48,101 @@ class ResourceMixin(object):
         """
         db.session.delete(self)
         return db.session.commit()
+
+
+def ids_of(items):
+    """
+    Get the ids of model instances, ids are passed through.
+
+    :param items: Model instances or ids
+    :return: set of ids
+    """
+    return {int(getattr(item, 'id', item)) for item in items}
+
+
+def _item_column(table, owner):
+    # Association tables link the owner column to one other column
+    return next(column for column in table.c if column.name != owner)
+
+
+def link(table, owner, owner_id, ids):
+    """
+    Link an owner to many rows through an association table with a single
+    INSERT ... ON CONFLICT DO NOTHING. Existing links are left alone and
+    ids that don't exist are skipped.
+
+    :param table: Association table, e.g. group_members
+    :param owner: Name of the owner's column, e.g. group_id
+    :param owner_id: Owner id
+    :param ids: Ids of the rows to link
+    :return dict: Counts of added, unchanged and not found ids
+    """
+    ids = set(ids)
+
+    if not ids:
+        return {'added': 0, 'unchanged': 0, 'not_found': 0}
+
+    item = _item_column(table, owner)
+    target = next(iter(item.foreign_keys)).column
+
+    found = select([target.label('id')]).where(target.in_(ids)).cte('found')
+    added = insert(table).from_select(
+        [owner, item.name], select([literal(owner_id), found.c.id])
+    ).on_conflict_do_nothing().returning(item).cte('added')
+
+    found_count, added_count = db.session.execute(select([
+        select([func.count()]).select_from(found).as_scalar(),
+        select([func.count()]).select_from(added).as_scalar()
+    ])).first()
+
+    return {
+        'added': added_count,
+        'unchanged': found_count - added_count,
+        'not_found': len(ids) - found_count
+    }
+
+
+def unlink(table, owner, owner_id, ids):
+    """
+    Remove an owner's links to many rows with a single DELETE.
+
+    :param table: Association table, e.g. group_members
+    :param owner: Name of the owner's column, e.g. group_id
+    :param owner_id: Owner id
+    :param ids: Ids of the rows to unlink
+    :return dict: Counts of removed and unchanged ids
+    """
+    ids = set(ids)
+
+    if not ids:
+        return {'removed': 0, 'unchanged': 0}
+
+    item = _item_column(table, owner)
+    removed = db.session.execute(table.delete().where(
+        table.c[owner] == owner_id).where(item.in_(ids))).rowcount
+
+    return {'removed': removed, 'unchanged': len(ids) - removed}
+
+
+def sync_links(table, owner, owner_id, ids):
+    """
+    Make an owner's links through an association table exactly `ids`:
+    one DELETE drops the links not in it, then `link` adds the missing
+    ones. Run both in one transaction.
+
+    :param table: Association table, e.g. group_members
+    :param owner: Name of the owner's column, e.g. group_id
+    :param owner_id: Owner id
+    :param ids: Ids of the rows to be linked, empty to drop every link
+    :return dict: Counts of added, removed, unchanged and not found ids
+    """
+    ids = set(ids)
+    item = _item_column(table, owner)
+    statement = table.delete().where(table.c[owner] == owner_id)
+
+    if ids:
+        statement = statement.where(~item.in_(ids))
+
+    removed = db.session.execute(statement).rowcount
+
+    return dict(link(table, owner, owner_id, ids), removed=removed)
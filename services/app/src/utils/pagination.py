@@ -0,0 +1,144 @@
+import json
+import base64
+import binascii
+from datetime import datetime
+
+from sqlalchemy import tuple_
+from sqlalchemy.orm import undefer
+from sqlalchemy.orm.attributes import InstrumentedAttribute
+
+
+class InvalidCursor(Exception):
+    """A pagination cursor that can't be decoded."""
+
+
+def encode_cursor(direction, values):
+    """
+    Encode a position in a listing as an opaque, url safe string.
+
+    :param direction: 'next' for the rows after it, 'prev' for the ones
+    before it
+    :param values: Sort key of the row at the position
+    :return: str
+    """
+    values = [
+        value.isoformat() if isinstance(value, datetime) else value
+        for value in values
+    ]
+    data = json.dumps([direction, values], separators=(',', ':'))
+
+    return base64.urlsafe_b64encode(data.encode()).rstrip(b'=').decode()
+
+
+def decode_cursor(cursor, columns):
+    """
+    Decode a cursor made by encode_cursor.
+
+    :param cursor: Cursor string
+    :param columns: Sort key columns, to convert the values back
+    :return: Tuple of the direction and the sort key values
+    :raises InvalidCursor: When the cursor is malformed
+    """
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, values = json.loads(data.decode())
+
+        if direction not in ('next', 'prev') or \
+                len(values) != len(columns):
+            raise ValueError(cursor)
+
+        return direction, tuple(
+            datetime.fromisoformat(value)
+            if column.type.python_type is datetime
+            else column.type.python_type(value)
+            for column, value in zip(columns, values)
+        )
+    except (binascii.Error, TypeError, ValueError) as e:
+        raise InvalidCursor(cursor) from e
+
+
+class Page(object):
+    """
+    A page of a listing, with cursors to the pages around it.
+
+    :param items: Rows on the page
+    :param has_next: Whether rows follow the page
+    :param has_prev: Whether rows come before the page
+    :param next: Cursor to the next page or None
+    :param prev: Cursor to the previous page or None
+    """
+
+    def __init__(self, items, has_next, has_prev, next=None, prev=None):
+        self.items = items
+        self.has_next = has_next
+        self.has_prev = has_prev
+        self.next = next
+        self.prev = prev
+
+
+def paginate(query, columns, per_page, page=None, cursor=None,
+             descending=True):
+    """
+    Get a page of a query ordered by `columns`, e.g. (created_on, id).
+
+    With a cursor the page starts after the cursor's row with a row
+    comparison on the sort key, so any page is an index range scan.
+    Page numbers still work, with an OFFSET. Either way one extra row is
+    fetched to know if there is a next page, nothing is counted.
+
+    :param query: Query to page through, without an ORDER BY
+    :param columns: Sort key columns, ending with a unique one, mapped
+    attributes or the columns of the rows the query returns
+    :param per_page: Page size
+    :param page: Page number, used without a cursor
+    :param cursor: Cursor from a previous page
+    :param descending: Newest first when sorting by created_on
+    :return: Page
+    :raises InvalidCursor: When the cursor is malformed
+    """
+    key = tuple_(*columns)
+    direction = 'next'
+
+    if cursor:
+        direction, values = decode_cursor(cursor, columns)
+
+    # The previous page is read walking away from the cursor the other
+    # way, then put back in order
+    desc = descending == (direction == 'next')
+
+    if cursor:
+        query = query.filter(
+            key < tuple_(*values) if desc else key > tuple_(*values))
+
+    # The cursors are read off the rows, even if the query defers them
+    query = query.options(*[
+        undefer(column) for column in columns
+        if isinstance(column, InstrumentedAttribute)
+    ])
+    query = query.order_by(*[
+        column.desc() if desc else column.asc() for column in columns])
+
+    if not cursor and page and page > 1:
+        query = query.offset((page - 1) * per_page)
+
+    items = query.limit(per_page + 1).all()
+    more = len(items) > per_page
+    items = items[:per_page]
+
+    if direction == 'prev':
+        items.reverse()
+        has_next, has_prev = True, more
+    else:
+        has_next, has_prev = more, bool(cursor) or bool(page and page > 1)
+
+    def cursor_to(direction, item):
+        return encode_cursor(
+            direction, [getattr(item, column.key) for column in columns])
+
+    return Page(
+        items,
+        has_next,
+        has_prev,
+        next=cursor_to('next', items[-1]) if has_next and items else None,
+        prev=cursor_to('prev', items[0]) if has_prev and items else None,
+    )
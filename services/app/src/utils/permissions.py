@@ -0,0 +1,240 @@
+import time
+import threading
+
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from src import db
+from src.utils.cache import TTLCache
+
+
+class PermissionSets(object):
+    """
+    Effective permission ids per user, compiled once and cached as a
+    frozenset so a permission check is a single set lookup.
+
+    Every cached set is tagged with the version it was compiled at. Any
+    change to memberships or permissions bumps the version, which drops
+    all compiled sets at once, as a change to one group reaches all of
+    its members. The version is per process, other workers recompile
+    after PERMISSION_CACHE_TTL seconds at the latest.
+    """
+
+    def __init__(self, maxsize=10000, ttl=60):
+        self.version = 0
+        self._cache = TTLCache(maxsize, ttl)
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Configure the cache from the app config.
+
+        :param app: Flask app
+        """
+        self._cache.init_app(app, 'PERMISSION_CACHE')
+
+    def get(self, user_id, compile):
+        """
+        Get a user's permission ids, compiling them on a miss.
+
+        :param user_id: User id
+        :param compile: Callable returning the user's permission ids
+        :return: frozenset
+        """
+        entry = self._cache.get(user_id)
+
+        if entry is not None and entry[0] == self.version:
+            return entry[1]
+
+        version = self.version
+        perms = frozenset(compile())
+        self._cache.set(user_id, (version, perms))
+
+        return perms
+
+    def invalidate(self):
+        """Drop every compiled set."""
+        with self._lock:
+            self.version += 1
+
+    def invalidate_on_commit(self, session):
+        """
+        Drop every compiled set now, so the session sees its own change,
+        and again once the transaction commits, as a concurrent request
+        may have compiled the old committed permissions in between.
+
+        :param session: SQLAlchemy session making the change
+        """
+        self.invalidate()
+        session.info.setdefault('permission_changes', set()).add(self)
+
+
+class PermissionRegistry(object):
+    """
+    The permissions table held in memory, with code_name -> id and
+    id -> Permission lookups that don't touch the database.
+
+    The table is small and only changes when permissions are provisioned.
+    Changes made through this process reload it on commit. Changes made
+    elsewhere are caught by comparing the table's row count, highest id
+    and latest updated_on every PERMISSION_REGISTRY_INTERVAL seconds.
+    """
+
+    def __init__(self, interval=30):
+        self.app = None
+        self.interval = interval
+        self.loaded = False
+        self._by_id = {}
+        self._by_name = {}
+        self._fingerprint = None
+        self._checked_on = 0
+        self._stale = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def init_app(self, app):
+        """
+        Configure the registry from the app config and load it.
+
+        :param app: Flask app
+        """
+        self.app = app
+        self.interval = app.config.get(
+            'PERMISSION_REGISTRY_INTERVAL', self.interval)
+        self.loaded = False
+
+        try:
+            with db.get_engine(app).connect() as connection:
+                self.load(connection)
+        except Exception:
+            # e.g. before db_init, lookups fall back to queries until then
+            self._checked_on = time.monotonic()
+            app.logger.warning('Permission registry not loaded.')
+
+    def load(self, bind):
+        """
+        Load every permission.
+
+        :param bind: Connection to read with
+        """
+        from src.blueprints.admin.models import Permission
+
+        table = Permission.__table__
+        fingerprint = self._read_fingerprint(bind)
+        rows = bind.execute(select([
+            table.c.id, table.c.name, table.c.code_name, table.c.model_id
+        ])).fetchall()
+
+        with self._lock:
+            self._by_id = {row.id: dict(row) for row in rows}
+            self._by_name = {row.code_name: row.id for row in rows}
+            self._fingerprint = fingerprint
+            self._checked_on = time.monotonic()
+            self._stale = False
+            self.loaded = True
+
+    def invalidate(self):
+        """Reload the registry on the next lookup."""
+        self._stale = True
+
+    def invalidate_on_commit(self, session):
+        """
+        Reload the registry once the session's transaction commits.
+
+        :param session: SQLAlchemy session making the change
+        """
+        session.info.setdefault('permission_changes', set()).add(self)
+
+    def id_for(self, code_name):
+        """
+        Get a permission's id.
+
+        :param code_name: Permission code name
+        :return: int or None
+        """
+        self._maintain()
+        return self._by_name.get(code_name)
+
+    def ids_for(self, code_names):
+        """
+        Get the ids of several permissions, None for unknown ones.
+
+        :param code_names: Permission code names
+        :return: list
+        """
+        self._maintain()
+        return [self._by_name.get(name) for name in code_names]
+
+    def get(self, id):
+        """
+        Get a permission, merged into the current session without a load.
+
+        :param id: Permission id
+        :return: Permission instance or None
+        """
+        from src.blueprints.admin.models import Permission
+
+        self._maintain()
+        row = self._by_id.get(id)
+
+        if row is None:
+            return None
+
+        perm = Permission.__mapper__.class_manager.new_instance()
+
+        for key, value in row.items():
+            setattr(perm, key, value)
+
+        make_transient_to_detached(perm)
+        return db.session.merge(perm, load=False)
+
+    def _read_fingerprint(self, bind):
+        from src.blueprints.admin.models import Permission
+
+        table = Permission.__table__
+        return tuple(bind.execute(select([
+            func.count(table.c.id),
+            func.max(table.c.id),
+            func.max(table.c.updated_on)
+        ])).first())
+
+    def _maintain(self):
+        if self.app is None:
+            return
+
+        if not self._stale and \
+                time.monotonic() - self._checked_on < self.interval:
+            return
+
+        # Keep serving the loaded permissions when the check fails
+        try:
+            with db.get_engine(self.app).connect() as connection:
+                if self._stale or not self.loaded or \
+                        self._read_fingerprint(connection) != \
+                        self._fingerprint:
+                    self.load(connection)
+                else:
+                    self._checked_on = time.monotonic()
+        except Exception:
+            self._checked_on = time.monotonic()
+            self.app.logger.exception('Could not refresh permissions.')
+
+
+@event.listens_for(Session, 'after_commit')
+def apply_permission_changes(session):
+    for target in session.info.pop('permission_changes', ()):
+        target.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_permission_changes(session):
+    session.info.pop('permission_changes', None)
+
+
+# Compiled permission ids keyed by user id, see User.get_perm_ids
+permission_sets = PermissionSets()
+
+# Permissions by id and code name, see Permission.find_by_name
+permission_registry = PermissionRegistry()
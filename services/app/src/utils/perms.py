@@ -1,34 +1,93 @@
-import os
-from sqlalchemy import exc
+from datetime import datetime
 
-from src import db, create_app
+from sqlalchemy import literal, select, union_all
+from sqlalchemy.dialects.postgresql import insert
+
+from src import db
+from src.utils.permissions import permission_registry
 from src.blueprints.admin.models import Permission, Model
 
-app = create_app(os.getenv('APP_SETTINGS'))
 
+ACTIONS = ('add', 'delete', 'edit', 'view')
+
+# Models and tables with the actions that can be granted on them
+PERMISSIONS = {
+    'users': ACTIONS,
+    'profiles': ('edit', 'view'),
+    'groups': ACTIONS,
+    'group_members': ACTIONS,
+    'group_permissions': ACTIONS,
+    'user_permissions': ACTIONS,
+}
+
+
+def apply_manifest(manifest):
+    """
+    Create the models and permissions of a manifest that don't exist yet,
+    with a single INSERT statement committed in one transaction. Applying
+    a manifest again leaves existing rows alone.
+
+    :param manifest: dict of model or table names to their actions
+    :return: Number of permissions created
+    """
+    now = datetime.utcnow()
+    models = Model.__table__
+    perms = Permission.__table__
+    names = [name.lower() for name in manifest]
+
+    if not names:
+        return 0
+
+    created = insert(models).values([
+        {'name': name, 'created_on': now, 'updated_on': now}
+        for name in names
+    ]).on_conflict_do_nothing().returning(
+        models.c.id, models.c.name).cte('created_models')
+
+    # Rows inserted by the statement aren't visible to it, take the new
+    # ones from the CTE and the others from the table
+    known = union_all(
+        select([created.c.id, created.c.name]),
+        select([models.c.id, models.c.name]).where(models.c.name.in_(names))
+    ).cte('known_models')
 
-def set_model_perms(model, actions=[
-        'add', 'delete', 'edit', 'view'], is_table=False):
+    rows = []
 
+    for name, actions in manifest.items():
+        for action in actions:
+            perm = f'can {action} {name}'.lower()
+            rows.append(select([
+                literal(perm),
+                literal(Permission.set_code_name(perm)),
+                known.c.id,
+                literal(now),
+                literal(now)
+            ]).where(known.c.name == name.lower()))
+
+    statement = insert(perms).from_select(
+        ['name', 'code_name', 'model_id', 'created_on', 'updated_on'],
+        union_all(*rows)
+    ).on_conflict_do_nothing()
+
+    result = db.session.execute(statement)
+    permission_registry.invalidate_on_commit(db.session)
+    db.session.commit()
+
+    return result.rowcount
+
+
+def set_model_perms(model, actions=ACTIONS, is_table=False):
+    """
+    Create the permissions for one model or table.
+
+    :param model: Model class or association table
+    :param actions: Actions that can be granted on it
+    :param is_table: Whether model is a table
+    :return: Number of permissions created
+    """
     if is_table:
         name = str(model)
     else:
         name = f'{model.__name__}s'
 
-    try:
-        db.session.query(model)
-    except exc.InvalidRequestError:
-        return f"Error: {name} is not a valid sqlalchemy model or table."
-    else:
-        with app.app_context():
-            try:
-                mod = Model(name=name)
-                mod.save()
-
-                for action in actions:
-                    perm = Permission(name=f'can {action} {name}')
-                    perm.model_id = mod.id
-                    perm.save()
-            except (exc.IntegrityError, ValueError) as error:
-                db.session.rollback()
-                return f'Error: {error}'
+    return apply_manifest({name: actions})
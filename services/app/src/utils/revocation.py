@@ -0,0 +1,249 @@
+import os
+import time
+import atexit
+import struct
+import hashlib
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from src import db
+
+
+# Fingerprint followed by the expiry bucket it belongs to
+RECORD = struct.Struct('>QI')
+
+
+def utc_now():
+    """Current time on the database's clock, in UTC"""
+    return func.timezone('utc', func.now())
+
+
+def fingerprint(jti):
+    """
+    Shrink a token id to a 64 bit int, collisions only ever revoke an
+    extra token, about once in 2**64.
+
+    :param jti: Token id
+    :return: int
+    """
+    digest = hashlib.blake2b(jti.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+class RevocationList(object):
+    """
+    Ids (jti) of revoked tokens, kept until the tokens expire anyway.
+
+    Revoked ids are stored as 64 bit fingerprints in sets bucketed by the
+    token's expiry, `granularity` seconds per bucket. A token carries its
+    expiry, so a lookup is one set membership test, and whole buckets are
+    dropped once they expire. Memory is bounded by the logouts made
+    within one token lifetime, at roughly 60 bytes each.
+
+    The database backend, the default, shares revocations between
+    workers through the revoked_tokens table: every
+    REVOCATION_SYNC_INTERVAL seconds each worker pulls the rows created
+    since its last sync, and the REVOCATION_SYNC_OVERLAP seconds before
+    it, since rows don't commit in the order they're created. That
+    bounds how long other workers still accept a revoked token.
+
+    The local backend is for single process setups. It persists the list
+    to REVOCATION_LIST_PATH every REVOCATION_SYNC_INTERVAL seconds and at
+    exit, merged with what's already there. Without a path logouts are
+    forgotten on restart, which is only allowed in development and
+    testing.
+    """
+
+    def __init__(self, backend='database', path=None, interval=30,
+                 overlap=60, granularity=3600):
+        self.app = None
+        self.backend = backend
+        self.path = path
+        self.interval = interval
+        self.overlap = overlap
+        self.granularity = granularity
+        self._buckets = {}
+        self._synced_on = 0
+        # Database time of the last sync, None to pull every row
+        self._synced_until = None
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self._buckets.values())
+
+    def init_app(self, app):
+        """
+        Configure the list from the app config and load persisted entries.
+
+        :param app: Flask app
+        """
+        self.app = app
+        self.backend = app.config.get('REVOCATION_BACKEND', self.backend)
+        self.path = app.config.get('REVOCATION_LIST_PATH', self.path)
+        self.interval = app.config.get(
+            'REVOCATION_SYNC_INTERVAL', self.interval)
+        self.overlap = app.config.get(
+            'REVOCATION_SYNC_OVERLAP', self.overlap)
+
+        if self.backend == 'local' and not self.path and not (
+                app.testing or app.debug or app.env == 'development'):
+            raise RuntimeError(
+                'The local revocation backend needs REVOCATION_LIST_PATH.')
+
+        self.clear()
+
+        if self.backend == 'local' and self.path:
+            self.load()
+
+    def clear(self):
+        with self._lock:
+            self._buckets = {}
+            self._synced_on = 0
+            self._synced_until = None
+            self._dirty = False
+
+    def revoke(self, jti, exp):
+        """
+        Revoke a token. With the database backend the row is added to the
+        current session, the caller commits it.
+
+        :param jti: Token id
+        :param exp: Token expiry, seconds since the epoch
+        """
+        if self.backend == 'database':
+            from src.blueprints.auth.models import revoked_tokens
+
+            db.session.execute(revoked_tokens.insert().values(
+                jti=jti, expires_on=datetime.utcfromtimestamp(exp)))
+
+        with self._lock:
+            self._add(fingerprint(jti), int(exp) // self.granularity)
+            self._dirty = True
+
+        self._maintain()
+
+    def is_revoked(self, jti, exp):
+        """
+        Check if a token was revoked.
+
+        :param jti: Token id
+        :param exp: Token expiry, seconds since the epoch
+        :return: boolean
+        """
+        if not jti or not exp:
+            return False
+
+        self._maintain()
+        bucket = self._buckets.get(int(exp) // self.granularity, ())
+
+        return fingerprint(jti) in bucket
+
+    def load(self):
+        """Load the entries persisted at REVOCATION_LIST_PATH."""
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, 'rb') as f:
+            data = f.read()
+
+        with self._lock:
+            for fp, bucket in RECORD.iter_unpack(data):
+                self._add(fp, bucket)
+
+            self._evict()
+
+    def save(self):
+        """
+        Persist the entries to REVOCATION_LIST_PATH, atomically, keeping
+        the ones other processes saved there.
+        """
+        if self.backend != 'local' or not self.path:
+            return
+
+        self.load()
+
+        with self._lock:
+            records = b''.join(
+                RECORD.pack(fp, bucket)
+                for bucket, fps in self._buckets.items() for fp in fps)
+            self._dirty = False
+
+        tmp = f'{self.path}.tmp'
+
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(records)
+
+            os.replace(tmp, self.path)
+        except OSError:
+            self._dirty = True
+            raise
+
+    def sync(self, bind):
+        """
+        Pull revocations made by other workers and purge expired rows.
+        Rows are picked by creation time on the database's clock, going
+        back `overlap` seconds before the last sync for the ones that
+        committed late.
+
+        :param bind: Connection to use
+        """
+        from src.blueprints.auth.models import revoked_tokens
+
+        now = bind.execute(select([utc_now()])).scalar()
+        query = select([revoked_tokens.c.jti, revoked_tokens.c.expires_on])\
+            .where(revoked_tokens.c.expires_on > now)
+
+        if self._synced_until is not None:
+            query = query.where(revoked_tokens.c.created_on > (
+                self._synced_until - timedelta(seconds=self.overlap)))
+
+        rows = bind.execute(query).fetchall()
+
+        with self._lock:
+            for jti, expires_on in rows:
+                exp = (expires_on - datetime(1970, 1, 1)).total_seconds()
+                self._add(fingerprint(jti), int(exp) // self.granularity)
+
+            self._synced_until = now
+
+        bind.execute(revoked_tokens.delete().where(
+            revoked_tokens.c.expires_on <= now))
+
+    def _add(self, fp, bucket):
+        # Call with the lock held
+        self._buckets.setdefault(bucket, set()).add(fp)
+
+    def _evict(self):
+        # Call with the lock held, tokens in past buckets are expired
+        current = int(time.time()) // self.granularity
+
+        for bucket in [b for b in self._buckets if b < current]:
+            del self._buckets[bucket]
+
+    def _maintain(self):
+        if time.monotonic() - self._synced_on < self.interval:
+            return
+
+        with self._lock:
+            self._synced_on = time.monotonic()
+            self._evict()
+            dirty = self._dirty
+
+        # Keep serving the in-memory list when syncing fails
+        try:
+            if self.backend == 'database':
+                with db.get_engine(self.app).begin() as connection:
+                    self.sync(connection)
+            elif dirty:
+                self.save()
+        except Exception:
+            if self.app is not None:
+                self.app.logger.exception('Could not sync revoked tokens.')
+
+
+revocations = RevocationList()
+atexit.register(revocations.save)
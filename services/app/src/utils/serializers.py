@@ -0,0 +1,209 @@
+import threading
+
+from marshmallow import Schema, fields, missing
+from marshmallow.decorators import PRE_DUMP, POST_DUMP
+
+
+# Nested schemas deeper than this are left to marshmallow
+MAX_DEPTH = 8
+
+_binders = {}
+_lock = threading.Lock()
+
+
+def _key(schema):
+    """
+    Cache key of a schema: its class and the fields it dumps.
+
+    :param schema: Schema instance
+    :return: tuple
+    """
+    only = frozenset(schema.only) if schema.only is not None else None
+    return type(schema), only, frozenset(schema.exclude), \
+        frozenset(schema.load_only)
+
+
+def _supported(schema):
+    # Hooks and custom attribute getters need marshmallow's own dump
+    return type(schema).get_attribute is Schema.get_attribute and \
+        not schema._has_processors(PRE_DUMP) and \
+        not schema._has_processors(POST_DUMP)
+
+
+def _value(field, name):
+    """
+    Source of an expression serializing `v`, the value of a field read
+    off `obj`, or None when the field can't be inlined.
+
+    :param field: Marshmallow field
+    :param name: Name of the field's serializer in the generated code
+    :return: str or None
+    """
+    if type(field) is fields.Integer and not field.as_string:
+        return f'v if type(v) is int else ' \
+            f'(None if v is None else {name}(v, attr, obj))'
+    if isinstance(field, fields.String) and \
+            type(field)._serialize is fields.String._serialize:
+        return f'v if type(v) is str else ' \
+            f'(None if v is None else {name}(v, attr, obj))'
+    if type(field) is fields.DateTime and \
+            field.format in (None, 'iso', 'iso8601'):
+        return 'None if v is None else v.isoformat()'
+    if type(field) in (fields.Nested, fields.List):
+        return f'{name}(v, attr, obj)'
+
+    return None
+
+
+def _compile(schema):
+    """
+    Generate the dump function of a schema's fields: one straight line
+    per field reading the attribute and formatting it inline, instead of
+    marshmallow's per field dispatch. Fields it doesn't know how to
+    inline are serialized by marshmallow, as are objects with keys.
+
+    :param schema: Schema instance
+    :return: function binding the dump function to a schema instance
+    """
+    setup = []
+    body = []
+
+    for i, (name, field) in enumerate(schema.dump_fields.items()):
+        key = field.data_key if field.data_key is not None else name
+        attr = field.attribute or name
+        ref = f'fields[{name!r}]'
+
+        if type(field) is fields.Method:
+            method = field.serialize_method_name
+            setup.append(
+                f'f{i} = getattr(schema, {method!r})' if method
+                else f'f{i} = None')
+            body += [
+                f'v = f{i}(obj) if f{i} is not None else missing',
+                'if v is not missing:',
+                f'    out[{key!r}] = v',
+            ]
+            continue
+
+        expression = _value(field, f'f{i}')
+
+        if expression is None or '.' in attr or \
+                getattr(field, 'default', missing) is not missing:
+            setup.append(f'f{i} = {ref}.serialize')
+            body += [
+                f'v = f{i}({name!r}, obj, accessor=get_attribute)',
+                'if v is not missing:',
+                f'    out[{key!r}] = v',
+            ]
+            continue
+
+        if type(field) in (fields.Nested, fields.List):
+            setup.append(f'f{i} = _relation({ref}, depth)')
+        else:
+            setup.append(f'f{i} = {ref}._serialize')
+
+        body += [
+            f'v = getattr(obj, {attr!r}, missing)',
+            'if v is not missing:',
+            f'    attr = {name!r}',
+            f'    out[{key!r}] = {expression}',
+        ]
+
+    lines = ['def bind(schema, depth):', '    fields = schema.dump_fields']
+    lines += ['    get_attribute = schema.get_attribute']
+    lines += ['    dict_class = schema.dict_class']
+    lines += [f'    {line}' for line in setup]
+    lines += [
+        '    def dump(obj):',
+        "        if hasattr(obj, '__getitem__'):",
+        '            return schema._serialize(obj)',
+        '        out = dict_class()',
+    ]
+    lines += [f'        {line}' for line in body]
+    lines += ['        return out', '    return dump']
+
+    namespace = {'missing': missing, '_relation': _relation}
+    exec(compile('\n'.join(lines), f'<dump {type(schema).__name__}>',
+                 'exec'), namespace)
+
+    return namespace['bind']
+
+
+def _bind(schema, depth=0):
+    """
+    Get a schema instance's dump function, compiling it on first use.
+
+    :param schema: Schema instance
+    :param depth: Nesting depth, to stop at MAX_DEPTH
+    :return: function dumping a single object
+    """
+    if depth >= MAX_DEPTH or not _supported(schema):
+        return lambda obj: schema._serialize(obj)
+
+    key = _key(schema)
+    binder = _binders.get(key)
+
+    if binder is None:
+        with _lock:
+            binder = _binders.get(key)
+
+            if binder is None:
+                binder = _binders[key] = _compile(schema)
+
+    return binder(schema, depth)
+
+
+def _relation(field, depth):
+    """
+    Serializer of a Nested field, or of a List of them, through the
+    nested schema's dump function.
+
+    :param field: Nested or List field
+    :param depth: Nesting depth of the field's schema
+    :return: function of (value, attr, obj)
+    """
+    inner = field.inner if type(field) is fields.List else None
+    nested = inner if inner is not None else field
+
+    if type(nested) is not fields.Nested or inner is not None and \
+            nested.many:
+        return field._serialize
+
+    schema = nested.schema
+    dump = _bind(schema, depth + 1)
+    many = schema.many or nested.many
+
+    if not _supported(schema):
+        return field._serialize
+
+    def one(value):
+        if value is None:
+            return None
+        return [dump(item) for item in value] if many else dump(value)
+
+    if inner is not None:
+        return lambda value, attr, obj: None if value is None else [
+            one(item) for item in value]
+
+    return lambda value, attr, obj: one(value)
+
+
+def fast_dump(schema, obj, many=None):
+    """
+    Dump like schema.dump, through a function generated once per schema
+    class and set of fields and cached, see _compile. The output is the
+    same as marshmallow's.
+
+    :param schema: Schema instance, with its only, exclude and context
+    :param obj: Object, or objects with many
+    :param many: Defaults to the schema's
+    :return: dict, or list of dicts with many
+    """
+    many = schema.many if many is None else many
+
+    if obj is None or not _supported(schema):
+        return schema.dump(obj, many=many)
+
+    dump = _bind(schema)
+
+    return [dump(item) for item in obj] if many else dump(obj)
@@ -0,0 +1,339 @@
+import heapq
+from itertools import groupby
+
+from sqlalchemy import and_, exists, func, literal, select, true, \
+    union_all
+from sqlalchemy.dialects.postgresql import insert
+
+from src import db
+
+
+class Timeline(object):
+    """
+    Home timelines precomputed on write. Every new post is pushed to the
+    timelines of its author's followers, and of the author, so reading a
+    timeline is mostly an index range scan over the timelines table.
+
+    Posts by authors with more than `fanout_limit` followers are not
+    fanned out, one post would write that many rows. They are flagged
+    on the post and merged into their readers' timelines at read time
+    instead, whatever the author's follower count is by then.
+
+    Timelines keep about the newest `length` posts. Pushing a post
+    doesn't trim them, that would probe every reader's timeline on every
+    post, entries past `length` are trimmed in batches by trim_all
+    instead, see manage.py trim-timelines.
+    """
+
+    def __init__(self, length=800, fanout_limit=10000):
+        self.length = length
+        self.fanout_limit = fanout_limit
+
+    def init_app(self, app):
+        """
+        Configure the timelines from the app config.
+
+        :param app: Flask app
+        """
+        self.length = app.config.get('TIMELINE_LENGTH', self.length)
+        self.fanout_limit = app.config.get(
+            'TIMELINE_FANOUT_LIMIT', self.fanout_limit)
+
+    def fans_out(self, bind, author_id):
+        """
+        Check if a new post by an author should be fanned out.
+
+        :param bind: Connection or session to read with
+        :param author_id: Author's user id
+        :return: boolean
+        """
+        from src.blueprints.auth.models import User
+
+        users = User.__table__
+        count = bind.execute(select([users.c.follower_count]).where(
+            users.c.id == author_id)).scalar()
+
+        return (count or 0) <= self.fanout_limit
+
+    def push(self, bind, post_id, author_id, fan_out=True):
+        """
+        Push a new post to the timelines of its author and, when it's
+        fanned out, their followers.
+
+        :param bind: Connection or session to write with
+        :param post_id: Post id
+        :param author_id: Author's user id
+        :param fan_out: Whether to push to the followers
+        """
+        from src.blueprints.auth.models import followers
+        from src.blueprints.posts.models import timelines
+
+        readers = select([literal(author_id).label('user_id')])
+
+        if fan_out:
+            readers = union_all(readers, select([
+                followers.c.follower_id
+            ]).where(followers.c.followed_id == author_id))
+
+        bind.execute(insert(timelines).from_select(
+            ['user_id', 'post_id'],
+            select([readers.alias('readers').c.user_id, literal(post_id)])
+        ).on_conflict_do_nothing())
+
+    def trim(self, bind, users):
+        """
+        Drop the entries past the newest `length` of some timelines.
+
+        :param bind: Connection or session to write with
+        :param users: Select of the timelines' user ids, as user_id
+        :return: Number of entries dropped
+        """
+        from src.blueprints.posts.models import timelines
+
+        users = users.alias('users')
+
+        # Per user, the newest entry that no longer fits, found by walking
+        # the primary key index
+        cutoff = select([timelines.c.post_id]).where(
+            timelines.c.user_id == users.c.user_id
+        ).order_by(timelines.c.post_id.desc()).offset(
+            self.length).limit(1).lateral('cutoff')
+        bounds = select([users.c.user_id, cutoff.c.post_id]).select_from(
+            users.join(cutoff, true())).alias('bounds')
+
+        return bind.execute(timelines.delete().where(exists().where(and_(
+            bounds.c.user_id == timelines.c.user_id,
+            timelines.c.post_id <= bounds.c.post_id
+        )))).rowcount
+
+    def trim_all(self, chunk=1000, engine=None):
+        """
+        Trim every timeline, `chunk` users at a time, each chunk in a
+        transaction of its own so locks stay short.
+
+        :param chunk: Users per transaction
+        :param engine: Engine to use, defaults to the app's
+        :return: Number of entries dropped
+        """
+        from src.blueprints.auth.models import User
+
+        engine = engine or db.engine
+        users = User.__table__
+        last = engine.execute(select([func.max(users.c.id)])).scalar() or 0
+        dropped = 0
+
+        for start in range(0, last, chunk):
+            with engine.begin() as connection:
+                dropped += self.trim(connection, select([
+                    users.c.id.label('user_id')
+                ]).where(users.c.id > start).where(
+                    users.c.id <= start + chunk))
+
+        return dropped
+
+    def backfill(self, chunk=1000, engine=None):
+        """
+        Fill the timelines from the follows and posts made before they
+        existed, `chunk` users at a time, each chunk in a transaction of
+        its own. Posts of authors with more than `fanout_limit` followers
+        are flagged first, they're merged in at read time as usual.
+        Entries already there are kept, so it can be run again.
+
+        Run reconcile-counters before, the flags go by follower_count.
+
+        :param chunk: Users per transaction
+        :param engine: Engine to use, defaults to the app's
+        :return: Number of entries added
+        """
+        from src.blueprints.auth.models import User, followers
+        from src.blueprints.posts.models import Post, timelines
+
+        engine = engine or db.engine
+        users = User.__table__
+        posts = Post.__table__
+
+        with engine.begin() as connection:
+            connection.execute(posts.update().where(
+                posts.c.fanned_out.is_(True)
+            ).where(posts.c.user_id.in_(select([users.c.id]).where(
+                users.c.follower_count > self.fanout_limit))
+            ).values(fanned_out=False, updated_on=posts.c.updated_on))
+
+        last = engine.execute(select([func.max(users.c.id)])).scalar() or 0
+        added = 0
+
+        for start in range(0, last, chunk):
+            # The users' own posts and the fanned out posts of the users
+            # they follow, the newest `length` of them per user
+            entries = union_all(
+                select([
+                    posts.c.user_id.label('user_id'),
+                    posts.c.id.label('post_id')
+                ]).where(posts.c.user_id > start).where(
+                    posts.c.user_id <= start + chunk),
+                select([followers.c.follower_id, posts.c.id]).select_from(
+                    followers.join(
+                        posts, posts.c.user_id == followers.c.followed_id)
+                ).where(followers.c.follower_id > start).where(
+                    followers.c.follower_id <= start + chunk
+                ).where(posts.c.fanned_out.is_(True))
+            ).alias('entries')
+            ranked = select([
+                entries.c.user_id,
+                entries.c.post_id,
+                func.row_number().over(
+                    partition_by=entries.c.user_id,
+                    order_by=entries.c.post_id.desc()
+                ).label('rank')
+            ]).alias('ranked')
+
+            with engine.begin() as connection:
+                added += connection.execute(insert(timelines).from_select(
+                    ['user_id', 'post_id'],
+                    select([ranked.c.user_id, ranked.c.post_id]).where(
+                        ranked.c.rank <= self.length)
+                ).on_conflict_do_nothing()).rowcount
+
+        return added
+
+    def follow(self, bind, user_id, followed_id):
+        """
+        Backfill a timeline with the recent fanned out posts of a newly
+        followed user.
+
+        :param bind: Connection or session to write with
+        :param user_id: Follower's user id
+        :param followed_id: Followed user's id
+        """
+        from src.blueprints.posts.models import Post, timelines
+
+        posts = Post.__table__
+        recent = select([literal(user_id), posts.c.id]).where(
+            posts.c.user_id == followed_id
+        ).where(posts.c.fanned_out.is_(True)).order_by(
+            posts.c.id.desc()).limit(self.length)
+
+        bind.execute(insert(timelines).from_select(
+            ['user_id', 'post_id'], recent).on_conflict_do_nothing())
+        self.trim(bind, select([literal(user_id).label('user_id')]))
+
+    def unfollow(self, bind, user_id, followed_id):
+        """
+        Drop an unfollowed user's posts from a timeline.
+
+        :param bind: Connection or session to write with
+        :param user_id: Follower's user id
+        :param followed_id: Unfollowed user's id
+        """
+        from src.blueprints.posts.models import Post, timelines
+
+        posts = Post.__table__
+        bind.execute(timelines.delete().where(
+            timelines.c.user_id == user_id
+        ).where(timelines.c.post_id.in_(
+            select([posts.c.id]).where(posts.c.user_id == followed_id))))
+
+    def read(self, user_id, limit, before=None, after=None, offset=0,
+             options=()):
+        """
+        Read a page of a timeline, newest posts first.
+
+        The precomputed entries and the recent posts of each followed
+        author that weren't fanned out are already sorted by id, a heap
+        merge of these streams gives the page. Pages after `after` are
+        read oldest first, walking back up the timeline, then reversed.
+
+        :param user_id: Timeline's user id
+        :param limit: Page size
+        :param before: Only posts older than this post id, the cursor
+        :param after: Only posts newer than this post id, the cursor
+        :param offset: Posts to skip, for page numbers
+        :param options: Loader options for the posts, see eager_options
+        :return: Tuple of the posts and whether there are more past them
+        """
+        from src.blueprints.posts.models import Post
+
+        wanted = offset + limit + 1
+        streams = [self._entries(user_id, wanted, before, after)]
+        streams.extend(self._pulled(user_id, wanted, before, after))
+
+        ids = []
+
+        for post_id in heapq.merge(*streams, reverse=after is None):
+            if not ids or ids[-1] != post_id:
+                ids.append(post_id)
+
+            if len(ids) == wanted:
+                break
+
+        ids = ids[offset:]
+        page = ids[:limit]
+
+        if after is not None:
+            page.reverse()
+
+        posts = {
+            post.id: post
+            for post in Post.query.options(*options).filter(
+                Post.id.in_(page)).all()
+        } if page else {}
+
+        return [posts[id] for id in page if id in posts], len(ids) > limit
+
+    def _entries(self, user_id, limit, before, after):
+        from src.blueprints.posts.models import timelines
+
+        query = select([timelines.c.post_id]).where(
+            timelines.c.user_id == user_id)
+
+        if before is not None:
+            query = query.where(timelines.c.post_id < before)
+
+        if after is not None:
+            query = query.where(timelines.c.post_id > after)
+
+        order = timelines.c.post_id.asc() if after is not None \
+            else timelines.c.post_id.desc()
+        rows = db.session.execute(query.order_by(order).limit(limit))
+        return [row[0] for row in rows]
+
+    def _pulled(self, user_id, limit, before, after):
+        # Recent posts of followed authors that weren't fanned out, one
+        # stream per author, fetched with a single lateral query that
+        # probes a partial index once per followed author
+        from src.blueprints.auth.models import followers
+        from src.blueprints.posts.models import Post
+
+        posts = Post.__table__
+
+        authors = select([followers.c.followed_id.label('id')]).where(
+            followers.c.follower_id == user_id).alias('authors')
+
+        recent = select([posts.c.id]).where(
+            posts.c.user_id == authors.c.id).where(
+            posts.c.fanned_out.is_(False))
+
+        if before is not None:
+            recent = recent.where(posts.c.id < before)
+
+        if after is not None:
+            recent = recent.where(posts.c.id > after)
+
+        def order(column):
+            return column.asc() if after is not None else column.desc()
+
+        recent = recent.order_by(order(posts.c.id)).limit(
+            limit).lateral('recent')
+
+        rows = db.session.execute(
+            select([authors.c.id, recent.c.id]).select_from(
+                authors.join(recent, true())
+            ).order_by(authors.c.id, order(recent.c.id)))
+
+        return [
+            [row[1] for row in stream]
+            for _, stream in groupby(rows, key=lambda row: row[0])
+        ]
+
+
+timeline = Timeline()
@@ -42,7 +42,7 @@ export const PostActions = ({
         onClick={() => updateLikes(post.id)}
       >
         <Typography variant="body2" style={{ marginRight: 4 }}>
-          {post.likes.length}{" "}
+          {post.like_count}{" "}
         </Typography>
         {isLiked(post.id) ? (
           <FavoriteOutlinedIcon color="primary" />
@@ -85,7 +85,7 @@ export default function LikesTab() {
       setLikes(
         likes.map((post) =>
           post.id === response.data.id
-            ? { ...post, likes: response.data.likes }
+            ? { ...post, like_count: response.data.like_count }
             : post
         )
       );
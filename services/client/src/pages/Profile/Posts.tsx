@@ -84,7 +84,7 @@ export default function PostTab() {
       setPosts(
         posts.map((post) =>
           post.id === response.data.id
-            ? { ...post, likes: response.data.likes }
+            ? { ...post, like_count: response.data.like_count }
             : post
         )
       );
@@ -87,7 +87,7 @@ export default function RepliesTab() {
       setComments(
         comments.map((comment) =>
           comment.id === response.data.id
-            ? { ...comment, likes: response.data.likes }
+            ? { ...comment, like_count: response.data.like_count }
             : comment
         )
       );
@@ -51,7 +51,7 @@ const postSlice = createSlice({
     updateLikesSuccess(state, { payload }: PayloadAction<Comment>) {
       state.comments = state.comments.map((comment) =>
         comment.id === payload.id
-          ? { ...comment, likes: payload.likes }
+          ? { ...comment, like_count: payload.like_count }
           : comment
       );
       state.loading = false;
@@ -54,7 +54,7 @@ const postSlice = createSlice({
     },
     updateLikesSuccess(state, { payload }: PayloadAction<Post>) {
       state.posts = state.posts.map((post) =>
-        post.id === payload.id ? { ...post, likes: payload.likes } : post
+        post.id === payload.id ? { ...post, like_count: payload.like_count } : post
       );
       state.loading = false;
     },
@@ -39,6 +39,7 @@ export type User = {
   sign_in_count: number;
   followers: { id: number }[];
   followed: { id: number }[];
+  followed_by_me?: boolean;
 };
 
 export type Followers = {
@@ -57,10 +58,15 @@ export type Post = {
   created_on: Date;
   updated_on: Date;
   author: User;
-  likes: { id: number }[];
+  like_count: number;
+  liked_by_me?: boolean;
+  recent_likers?: User[];
   comments: { id: number }[];
 };
 
 export type Comment = {
-  replies: Comment[];
+  comment_id: number | null;
+  depth: number;
+  reply_count: number;
+  replies?: Comment[];
 } & Post;